@@ -1,8 +1,10 @@
 from flask import Blueprint, request, jsonify
-import hashlib
 import jwt
 import os
-from services.database import cursor, conn
+from services.database import cursor, conn, prepared
+from services.listing_versions import USERS, bump_listing_version
+from services.replicas import leave_replica, use_replica
+from utils.auth import hash_password
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 
@@ -27,14 +29,22 @@ def login():
             return jsonify({"error": "Email and password are required"}), 400
 
         # Hash the password for comparison
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
+        hashed_password = hash_password(password)
 
         # Check if user exists and password matches
+        use_replica(USERS)
         cursor.execute(
-            "SELECT id, name, email FROM users WHERE email = %s AND password_hash = %s",
+            prepared("SELECT id, name, email FROM users WHERE email = %s AND password_hash = %s"),
             (email, hashed_password)
         )
         user = cursor.fetchone()
+        if not user and leave_replica():
+            # The account may be too new for the replica; ask the primary
+            cursor.execute(
+                prepared("SELECT id, name, email FROM users WHERE email = %s AND password_hash = %s"),
+                (email, hashed_password)
+            )
+            user = cursor.fetchone()
 
         if user:
             # Generate JWT token
@@ -73,23 +83,24 @@ def register():
             return jsonify({"error": "Name, email and password are required"}), 400
 
         # Check if user already exists
-        cursor.execute("SELECT id FROM users WHERE email = %s", (email,))
+        cursor.execute(prepared("SELECT id FROM users WHERE email = %s"), (email,))
         existing_user = cursor.fetchone()
 
         if existing_user:
             return jsonify({"error": "User with this email already exists"}), 400
 
         # Hash the password
-        hashed_password = hashlib.sha256(password.encode()).hexdigest()
+        hashed_password = hash_password(password)
 
         # Create new user
         cursor.execute(
-            "INSERT INTO users (name, email, password_hash) VALUES (%s, %s, %s) RETURNING id",
+            prepared("INSERT INTO users (name, email, password_hash) VALUES (%s, %s, %s) RETURNING id"),
             (name, email, hashed_password)
         )
         result = cursor.fetchone()
         if result:
             user_id = result['id']
+            bump_listing_version(USERS)
             conn.commit()
             return jsonify({
                 "success": True,
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
-from services.s3 import s3_client, BUCKET_NAME
+from services.blobs import is_blob_key, record_released, release_objects
 from services.database import cursor, conn
+from services.usage import record_usage
+from services.listing_versions import FILES, bump_listing_version
 
 delete_bp = Blueprint('delete', __name__)
 
@@ -14,8 +16,16 @@ def delete_file():
         if not file_key:
             return jsonify({"error": "File key is required"}), 400
 
-        s3_client.delete_object(Bucket=BUCKET_NAME, Key=file_key)
-        cursor.execute("DELETE FROM user_files WHERE s3_key = %s", (file_key,))
+        cursor.execute(
+            "DELETE FROM user_files WHERE s3_key = %s RETURNING user_id, file_size", (file_key,))
+        rows = cursor.fetchall()
+        # A shared blob loses one reference per removed row; any other key
+        # is deleted outright as before, by the outbox after the commit
+        release_objects([file_key] * len(rows) if is_blob_key(file_key) else [file_key])
+        record_released([(file_key, row['file_size']) for row in rows])
+        for row in rows:
+            record_usage(row['user_id'], files=-1, files_bytes=-(row['file_size'] or 0))
+            bump_listing_version(FILES, row['user_id'])
         conn.commit()
 
         return jsonify({"success": True, "message": "File deleted successfully"})
@@ -1,27 +1,30 @@
-from flask import Blueprint, send_file
-from services.s3 import s3_client, BUCKET_NAME
-from io import BytesIO
+from flask import Blueprint, request
+from services.storage import storage, ObjectNotFound
+from services.object_cache import get_object
+from services.storage_codec import send_stored_object
 
 download_bp = Blueprint('download', __name__)
 
 
+@download_bp.route('/signed/<path:file_key>', methods=['GET'])
+def download_signed(file_key):
+    """Serve a URL from storage.presign() on the local backend"""
+    if not hasattr(storage, 'verify_presigned') or not storage.verify_presigned(
+            file_key, request.args.get('expires'), request.args.get('signature')):
+        return {"error": "Invalid or expired link"}, 403
+    return download_file(file_key)
+
+
 @download_bp.route('/<path:file_key>', methods=['GET'])
 def download_file(file_key):
     try:
-        response = s3_client.get_object(Bucket=BUCKET_NAME, Key=file_key)
-
-        # Create BytesIO object for Flask send_file
-        file_data = BytesIO(response['Body'].read())
-        file_data.seek(0)
+        stored = get_object(file_key)
 
         name_splitter = file_key.split('-', 1)
         filename = name_splitter[1] if len(name_splitter) > 1 else file_key
 
-        return send_file(
-            file_data,
-            mimetype=response['ContentType'],
-            as_attachment=True,
-            download_name=filename
-        )
+        return send_stored_object(stored, filename)
+    except ObjectNotFound:
+        return {"error": "File not found"}, 404
     except Exception as e:
         return {"error": str(e)}, 500
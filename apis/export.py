@@ -0,0 +1,139 @@
+from flask import Blueprint, Response, current_app, jsonify, request
+import csv
+import io
+import jwt
+import os
+from datetime import datetime
+from dotenv import load_dotenv
+from services.database import stream_query
+from utils.auth import is_admin_request
+
+# Load environment variables
+load_dotenv()
+
+# Get secret key from environment variable
+SECRET_KEY = os.getenv(
+    "JWT_SECRET_KEY", "your-secret-key-here-change-this-in-production")
+
+export_bp = Blueprint('export', __name__)
+
+NDJSON = 'application/x-ndjson'
+CSV = 'text/csv'
+
+# Per export: columns, the query for one user (newest first, like the
+# listings) and the query for every user (by id, so exports can be diffed)
+EXPORTS = {
+    'files': (
+        ['id', 'user_id', 'filename', 's3_key', 'file_size', 'file_type', 'source_type', 'created_at'],
+        "SELECT id, user_id, filename, s3_key, file_size, file_type, source_type, created_at FROM user_files WHERE user_id = %s ORDER BY created_at DESC",
+        "SELECT id, user_id, filename, s3_key, file_size, file_type, source_type, created_at FROM user_files ORDER BY id",
+    ),
+    'logos': (
+        ['id', 'user_id', 'filename', 's3_key', 'logo_url', 'file_size', 'content_type', 'created_at'],
+        "SELECT id, user_id, filename, s3_key, logo_url, file_size, content_type, created_at FROM user_logos WHERE user_id = %s ORDER BY created_at DESC",
+        "SELECT id, user_id, filename, s3_key, logo_url, file_size, content_type, created_at FROM user_logos ORDER BY id",
+    ),
+}
+
+
+def get_user_from_token(token):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        return payload.get('user_id')
+    except jwt.ExpiredSignatureError:
+        return None
+    except jwt.InvalidTokenError:
+        return None
+
+
+def requesting_user_id():
+    """User id from the Bearer token, or None"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    return get_user_from_token(auth_header.split(' ')[1])
+
+
+def _ndjson_chunks(batches, dumps):
+    try:
+        for rows in batches:
+            yield ''.join(dumps(row) + '\n' for row in rows)
+    finally:
+        batches.close()
+
+
+def _csv_chunks(columns, batches):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    try:
+        writer.writerow(columns)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        for rows in batches:
+            writer.writerows(row.values() for row in rows)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    finally:
+        batches.close()
+
+
+def _with_first(first, batches):
+    """The batches again, starting with one already taken from them (None if there were none)"""
+    try:
+        if first is not None:
+            yield first
+            yield from batches
+    finally:
+        batches.close()
+
+
+@export_bp.route('/<kind>', methods=['GET'])
+def export(kind):
+    """Stream every file or logo row of the user as NDJSON (default) or CSV (?format=csv)
+
+    Admins (X-Admin-Token) export the whole tenant, or one user with
+    ?user_id=. Rows are read through a server-side cursor and sent as they
+    arrive, so memory stays flat however many there are.
+    """
+    try:
+        if kind not in EXPORTS:
+            return jsonify({"error": f"Unknown export '{kind}'. Use one of: {', '.join(EXPORTS)}"}), 404
+        columns, user_query, tenant_query = EXPORTS[kind]
+
+        if is_admin_request():
+            user_id = request.args.get('user_id')
+            if user_id is not None:
+                try:
+                    user_id = int(user_id)
+                except ValueError:
+                    return jsonify({"error": "user_id must be an integer"}), 400
+        else:
+            user_id = requesting_user_id()
+            if not user_id:
+                return jsonify({"error": "Authentication required"}), 401
+
+        export_format = request.args.get('format') or (
+            'csv' if request.accept_mimetypes.best == CSV else 'ndjson')
+        if export_format not in ('ndjson', 'csv'):
+            return jsonify({"error": "format must be ndjson or csv"}), 400
+
+        if user_id is None:
+            rows = stream_query(tenant_query)
+        else:
+            rows = stream_query(user_query, (user_id,))
+        # The first batch is read here, so failures still get an error response
+        batches = _with_first(next(rows, None), rows)
+        if export_format == 'csv':
+            response = Response(_csv_chunks(columns, batches), mimetype=CSV)
+        else:
+            response = Response(_ndjson_chunks(batches, current_app.json.dumps), mimetype=NDJSON)
+        # Frees the connection even if the body is never iterated
+        response.call_on_close(rows.close)
+        response.headers['Content-Disposition'] = (
+            f"attachment; filename={kind}-{datetime.utcnow():%Y%m%d}.{export_format}")
+        return response
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
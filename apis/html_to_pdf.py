@@ -4,7 +4,9 @@ from bs4 import BeautifulSoup
 import io
 import os
 import subprocess
+import time
 from datetime import datetime
+from services.metrics import observe_pdf_render
 
 html_to_pdf_bp = Blueprint('html_to_pdf', __name__)
 
@@ -40,6 +42,15 @@ def get_wkhtmltopdf_config():
     except Exception:
         return None
 
+
+def render_pdf(html, options, config, endpoint):
+    """Render HTML to PDF bytes with wkhtmltopdf, recording render metrics"""
+    start = time.perf_counter()
+    pdf_data = pdfkit.from_string(html, False, options=options, configuration=config)
+    observe_pdf_render(endpoint, time.perf_counter() - start, pdf_data)
+    return pdf_data
+
+
 # PDF generation options
 PDF_OPTIONS = {
     'page-size': 'A4',
@@ -142,7 +153,7 @@ def convert_html_to_pdf():
                     "error": "wkhtmltopdf not found. Please ensure wkhtmltopdf is installed and accessible."
                 }), 500
                 
-            pdf_data = pdfkit.from_string(cleaned_html, False, options=pdf_options, configuration=config)
+            pdf_data = render_pdf(cleaned_html, pdf_options, config, 'convert')
         except Exception as e:
             return jsonify({"error": f"PDF generation failed: {str(e)}"}), 500
 
@@ -187,7 +198,7 @@ def preview_pdf():
                     "error": "wkhtmltopdf not found. Please ensure wkhtmltopdf is installed and accessible."
                 }), 500
                 
-            pdf_data = pdfkit.from_string(cleaned_html, False, options=pdf_options, configuration=config)
+            pdf_data = render_pdf(cleaned_html, pdf_options, config, 'preview')
         except Exception as e:
             return jsonify({"error": f"PDF generation failed: {str(e)}"}), 500
 
@@ -1,9 +1,14 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify
 import jwt
-import uuid
 import os
-from services.database import cursor, conn
-from services.s3 import s3_client, BUCKET_NAME
+from services.database import cursor, conn, prepared
+from services.storage import storage
+from services.blobs import LOGOS_PREFIX, record_released, release_objects, store_blob
+from services.listing_versions import (
+    LOGOS, bump_listing_version, listing_etag, not_modified_response, with_etag)
+from services.listing_cache import listing_cache
+from services.replicas import use_replica
+from services.usage import QuotaExceeded, check_quota, record_usage
 from datetime import datetime
 from dotenv import load_dotenv
 import base64
@@ -81,42 +86,37 @@ def upload_logo():
 
         if file_size > 5 * 1024 * 1024:  # 5MB limit
             return jsonify({"error": "File size too large. Maximum 5MB allowed"}), 400
+        check_quota(user_id, file_size)
 
         # Prepare file data
         file_name = file.filename
-        file_content = file.read()
         content_type = file.content_type
 
-        # Generate unique filename and S3 key (logos/user<id>/ structure)
-        unique_filename = f"{uuid.uuid4()}-{file_name}"
-        s3_key = f"logos/user{user_id}/{unique_filename}"
-
-        # Upload to S3 (no ACL since bucket owner enforced is set)
-        print(f"Uploading to S3: Bucket={BUCKET_NAME}, Key={s3_key}")
+        # Stored by content hash under logos/; the user's own duplicate only gains
+        # a reference. Logos are served straight from their public URL, so never compressed
         try:
-            s3_client.put_object(
-                Bucket=BUCKET_NAME,
-                Key=s3_key,
-                Body=file_content,
-                ContentType=content_type
-            )
-            print(f"✅ Successfully uploaded to S3: {s3_key}")
+            s3_key, file_size, uploaded = store_blob(file.stream, content_type, user_id, LOGOS_PREFIX,
+                                                     compress=False)
+            if uploaded:
+                print(f"✅ Successfully uploaded to storage: {s3_key}")
         except Exception as s3_error:
-            print(f"❌ S3 upload error: {s3_error}")
+            print(f"❌ Storage upload error: {s3_error}")
             raise s3_error
 
         # Generate public URL (works because bucket policy allows public read for logos/*)
-        logo_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{s3_key}"
+        logo_url = storage.public_url(s3_key)
 
         # Save logo metadata to database
         cursor.execute(
-            "INSERT INTO user_logos (user_id, filename, s3_key, logo_url, file_size, content_type, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id",
+            prepared("INSERT INTO user_logos (user_id, filename, s3_key, logo_url, file_size, content_type, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id"),
             (user_id, file_name, s3_key, logo_url,
              file_size, content_type, datetime.now())
         )
         result = cursor.fetchone()
 
         if result:
+            record_usage(user_id, logos=1, logos_bytes=file_size)
+            bump_listing_version(LOGOS, user_id)
             conn.commit()
             return jsonify({
                 "success": True,
@@ -129,6 +129,9 @@ def upload_logo():
         else:
             return jsonify({"error": "Failed to save logo metadata"}), 500
 
+    except QuotaExceeded as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
@@ -149,20 +152,29 @@ def get_logos():
         if not user_id:
             return jsonify({"error": "Invalid or expired token"}), 401
 
-        # Get user's logos from database
-        cursor.execute(
-            """SELECT id, filename, s3_key, logo_url, file_size, content_type, created_at 
-               FROM user_logos 
-               WHERE user_id = %s 
-               ORDER BY created_at DESC""",
-            (user_id,)
-        )
-        logos = cursor.fetchall()
+        use_replica(LOGOS, user_id)
+        etag = listing_etag(LOGOS, user_id)
+        not_modified = not_modified_response(etag)
+        if not_modified:
+            return not_modified
+
+        body = listing_cache.get(LOGOS, user_id, etag)
+        if body is None:
+            # Get user's logos from database
+            cursor.execute(
+                prepared("""SELECT id, filename, s3_key, logo_url, file_size, content_type, created_at 
+                   FROM user_logos 
+                   WHERE user_id = %s 
+                   ORDER BY created_at DESC"""),
+                (user_id,)
+            )
+            logos = cursor.fetchall()
+            body = listing_cache.put(LOGOS, user_id, etag, jsonify({
+                "success": True,
+                "logos": logos
+            }).get_data())
 
-        return jsonify({
-            "success": True,
-            "logos": [dict(logo) for logo in logos]
-        })
+        return with_etag(Response(body, mimetype='application/json'), etag)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -185,7 +197,7 @@ def delete_logo(logo_id):
 
         # Check if logo exists and belongs to user
         cursor.execute(
-            "SELECT s3_key FROM user_logos WHERE id = %s AND user_id = %s",
+            "SELECT s3_key, file_size FROM user_logos WHERE id = %s AND user_id = %s",
             (logo_id, user_id)
         )
         logo = cursor.fetchone()
@@ -193,12 +205,8 @@ def delete_logo(logo_id):
         if not logo:
             return jsonify({"error": "Logo not found or access denied"}), 404
 
-        # Delete from S3
-        try:
-            s3_client.delete_object(Bucket=BUCKET_NAME, Key=logo['s3_key'])
-        except Exception as s3_error:
-            print(f"Error deleting from S3: {s3_error}")
-            # Continue with database deletion even if S3 deletion fails
+        # Drop the reference; the object goes after the commit once nothing else uses it
+        release_objects([logo['s3_key']])
 
         # Delete from database
         cursor.execute(
@@ -207,6 +215,9 @@ def delete_logo(logo_id):
         )
 
         if cursor.rowcount > 0:
+            record_usage(user_id, logos=-1, logos_bytes=-(logo['file_size'] or 0))
+            record_released([(logo['s3_key'], logo['file_size'])])
+            bump_listing_version(LOGOS, user_id)
             conn.commit()
             return jsonify({
                 "success": True,
@@ -235,22 +246,33 @@ def get_logo_details(logo_id):
         if not user_id:
             return jsonify({"error": "Invalid or expired token"}), 401
 
-        # Get logo details
-        cursor.execute(
-            """SELECT id, filename, s3_key, logo_url, file_size, content_type, created_at 
-               FROM user_logos 
-               WHERE id = %s AND user_id = %s""",
-            (logo_id, user_id)
-        )
-        logo = cursor.fetchone()
+        use_replica(LOGOS, user_id)
+
+        # Any change to the user's logos invalidates their details too
+        etag = f"{listing_etag(LOGOS, user_id)}-{logo_id}"
+        not_modified = not_modified_response(etag)
+        if not_modified:
+            return not_modified
+
+        body = listing_cache.get(LOGOS, user_id, etag, logo_id)
+        if body is None:
+            # Get logo details
+            cursor.execute(
+                prepared("""SELECT id, filename, s3_key, logo_url, file_size, content_type, created_at 
+                   FROM user_logos 
+                   WHERE id = %s AND user_id = %s"""),
+                (logo_id, user_id)
+            )
+            logo = cursor.fetchone()
 
-        if logo:
-            return jsonify({
+            if not logo:
+                return jsonify({"error": "Logo not found or access denied"}), 404
+            body = listing_cache.put(LOGOS, user_id, etag, jsonify({
                 "success": True,
-                "logo": dict(logo)
-            })
-        else:
-            return jsonify({"error": "Logo not found or access denied"}), 404
+                "logo": logo
+            }).get_data(), logo_id)
+
+        return with_etag(Response(body, mimetype='application/json'), etag)
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -275,31 +297,26 @@ def test_upload():
         test_content = b"test logo content"
         test_key = f"logos/user{user_id}/test-logo.txt"
 
-        print(f"Testing S3 upload: Bucket={BUCKET_NAME}, Key={test_key}")
+        print(f"Testing storage upload: Backend={storage.name}, Key={test_key}")
 
         try:
-            s3_client.put_object(
-                Bucket=BUCKET_NAME,
-                Key=test_key,
-                Body=test_content,
-                ContentType='text/plain'
-            )
+            storage.put(test_key, test_content, 'text/plain')
 
             # Clean up test file
-            s3_client.delete_object(Bucket=BUCKET_NAME, Key=test_key)
+            storage.delete([test_key])
 
             return jsonify({
                 "success": True,
-                "message": "S3 upload test successful",
-                "bucket": BUCKET_NAME,
+                "message": "Storage upload test successful",
+                "backend": storage.name,
                 "test_key": test_key
             })
 
-        except Exception as s3_error:
+        except Exception as storage_error:
             return jsonify({
                 "success": False,
-                "error": f"S3 error: {str(s3_error)}",
-                "bucket": BUCKET_NAME,
+                "error": f"Storage error: {str(storage_error)}",
+                "backend": storage.name,
                 "test_key": test_key
             }), 500
 
@@ -0,0 +1,11 @@
+from flask import Blueprint, Response
+from services.metrics import render_metrics
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.route('/', methods=['GET'])
+def get_metrics():
+    """Expose process metrics in Prometheus text format"""
+    return Response(render_metrics(),
+                    mimetype='text/plain; version=0.0.4; charset=utf-8')
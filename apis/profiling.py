@@ -0,0 +1,57 @@
+from flask import Blueprint, request, jsonify, send_file
+from services import profiling
+from utils.auth import is_admin_request
+
+profiling_bp = Blueprint('profiling', __name__)
+
+
+@profiling_bp.before_request
+def require_admin():
+    if not is_admin_request():
+        return jsonify({"error": "Admin access required"}), 403
+
+
+@profiling_bp.route('/', methods=['GET'])
+def list_profiles():
+    """List stored profile captures, newest first"""
+    return jsonify({
+        "captures": profiling.list_captures(),
+        "armed": profiling.armed_state(),
+        "profile_dir": profiling.PROFILE_DIR
+    })
+
+
+@profiling_bp.route('/<capture_id>/<path:artifact>', methods=['GET'])
+def get_profile(capture_id, artifact):
+    """Download one artifact (pstats, txt, collapsed, allocations.txt, json) of a capture"""
+    path = profiling.capture_path(capture_id, artifact)
+    if not path:
+        return jsonify({"error": "Capture not found"}), 404
+    return send_file(path, as_attachment=True,
+                     download_name=f"{capture_id}.{artifact}")
+
+
+@profiling_bp.route('/arm', methods=['POST'])
+def arm_profiler():
+    """Profile the next N requests whose path starts with path_prefix"""
+    data = request.get_json() or {}
+    path_prefix = data.get('path_prefix')
+    if not path_prefix:
+        return jsonify({"error": "path_prefix is required"}), 400
+
+    mode = data.get('mode', 'cprofile')
+    if mode not in profiling.PROFILE_MODES:
+        return jsonify({"error": f"mode must be one of {', '.join(profiling.PROFILE_MODES)}"}), 400
+
+    try:
+        count = int(data.get('count', 1))
+    except (TypeError, ValueError):
+        return jsonify({"error": "count must be an integer"}), 400
+
+    return jsonify({"success": True, "armed": profiling.arm(path_prefix, count, mode)})
+
+
+@profiling_bp.route('/arm', methods=['DELETE'])
+def disarm_profiler():
+    """Cancel any pending armed captures"""
+    return jsonify({"success": True, "armed": profiling.disarm()})
@@ -1,12 +1,28 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, Response, request, jsonify
 import jwt
-import uuid
 import os
-from services.database import cursor, conn
-from services.s3 import s3_client, BUCKET_NAME
+import hashlib
+from collections import deque
+from itertools import islice
+from services.database import cursor, conn, prepared
+from services.outbox import cancel
+from services.storage import storage, storage_executor
+from services.listing_versions import (
+    FILES, bump_listing_version, bump_storage_version, listing_etag, not_modified_response, with_etag)
+from services.listing_cache import listing_cache
+from services.replicas import use_replica
+from services.zip_stream import ZipMember, ZipStream, unique_member_names
+from services.blobs import (
+    FILES_PREFIX, acquire_blobs, blob_key, guard_uploads, hash_stream, put_blob, record_released, release_objects,
+    store_blob)
+from services.object_cache import get_object
+from services.purge import purge_files
+from services.search import PDF, detect_file_type, queue_extraction, search_files, upload_text
+from services.usage import QuotaExceeded, check_quota, record_usage
+from services.storage_codec import object_chunks, send_stored_object, storage_encoding
 from datetime import datetime
 from dotenv import load_dotenv
-from io import BytesIO
+from psycopg2.extras import execute_values
 
 # Load environment variables
 load_dotenv()
@@ -15,6 +31,21 @@ load_dotenv()
 SECRET_KEY = os.getenv(
     "JWT_SECRET_KEY", "your-secret-key-here-change-this-in-production")
 
+# Maximum number of parts accepted by /upload-batch in one request
+BATCH_UPLOAD_MAX_FILES = int(os.getenv("BATCH_UPLOAD_MAX_FILES", "500"))
+# Maximum number of ids accepted by /delete-batch in one request
+BATCH_DELETE_MAX_FILES = int(os.getenv("BATCH_DELETE_MAX_FILES", "10000"))
+# Results per /search page
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+SEARCH_MAX_OFFSET = 1000
+
+# /download-zip limits: files per archive, objects fetched ahead of the one
+# being streamed, and how much of each fetched-ahead object is buffered
+ZIP_DOWNLOAD_MAX_FILES = int(os.getenv("ZIP_DOWNLOAD_MAX_FILES", "5000"))
+ZIP_READ_AHEAD = int(os.getenv("ZIP_READ_AHEAD", "4"))
+ZIP_PREFETCH_BYTES = int(os.getenv("ZIP_PREFETCH_BYTES", str(1024 * 1024)))
+
 server_files_bp = Blueprint('server_files', __name__)
 
 
@@ -42,25 +73,67 @@ def get_files():
         if not user_id:
             return jsonify({"error": "Invalid or expired token"}), 401
 
-        # Get user's files from database
-        cursor.execute(
-            "SELECT id, filename, s3_key, created_at, file_size FROM user_files WHERE user_id = %s ORDER BY created_at DESC",
-            (user_id,)
-        )
-        files = cursor.fetchall()
+        use_replica(FILES, user_id)
+
+        # Unchanged listings are answered from the version counter alone
+        etag = listing_etag(FILES, user_id)
+        not_modified = not_modified_response(etag)
+        if not_modified:
+            return not_modified
+
+        # Other clients of the same user reuse the serialized listing until the next write
+        body = listing_cache.get(FILES, user_id, etag)
+        if body is None:
+            cursor.execute(
+                prepared("SELECT id, filename, s3_key, created_at, file_size FROM user_files WHERE user_id = %s ORDER BY created_at DESC"),
+                (user_id,)
+            )
+            files = cursor.fetchall()
+            body = listing_cache.put(FILES, user_id, etag, jsonify({"files": files}).get_data())
+
+        return with_etag(Response(body, mimetype='application/json'), etag)
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@server_files_bp.route('/search', methods=['GET'])
+def search():
+    """Rank the user's files against ?q= (web search syntax: "phrases", or, -word)
+
+    Matches filenames and extracted document text; each hit carries a
+    snippet with matches in <mark> tags. Page with limit and offset.
+    """
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({"error": "Authentication required"}), 401
 
-        # Convert to JSON serializable format
-        files_list = []
-        for file in files:
-            files_list.append({
-                'id': file['id'],
-                'filename': file['filename'],
-                's3_key': file['s3_key'],
-                'created_at': file['created_at'].isoformat() if file['created_at'] else None,
-                'file_size': file['file_size']
-            })
+        token = auth_header.split(' ')[1]
+        user_id = get_user_from_token(token)
 
-        return jsonify({"files": files_list})
+        if not user_id:
+            return jsonify({"error": "Invalid or expired token"}), 401
+
+        query = (request.args.get('q') or '').strip()
+        if not query:
+            return jsonify({"error": "q is required"}), 400
+        try:
+            limit = int(request.args.get('limit', SEARCH_DEFAULT_LIMIT))
+            offset = int(request.args.get('offset', 0))
+        except ValueError:
+            return jsonify({"error": "limit and offset must be integers"}), 400
+        if not 1 <= limit <= SEARCH_MAX_LIMIT:
+            return jsonify({"error": f"limit must be between 1 and {SEARCH_MAX_LIMIT}"}), 400
+        if not 0 <= offset <= SEARCH_MAX_OFFSET:
+            return jsonify({"error": f"offset must be between 0 and {SEARCH_MAX_OFFSET}"}), 400
+
+        hits, more = search_files(user_id, query, limit, offset)
+        return jsonify({
+            "query": query,
+            "results": hits,
+            "next_offset": offset + limit if more else None
+        })
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -88,29 +161,32 @@ def upload_file():
             return jsonify({"error": "No file selected"}), 400
 
         file_name = file.filename
-        file_content = file.read()
         content_type = file.content_type
+        file_type = detect_file_type(file_name, content_type)
 
-        # Generate unique filename
-        unique_filename = f"{uuid.uuid4()}-{file_name}"
-        s3_key = f"user_{user_id}/{unique_filename}"
+        # Nothing goes to storage for an upload over quota
+        file.stream.seek(0, 2)
+        check_quota(user_id, file.stream.tell())
+        file.stream.seek(0)
 
-        # Upload to S3
-        s3_client.put_object(
-            Bucket=BUCKET_NAME,
-            Key=s3_key,
-            Body=file_content,
-            ContentType=content_type
-        )
+        # HTML and plain text are indexed straight away, PDFs in the background
+        text = upload_text(file.stream, file_type)
+
+        # Stored by content hash; the user's own duplicate only gains a reference
+        s3_key, file_size, uploaded = store_blob(file.stream, content_type, user_id)
 
         # Save to database
         cursor.execute(
-            "INSERT INTO user_files (user_id, filename, s3_key, file_size, created_at) VALUES (%s, %s, %s, %s, %s) RETURNING id",
-            (user_id, file_name, s3_key, len(file_content), datetime.utcnow())
+            prepared("INSERT INTO user_files (user_id, filename, s3_key, file_size, file_type, original_content, content_type, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s) RETURNING id"),
+            (user_id, file_name, s3_key, file_size, file_type, text or '', content_type, datetime.utcnow())
         )
         result = cursor.fetchone()
         if result:
             file_id = result['id']
+            if file_type == PDF:
+                queue_extraction([file_id])
+            record_usage(user_id, files=1, files_bytes=file_size)
+            bump_listing_version(FILES, user_id)
             conn.commit()
         else:
             return jsonify({"error": "Failed to save file metadata"}), 500
@@ -119,9 +195,145 @@ def upload_file():
             "success": True,
             "message": "File uploaded successfully",
             "file_id": file_id,
-            "filename": file_name
+            "filename": file_name,
+            "deduplicated": not uploaded
         })
 
+    except QuotaExceeded as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 413
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
+def _prepare_part(file, file_type):
+    """Hash a part and read its text; runs on the shared storage executor"""
+    sha256, file_size = hash_stream(file.stream)
+    return sha256, file_size, upload_text(file.stream, file_type)
+
+
+@server_files_bp.route('/upload-batch', methods=['POST'])
+def upload_batch():
+    """Upload many files in one request.
+
+    Parts named 'files' (or 'file') are hashed (and HTML or text parts
+    read for search) concurrently on the shared bounded executor, references to their content blobs are taken with one
+    statement, and only content not stored yet is uploaded (again
+    concurrently). All metadata rows are then inserted with a single
+    statement in the same transaction. Returns a result per part.
+    """
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({"error": "Authentication required"}), 401
+
+        token = auth_header.split(' ')[1]
+        user_id = get_user_from_token(token)
+
+        if not user_id:
+            return jsonify({"error": "Invalid or expired token"}), 401
+
+        files = request.files.getlist('files') + request.files.getlist('file')
+        if not files:
+            return jsonify({"error": "No files provided"}), 400
+        if len(files) > BATCH_UPLOAD_MAX_FILES:
+            return jsonify({"error": f"Too many files. Maximum {BATCH_UPLOAD_MAX_FILES} per request"}), 400
+
+        results = []
+        pending = []
+        for index, file in enumerate(files):
+            if not file.filename:
+                results.append({"index": index, "success": False, "error": "No file selected"})
+                continue
+            file_type = detect_file_type(file.filename, file.content_type)
+            pending.append((index, file, file_type, storage_executor.submit(_prepare_part, file, file_type)))
+
+        hashed = []
+        texts = {}
+        for index, file, file_type, future in pending:
+            sha256, file_size, text = future.result()
+            hashed.append((index, file, blob_key(FILES_PREFIX, user_id, sha256), sha256, file_size))
+            texts[index] = (file_type, text or '')
+
+        # The whole batch is refused before any upload if it doesn't fit
+        check_quota(user_id, sum(file_size for _, _, _, _, file_size in hashed))
+
+        if hashed:
+            # Cleans up after this batch if its rows never commit
+            guard = guard_uploads(sorted({(s3_key, sha256, file_size) for _, _, s3_key, sha256, file_size in hashed}))
+            try:
+                encodings = {s3_key: storage_encoding(file.content_type, file_size)
+                             for _, file, s3_key, _, file_size in hashed}
+                to_upload = acquire_blobs([(s3_key, sha256, file_size, file.content_type, encodings[s3_key])
+                                           for _, file, s3_key, sha256, file_size in hashed])
+                # One PUT per new blob, whichever part carries it first
+                bodies = {}
+                for _, file, s3_key, _, file_size in hashed:
+                    if s3_key in to_upload:
+                        bodies.setdefault(s3_key, (file, file_size))
+                puts = {s3_key: storage_executor.submit(put_blob, s3_key, file.stream, file.content_type,
+                                                   file_size, encodings[s3_key])
+                        for s3_key, (file, file_size) in bodies.items()}
+                failed = {}
+                for s3_key, future in puts.items():
+                    try:
+                        future.result()
+                    except Exception as e:
+                        failed[s3_key] = e
+                if len(failed) < len(puts):
+                    bump_storage_version()
+
+                stored = []
+                for index, file, s3_key, _, file_size in hashed:
+                    if s3_key in failed:
+                        results.append({"index": index, "filename": file.filename, "success": False,
+                                        "error": f"Upload failed: {failed[s3_key]}"})
+                    else:
+                        stored.append((index, file.filename, s3_key, file_size, file.content_type,
+                                       bodies.get(s3_key, (None,))[0] is file))
+                if failed:
+                    release_objects([s3_key for _, _, s3_key, _, _ in hashed if s3_key in failed])
+                cancel(guard)
+
+                if stored:
+                    now = datetime.utcnow()
+                    rows = execute_values(
+                        cursor,
+                        "INSERT INTO user_files (user_id, filename, s3_key, file_size, file_type, original_content, content_type, created_at) VALUES %s RETURNING id",
+                        [(user_id, filename, s3_key, file_size) + texts[index] + (content_type, now)
+                         for index, filename, s3_key, file_size, content_type, _ in stored],
+                        fetch=True
+                    )
+                    queue_extraction([row['id'] for (index, _, _, _, _, _), row in zip(stored, rows)
+                                      if texts[index][0] == PDF])
+                    record_usage(user_id, files=len(stored),
+                                 files_bytes=sum(file_size for _, _, _, file_size, _, _ in stored))
+                    bump_listing_version(FILES, user_id)
+                conn.commit()
+            except Exception:
+                # Objects uploaded for new blobs are left to the guard
+                conn.rollback()
+                raise
+
+            # execute_values returns rows in VALUES order
+            for (index, filename, _, file_size, _, uploaded), row in zip(stored, rows if stored else []):
+                results.append({"index": index, "filename": filename, "success": True,
+                                "file_id": row['id'], "file_size": file_size,
+                                "deduplicated": not uploaded})
+
+        results.sort(key=lambda result: result["index"])
+        succeeded = sum(1 for result in results if result["success"])
+        return jsonify({
+            "success": succeeded == len(results),
+            "uploaded": succeeded,
+            "failed": len(results) - succeeded,
+            "results": results
+        }), 200 if succeeded else 500
+
+    except QuotaExceeded as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
@@ -143,7 +355,7 @@ def download_file(file_id):
 
         # Get file info from database
         cursor.execute(
-            "SELECT filename, s3_key FROM user_files WHERE id = %s AND user_id = %s",
+            prepared("SELECT filename, s3_key, content_type FROM user_files WHERE id = %s AND user_id = %s"),
             (file_id, user_id)
         )
         file_info = cursor.fetchone()
@@ -151,20 +363,176 @@ def download_file(file_id):
         if not file_info:
             return jsonify({"error": "File not found"}), 404
 
-        # Download from S3
-        response = s3_client.get_object(
-            Bucket=BUCKET_NAME, Key=file_info['s3_key'])
+        # Compressed documents are passed through or decoded
+        return send_stored_object(get_object(file_info['s3_key']), file_info['filename'],
+                                  file_info['content_type'])
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
-        # Create BytesIO object for Flask send_file
-        file_data = BytesIO(response['Body'].read())
-        file_data.seek(0)
 
-        return send_file(
-            file_data,
-            mimetype=response['ContentType'],
-            as_attachment=True,
-            download_name=file_info['filename']
+def _fetch_zip_member(s3_key):
+    """Open an object and buffer its head; runs on the shared storage executor.
+
+    Small files arrive whole while earlier members are still streaming;
+    larger ones keep their connection open and stream the rest on demand.
+    Compressed documents are decoded, so the archive holds the originals.
+    """
+    chunks = object_chunks(storage.get(s3_key))
+    head = []
+    buffered = 0
+    for chunk in chunks:
+        head.append(chunk)
+        buffered += len(chunk)
+        if buffered >= ZIP_PREFETCH_BYTES:
+            break
+    return head, chunks
+
+
+def _discard_zip_member(future):
+    if not future.cancelled() and future.exception() is None:
+        future.result()[1].close()
+
+
+def _zip_member_chunks(head, chunks):
+    try:
+        yield from head
+        yield from chunks
+    finally:
+        chunks.close()
+
+
+def _zip_contents(s3_keys):
+    """Yield each object's chunks in order with up to ZIP_READ_AHEAD fetches in flight"""
+    keys = iter(s3_keys)
+    pending = deque(storage_executor.submit(_fetch_zip_member, key)
+                    for key in islice(keys, ZIP_READ_AHEAD))
+    try:
+        while pending:
+            head, body = pending.popleft().result()
+            pending.extend(storage_executor.submit(_fetch_zip_member, key) for key in islice(keys, 1))
+            yield _zip_member_chunks(head, body)
+    finally:
+        # Client went away or the range ended early; drop what was fetched ahead
+        for future in pending:
+            if not future.cancel():
+                future.add_done_callback(_discard_zip_member)
+
+
+def _object_size(s3_key):
+    """Original size of an object, before any stored compression"""
+    try:
+        return storage.head(s3_key).original_size
+    except Exception:
+        return None
+
+
+@server_files_bp.route('/download-zip', methods=['GET', 'POST'])
+def download_zip():
+    """Download many files as one ZIP archive streamed on the fly.
+
+    Select files with ids (GET ?ids=1,2,3 or POST {"file_ids": [...]}) or
+    with everything created since a date (?since=2024-01-01). Objects are
+    fetched from storage concurrently with bounded read-ahead, so memory stays
+    flat however many files are included. The archive has a fixed layout
+    for a given selection, so Range requests (with If-Range) can resume an
+    interrupted download.
+    """
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({"error": "Authentication required"}), 401
+
+        token = auth_header.split(' ')[1]
+        user_id = get_user_from_token(token)
+
+        if not user_id:
+            return jsonify({"error": "Invalid or expired token"}), 401
+
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+            file_ids = data.get('file_ids')
+            since = data.get('since')
+        else:
+            ids = request.args.get('ids')
+            file_ids = ids.split(',') if ids else None
+            since = request.args.get('since')
+
+        if file_ids:
+            try:
+                file_ids = sorted({int(file_id) for file_id in file_ids})
+            except (TypeError, ValueError):
+                return jsonify({"error": "file_ids must be integers"}), 400
+            if len(file_ids) > ZIP_DOWNLOAD_MAX_FILES:
+                return jsonify({"error": f"Too many files. Maximum {ZIP_DOWNLOAD_MAX_FILES} per archive"}), 400
+            cursor.execute(
+                "SELECT id, filename, s3_key, file_size, created_at FROM user_files WHERE user_id = %s AND id = ANY(%s)",
+                (user_id, file_ids)
+            )
+        elif since:
+            try:
+                since = datetime.fromisoformat(since)
+            except (TypeError, ValueError):
+                return jsonify({"error": "since must be an ISO 8601 date"}), 400
+            cursor.execute(
+                "SELECT id, filename, s3_key, file_size, created_at FROM user_files WHERE user_id = %s AND created_at >= %s ORDER BY created_at DESC LIMIT %s",
+                (user_id, since, ZIP_DOWNLOAD_MAX_FILES + 1)
+            )
+        else:
+            return jsonify({"error": "Provide file_ids or since"}), 400
+
+        files = cursor.fetchall()
+        if len(files) > ZIP_DOWNLOAD_MAX_FILES:
+            return jsonify({"error": f"Too many files. Maximum {ZIP_DOWNLOAD_MAX_FILES} per archive; use a later since date"}), 400
+        if not files:
+            return jsonify({"error": "No files found"}), 404
+
+        # Rows from older uploads may lack a size; ask storage and leave out
+        # anything whose object is gone
+        unsized = [f for f in files if f['file_size'] is None]
+        for f, size in zip(unsized, storage_executor.map(_object_size, [f['s3_key'] for f in unsized])):
+            f['file_size'] = size
+        skipped = [f['id'] for f in files if f['file_size'] is None]
+        files = [f for f in files if f['file_size'] is not None]
+
+        # Oldest first, with id breaking ties, so a selection always maps
+        # to the same bytes and Range resumes line up
+        files.sort(key=lambda f: (f['created_at'] or datetime.min, f['id']))
+        names = unique_member_names([f['filename'] for f in files])
+        archive = ZipStream([ZipMember(name, f['file_size'], f['created_at'])
+                             for name, f in zip(names, files)])
+
+        digest = hashlib.sha256()
+        for name, f in zip(names, files):
+            digest.update(f"{f['id']}\0{f['s3_key']}\0{f['file_size']}\0{f['created_at']}\0{name}\n".encode())
+        etag = f"zip-{digest.hexdigest()[:32]}"
+
+        start, stop, status = 0, archive.size, 200
+        if_range = request.headers.get('If-Range')
+        if request.range and len(request.range.ranges) == 1 and (
+                not if_range or request.if_range.etag == etag):
+            byte_range = request.range.range_for_length(archive.size)
+            if byte_range is None:
+                return Response(status=416, headers={'Content-Range': f"bytes */{archive.size}"})
+            start, stop = byte_range
+            status = 206
+
+        response = Response(
+            archive.generate(_zip_contents([f['s3_key'] for f in files]), start, stop),
+            status=status,
+            mimetype='application/zip',
+            direct_passthrough=True
         )
+        response.content_length = stop - start
+        response.set_etag(etag)
+        response.accept_ranges = 'bytes'
+        if status == 206:
+            response.content_range = f"bytes {start}-{stop - 1}/{archive.size}"
+        response.headers['Content-Disposition'] = (
+            f"attachment; filename=invoices-{datetime.utcnow():%Y%m%d}.zip")
+        if skipped:
+            response.headers['X-Archive-Skipped'] = ','.join(str(file_id) for file_id in skipped)
+        return response
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
@@ -186,7 +554,7 @@ def delete_file(file_id):
 
         # Get file info from database
         cursor.execute(
-            "SELECT s3_key FROM user_files WHERE id = %s AND user_id = %s",
+            prepared("SELECT s3_key, file_size FROM user_files WHERE id = %s AND user_id = %s"),
             (file_id, user_id)
         )
         file_info = cursor.fetchone()
@@ -194,13 +562,15 @@ def delete_file(file_id):
         if not file_info:
             return jsonify({"error": "File not found"}), 404
 
-        # Delete from S3
-        s3_client.delete_object(
-            Bucket=BUCKET_NAME, Key=file_info['s3_key'])
+        # Drop the reference; the object goes after the commit once nothing else uses it
+        release_objects([file_info['s3_key']])
 
         # Delete from database
         cursor.execute(
-            "DELETE FROM user_files WHERE id = %s AND user_id = %s", (file_id, user_id))
+            prepared("DELETE FROM user_files WHERE id = %s AND user_id = %s"), (file_id, user_id))
+        record_usage(user_id, files=-1, files_bytes=-(file_info['file_size'] or 0))
+        record_released([(file_info['s3_key'], file_info['file_size'])])
+        bump_listing_version(FILES, user_id)
         conn.commit()
 
         return jsonify({"success": True, "message": "File deleted successfully"})
@@ -208,3 +578,41 @@ def delete_file(file_id):
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
+
+
+@server_files_bp.route('/delete-batch', methods=['POST'])
+def delete_batch():
+    """Delete many files in one transaction; the outbox deletes their objects in batched storage calls"""
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({"error": "Authentication required"}), 401
+
+        token = auth_header.split(' ')[1]
+        user_id = get_user_from_token(token)
+
+        if not user_id:
+            return jsonify({"error": "Invalid or expired token"}), 401
+
+        data = request.get_json(silent=True) or {}
+        try:
+            file_ids = {int(file_id) for file_id in data.get('file_ids') or []}
+        except (TypeError, ValueError):
+            return jsonify({"error": "file_ids must be integers"}), 400
+        if not file_ids:
+            return jsonify({"error": "Provide file_ids"}), 400
+        if len(file_ids) > BATCH_DELETE_MAX_FILES:
+            return jsonify({"error": f"Too many files. Maximum {BATCH_DELETE_MAX_FILES} per request"}), 400
+
+        deleted_ids, objects_pending = purge_files(user_id, file_ids)
+
+        return jsonify({
+            "success": True,
+            "deleted": deleted_ids,
+            "not_found": sorted(file_ids.difference(deleted_ids)),
+            "objects_pending": objects_pending
+        })
+
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
@@ -1,23 +1,225 @@
-from flask import Blueprint, jsonify
-from services.s3 import s3_client, BUCKET_NAME
+import hashlib
+import json
+import jwt
+import os
+from itertools import islice
+from flask import Blueprint, Response, current_app, jsonify, request
+from dotenv import load_dotenv
+from services.database import release_connection
+from services.storage import storage
+from services.listing_versions import STORAGE, get_storage_version, not_modified_response, with_etag
+from services.storage_summary import content_sizes, summarize
+from services.usage import STORAGE_QUOTA_BYTES, get_usage
+from utils.auth import is_admin_request
+
+# Load environment variables
+load_dotenv()
+
+# Get secret key from environment variable
+SECRET_KEY = os.getenv(
+    "JWT_SECRET_KEY", "your-secret-key-here-change-this-in-production")
 
 storage_bp = Blueprint('storage', __name__)
 
+NDJSON = 'application/x-ndjson'
+LIST_DEFAULT_LIMIT = 1000
+LIST_MAX_LIMIT = 1000
+SUMMARY_MAX_DEPTH = 5
+
+
+def get_user_from_token(token):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        return payload.get('user_id')
+    except jwt.ExpiredSignatureError:
+        return None
+    except jwt.InvalidTokenError:
+        return None
+
+
+def requesting_user_id():
+    """User id from the Bearer token, or None"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    return get_user_from_token(auth_header.split(' ')[1])
+
+
+def _listing_user_id():
+    """User from ?user_id=, or None for the whole bucket.
+
+    Raises ValueError if it isn't an integer and PermissionError unless
+    the request is the admin's or that user's own.
+    """
+    user_id = request.args.get('user_id')
+    if user_id is None:
+        return None
+    user_id = int(user_id)
+    if not is_admin_request() and requesting_user_id() != user_id:
+        raise PermissionError
+    return user_id
+
+
+def _listing_prefixes(prefix, user_id):
+    """Prefixes to read, in key order: ?prefix= itself, or under both of the user's directories"""
+    if user_id is None:
+        return [prefix]
+    # Everything a user stores, content blobs included (services/blobs.py),
+    # is under the user's logo directory or file directory
+    return [f"logos/user{user_id}/{prefix}", f"user_{user_id}/{prefix}"]
+
+
+def _list(prefixes, start_after, page_size=1000):
+    """Objects under prefixes after start_after, in key order"""
+    for prefix in prefixes:
+        yield from storage.list(prefix, start_after, page_size)
+
+
+def _storage_etag(version, **query):
+    """ETag for one view of the bucket: its version plus the normalized query that selected it"""
+    digest = hashlib.sha1(json.dumps(query, sort_keys=True).encode()).hexdigest()[:16]
+    return f"{STORAGE}-{version}-{digest}"
+
+
+def _listing_item(item, sizes):
+    return {
+        'key': item['key'],
+        'size': sizes[item['key']],
+        'last_modified': item['last_modified'].strftime('%Y-%m-%d %H:%M:%S')
+    }
+
 
 @storage_bp.route('/', methods=['GET'])
 def get_storage_info():
+    """One page of the bucket listing, or every object as NDJSON for full scans
+
+    Pages follow key order: pass the previous page's next_start_after as
+    start_after to continue. Sizes are content sizes, before storage
+    compression, as in the summary.
+    """
     try:
-        response = s3_client.list_objects_v2(Bucket=BUCKET_NAME)
-        files = []
-        if 'Contents' in response:
-            files = [
-                {
-                    'key': item['Key'],
-                    'size': item['Size'],
-                    'last_modified': item['LastModified'].strftime('%Y-%m-%d %H:%M:%S')
-                }
-                for item in response['Contents']
-            ]
-        return jsonify({"files": files})
+        try:
+            prefix = request.args.get('prefix', '')
+            user_id = _listing_user_id()
+            limit = int(request.args.get('limit', LIST_DEFAULT_LIMIT))
+        except ValueError:
+            return jsonify({"error": "user_id and limit must be integers"}), 400
+        except PermissionError:
+            return jsonify({"error": "Only admins may list another user's storage"}), 403
+        if not 1 <= limit <= LIST_MAX_LIMIT:
+            return jsonify({"error": f"limit must be between 1 and {LIST_MAX_LIMIT}"}), 400
+        start_after = request.args.get('start_after') or None
+        stream = request.args.get('format') == 'ndjson' or request.accept_mimetypes.best == NDJSON
+
+        prefixes = _listing_prefixes(prefix, user_id)
+        etag = _storage_etag(get_storage_version(), prefixes=prefixes, start_after=start_after,
+                             limit=None if stream else limit, format='ndjson' if stream else 'json')
+        not_modified = not_modified_response(etag)
+        if not_modified:
+            return not_modified
+
+        if stream:
+            dumps = current_app.json.dumps
+
+            def generate():
+                # Runs after the request's connection is released, so it
+                # releases the one its size lookups take
+                try:
+                    items = _list(prefixes, start_after)
+                    while True:
+                        page = list(islice(items, LIST_MAX_LIMIT))
+                        if not page:
+                            return
+                        sizes = content_sizes(page)
+                        yield ''.join(dumps(_listing_item(item, sizes)) + '\n' for item in page)
+                finally:
+                    release_connection()
+
+            return with_etag(Response(generate(), mimetype=NDJSON), etag)
+
+        items = []
+        truncated = False
+        for item in _list(prefixes, start_after, page_size=limit + 1):
+            if len(items) == limit:
+                truncated = True
+                break
+            items.append(item)
+        sizes = content_sizes(items) if items else {}
+        files = [_listing_item(item, sizes) for item in items]
+
+        return with_etag(jsonify({
+            "files": files,
+            "prefix": prefix,
+            "user_id": user_id,
+            "truncated": truncated,
+            "next_start_after": files[-1]['key'] if truncated else None
+        }), etag)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@storage_bp.route('/summary', methods=['GET'])
+def get_storage_summary():
+    """Object count and total size per prefix, depth levels below ?prefix=
+
+    Read from the per-directory counters (services/storage_summary.py), so
+    ?prefix= is a directory: empty or ending with '/'.
+    """
+    try:
+        try:
+            prefix = request.args.get('prefix', '')
+            user_id = _listing_user_id()
+            depth = int(request.args.get('depth', 1))
+        except ValueError:
+            return jsonify({"error": "user_id and depth must be integers"}), 400
+        except PermissionError:
+            return jsonify({"error": "Only admins may summarize another user's storage"}), 403
+        if not 1 <= depth <= SUMMARY_MAX_DEPTH:
+            return jsonify({"error": f"depth must be between 1 and {SUMMARY_MAX_DEPTH}"}), 400
+        if prefix and not prefix.endswith('/'):
+            return jsonify({"error": "prefix must be empty or end with '/'"}), 400
+
+        summary = {"prefix": prefix, "user_id": user_id, "depth": depth,
+                   **summarize(_listing_prefixes(prefix, user_id), depth)}
+        # Counters change when writes commit, after the storage version has
+        # moved, so the ETag comes from the summary itself (which includes
+        # the query it was asked for)
+        digest = hashlib.sha1(json.dumps(summary, sort_keys=True).encode()).hexdigest()[:16]
+        etag = f"{STORAGE}-summary-{digest}"
+        not_modified = not_modified_response(etag)
+        if not_modified:
+            return not_modified
+        return with_etag(jsonify(summary), etag)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@storage_bp.route('/usage', methods=['GET'])
+def get_storage_usage():
+    """Files, logos and bytes stored by the requesting user, against their quota
+
+    Admins may ask for any user with ?user_id=.
+    """
+    try:
+        if is_admin_request() and request.args.get('user_id') is not None:
+            try:
+                user_id = int(request.args['user_id'])
+            except ValueError:
+                return jsonify({"error": "user_id must be an integer"}), 400
+        else:
+            user_id = requesting_user_id()
+            if not user_id:
+                return jsonify({"error": "Authentication required"}), 401
+
+        usage = get_usage(user_id)
+        total_bytes = usage['files_bytes'] + usage['logos_bytes']
+        return jsonify({
+            "user_id": user_id,
+            "files": {"count": usage['files_count'], "bytes": usage['files_bytes']},
+            "logos": {"count": usage['logos_count'], "bytes": usage['logos_bytes']},
+            "total_bytes": total_bytes,
+            "quota_bytes": STORAGE_QUOTA_BYTES or None,
+            "remaining_bytes": max(0, STORAGE_QUOTA_BYTES - total_bytes) if STORAGE_QUOTA_BYTES else None
+        })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
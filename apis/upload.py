@@ -1,7 +1,12 @@
 from flask import Blueprint, request, jsonify
 import uuid
-from services.s3 import s3_client, BUCKET_NAME
+from services.storage import storage
 from services.database import cursor, conn
+from services.blobs import guard_uploads
+from services.outbox import cancel
+from services.usage import QuotaExceeded, check_quota, record_usage
+from services.listing_versions import FILES, bump_listing_version, bump_storage_version
+from services.storage_summary import record_objects
 
 upload_bp = Blueprint('upload', __name__)
 
@@ -24,18 +29,21 @@ def upload_file():
         user_id = request.form.get('user_id')
 
         if user_id:
-            s3_client.put_object(
-                Bucket=BUCKET_NAME,
-                Key=f"user_{user_id}/{unique_filename}",
-                Body=file_content,
-                ContentType=content_type
-            )
+            check_quota(user_id, len(file_content))
+            s3_key = f"user_{user_id}/{unique_filename}"
+            guard = guard_uploads(s3_keys=[s3_key])
+            storage.put(s3_key, file_content, content_type)
+            bump_storage_version()
+            cancel(guard)
             cursor.execute(
-                "INSERT INTO user_files (user_id, filename, s3_key) VALUES (%s, %s, %s) RETURNING id",
-                (user_id, file_name, unique_filename)
+                "INSERT INTO user_files (user_id, filename, s3_key, file_size, content_type) VALUES (%s, %s, %s, %s, %s) RETURNING id",
+                (user_id, file_name, unique_filename, len(file_content), content_type)
             )
             result = cursor.fetchone()
             if result:
+                record_usage(user_id, files=1, files_bytes=len(file_content))
+                record_objects([(s3_key, len(file_content))])
+                bump_listing_version(FILES, user_id)
                 conn.commit()
                 return jsonify({"success": True, "file_id": result['id'], "filename": file_name})
             else:
@@ -43,6 +51,9 @@ def upload_file():
         else:
             return jsonify({"error": "User ID required"}), 400
 
+    except QuotaExceeded as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 413
     except Exception as e:
         conn.rollback()
         return jsonify({"error": str(e)}), 500
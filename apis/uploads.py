@@ -0,0 +1,388 @@
+from flask import Blueprint, request, jsonify
+import jwt
+import uuid
+import os
+import hashlib
+from services.database import cursor, conn
+from services.usage import QuotaExceeded, check_quota, record_usage
+from services.search import detect_file_type, queue_extraction
+from services.storage import ObjectNotFound, UploadNotFound, storage
+from services.listing_versions import FILES, bump_listing_version, bump_storage_version
+from services.storage_summary import record_objects
+from services.upload_sessions import (
+    OPEN, COMPLETING, COMPLETED, UPLOAD_MAX_SIZE, UPLOAD_SESSION_TTL,
+    choose_chunk_size, discard_upload, expected_part_size, lease_cutoff, part_count)
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Get secret key from environment variable
+SECRET_KEY = os.getenv(
+    "JWT_SECRET_KEY", "your-secret-key-here-change-this-in-production")
+
+uploads_bp = Blueprint('uploads', __name__)
+
+
+def get_user_from_token(token):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        return payload.get('user_id')
+    except jwt.ExpiredSignatureError:
+        return None
+    except jwt.InvalidTokenError:
+        return None
+
+
+def session_state(session):
+    """Describe a session and the chunks it has received, for resuming"""
+    cursor.execute(
+        "SELECT part_number, size, sha256 FROM upload_session_parts WHERE session_id = %s ORDER BY part_number",
+        (session['id'],)
+    )
+    parts = cursor.fetchall()
+    total_parts = part_count(session['total_size'], session['chunk_size'])
+    received = {part['part_number'] for part in parts}
+    return {
+        "upload_id": session['id'],
+        "filename": session['filename'],
+        "status": session['status'],
+        "file_id": session['file_id'],
+        "size": session['total_size'],
+        "chunk_size": session['chunk_size'],
+        "part_count": total_parts,
+        "received": [{"offset": (part['part_number'] - 1) * session['chunk_size'],
+                      "size": part['size'], "sha256": part['sha256']} for part in parts],
+        "missing_offsets": [(number - 1) * session['chunk_size']
+                            for number in range(1, total_parts + 1) if number not in received],
+    }
+
+
+def reopen(upload_id, claimed_at):
+    """Return a session this request moved to completing to open, unless another request took it over"""
+    cursor.execute(
+        "UPDATE upload_sessions SET status = %s WHERE id = %s AND status = %s AND updated_at = %s",
+        (OPEN, upload_id, COMPLETING, claimed_at)
+    )
+    conn.commit()
+
+
+@uploads_bp.route('/', methods=['POST'])
+def create_upload():
+    """Start a resumable upload.
+
+    Body: {"filename", "size", "content_type"?, "chunk_size"?}. Returns the
+    upload_id and the chunk size to PUT; chunks are sent to
+    /server-files/uploads/<upload_id>?offset=N and may arrive in any order
+    and in parallel.
+    """
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({"error": "Authentication required"}), 401
+
+        token = auth_header.split(' ')[1]
+        user_id = get_user_from_token(token)
+
+        if not user_id:
+            return jsonify({"error": "Invalid or expired token"}), 401
+
+        data = request.get_json(silent=True) or {}
+        filename = data.get('filename')
+        try:
+            total_size = int(data.get('size'))
+            requested_chunk_size = int(data['chunk_size']) if data.get('chunk_size') else None
+        except (TypeError, ValueError):
+            return jsonify({"error": "size and chunk_size must be integers"}), 400
+
+        if not filename:
+            return jsonify({"error": "filename is required"}), 400
+        if total_size <= 0 or total_size > UPLOAD_MAX_SIZE:
+            return jsonify({"error": f"size must be between 1 and {UPLOAD_MAX_SIZE} bytes"}), 400
+        # Refused before the client sends a single chunk
+        check_quota(user_id, total_size)
+
+        content_type = data.get('content_type') or 'application/octet-stream'
+        chunk_size = choose_chunk_size(total_size, requested_chunk_size)
+        s3_key = f"user_{user_id}/{uuid.uuid4()}-{filename}"
+        s3_upload_id = storage.create_multipart_upload(s3_key, content_type)
+
+        upload_id = uuid.uuid4().hex
+        try:
+            cursor.execute(
+                "INSERT INTO upload_sessions (id, user_id, filename, content_type, s3_key, s3_upload_id, total_size, chunk_size) VALUES (%s, %s, %s, %s, %s, %s, %s, %s)",
+                (upload_id, user_id, filename, content_type, s3_key,
+                 s3_upload_id, total_size, chunk_size)
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            storage.abort_multipart_upload(s3_key, s3_upload_id)
+            raise
+
+        return jsonify({
+            "success": True,
+            "upload_id": upload_id,
+            "chunk_size": chunk_size,
+            "part_count": part_count(total_size, chunk_size),
+            "expires_in": UPLOAD_SESSION_TTL
+        }), 201
+
+    except QuotaExceeded as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 413
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
+@uploads_bp.route('/<upload_id>', methods=['PUT'])
+def upload_chunk(upload_id):
+    """Store one chunk.
+
+    The offset comes from ?offset= or the Upload-Offset header and must be a
+    multiple of the session's chunk size. An X-Chunk-SHA256 header (hex) is
+    checked against the body; re-sending a chunk replaces it.
+    """
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({"error": "Authentication required"}), 401
+
+        token = auth_header.split(' ')[1]
+        user_id = get_user_from_token(token)
+
+        if not user_id:
+            return jsonify({"error": "Invalid or expired token"}), 401
+
+        cursor.execute(
+            "SELECT id, s3_key, s3_upload_id, total_size, chunk_size, status FROM upload_sessions WHERE id = %s AND user_id = %s",
+            (upload_id, user_id)
+        )
+        session = cursor.fetchone()
+        # Don't hold a snapshot open while the chunk is written to storage
+        conn.commit()
+        if not session:
+            return jsonify({"error": "Upload session not found or expired"}), 404
+        if session['status'] != OPEN:
+            return jsonify({"error": f"Upload is {session['status']}"}), 409
+
+        try:
+            offset = int(request.args.get('offset', request.headers.get('Upload-Offset', '')))
+        except ValueError:
+            return jsonify({"error": "offset is required"}), 400
+        if offset < 0 or offset >= session['total_size'] or offset % session['chunk_size']:
+            return jsonify({"error": f"offset must be a multiple of {session['chunk_size']} below {session['total_size']}"}), 400
+
+        part_number = offset // session['chunk_size'] + 1
+        expected_size = expected_part_size(session, part_number)
+        if request.content_length is not None and request.content_length != expected_size:
+            return jsonify({"error": f"Chunk at offset {offset} must be {expected_size} bytes"}), 400
+        chunk = request.get_data(cache=False)
+        if len(chunk) != expected_size:
+            return jsonify({"error": f"Chunk at offset {offset} must be {expected_size} bytes"}), 400
+
+        sha256 = hashlib.sha256(chunk).hexdigest()
+        client_sha256 = request.headers.get('X-Chunk-SHA256')
+        if client_sha256 and client_sha256.lower() != sha256:
+            return jsonify({"error": "Chunk checksum mismatch", "sha256": sha256}), 400
+
+        etag = storage.upload_part(session['s3_key'], session['s3_upload_id'], part_number, chunk)
+
+        # Touching the session locks its row, so this can't race /complete
+        cursor.execute(
+            "UPDATE upload_sessions SET updated_at = %s WHERE id = %s AND status = %s RETURNING id",
+            (datetime.utcnow(), upload_id, OPEN)
+        )
+        if not cursor.fetchone():
+            conn.rollback()
+            return jsonify({"error": "Upload is no longer open"}), 409
+        cursor.execute(
+            """INSERT INTO upload_session_parts (session_id, part_number, size, sha256, etag) VALUES (%s, %s, %s, %s, %s)
+               ON CONFLICT (session_id, part_number) DO UPDATE SET size = EXCLUDED.size, sha256 = EXCLUDED.sha256, etag = EXCLUDED.etag, created_at = CURRENT_TIMESTAMP""",
+            (upload_id, part_number, len(chunk), sha256, etag)
+        )
+        conn.commit()
+
+        return jsonify({"success": True, "offset": offset, "size": len(chunk), "sha256": sha256})
+
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
+@uploads_bp.route('/<upload_id>', methods=['GET'])
+def get_upload(upload_id):
+    """Report which chunks have been received and which offsets are missing"""
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({"error": "Authentication required"}), 401
+
+        token = auth_header.split(' ')[1]
+        user_id = get_user_from_token(token)
+
+        if not user_id:
+            return jsonify({"error": "Invalid or expired token"}), 401
+
+        cursor.execute(
+            "SELECT id, filename, total_size, chunk_size, status, file_id FROM upload_sessions WHERE id = %s AND user_id = %s",
+            (upload_id, user_id)
+        )
+        session = cursor.fetchone()
+        if not session:
+            return jsonify({"error": "Upload session not found or expired"}), 404
+
+        return jsonify(session_state(session))
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@uploads_bp.route('/<upload_id>/complete', methods=['POST'])
+def complete_upload(upload_id):
+    """Assemble the chunks into the final object and record the file"""
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({"error": "Authentication required"}), 401
+
+        token = auth_header.split(' ')[1]
+        user_id = get_user_from_token(token)
+
+        if not user_id:
+            return jsonify({"error": "Invalid or expired token"}), 401
+
+        # A session left completing past its lease is taken over; claimed_at
+        # fences off the request that held it
+        claimed_at = datetime.utcnow()
+        cursor.execute(
+            """UPDATE upload_sessions SET status = %s, updated_at = %s
+               WHERE id = %s AND user_id = %s AND (status = %s OR (status = %s AND updated_at < %s))
+               RETURNING id, filename, content_type, s3_key, s3_upload_id, total_size, chunk_size, status, file_id""",
+            (COMPLETING, claimed_at, upload_id, user_id, OPEN, COMPLETING, lease_cutoff())
+        )
+        session = cursor.fetchone()
+        conn.commit()
+        if not session:
+            cursor.execute(
+                "SELECT status, file_id FROM upload_sessions WHERE id = %s AND user_id = %s",
+                (upload_id, user_id)
+            )
+            existing = cursor.fetchone()
+            if not existing:
+                return jsonify({"error": "Upload session not found or expired"}), 404
+            if existing['status'] == COMPLETED:
+                # A retried /complete whose first response was lost
+                return jsonify({"success": True, "file_id": existing['file_id']})
+            return jsonify({"error": f"Upload is {existing['status']}"}), 409
+
+        try:
+            cursor.execute(
+                "SELECT part_number, size, etag FROM upload_session_parts WHERE session_id = %s ORDER BY part_number",
+                (upload_id,)
+            )
+            parts = cursor.fetchall()
+            if len(parts) != part_count(session['total_size'], session['chunk_size']):
+                state = session_state(session)
+                reopen(upload_id, claimed_at)
+                return jsonify({"error": "Upload is missing chunks",
+                                "missing_offsets": state['missing_offsets']}), 409
+            # Space may have gone to other uploads since this one was created
+            check_quota(user_id, session['total_size'])
+            conn.commit()
+
+            try:
+                storage.complete_multipart_upload(
+                    session['s3_key'], session['s3_upload_id'],
+                    [(part['part_number'], part['etag']) for part in parts])
+            except UploadNotFound:
+                # An earlier attempt assembled the object but never recorded it
+                try:
+                    storage.head(session['s3_key'])
+                except ObjectNotFound:
+                    cursor.execute("DELETE FROM upload_sessions WHERE id = %s", (upload_id,))
+                    conn.commit()
+                    return jsonify({"error": "Upload no longer exists; start a new one"}), 410
+            bump_storage_version()
+
+            file_type = detect_file_type(session['filename'], session['content_type'])
+            cursor.execute(
+                "INSERT INTO user_files (user_id, filename, s3_key, file_size, file_type, content_type, created_at) VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id",
+                (user_id, session['filename'], session['s3_key'], session['total_size'], file_type,
+                 session['content_type'], datetime.utcnow())
+            )
+            file_id = cursor.fetchone()['id']
+            cursor.execute(
+                "UPDATE upload_sessions SET status = %s, file_id = %s, updated_at = %s WHERE id = %s AND status = %s AND updated_at = %s RETURNING id",
+                (COMPLETED, file_id, datetime.utcnow(), upload_id, COMPLETING, claimed_at)
+            )
+            if not cursor.fetchone():
+                # Our lease ran out and another request took the session over
+                conn.rollback()
+                return jsonify({"error": "Upload is completing"}), 409
+            # Too large to read here; the text is extracted in the background
+            if file_type != 'unknown':
+                queue_extraction([file_id])
+            cursor.execute("DELETE FROM upload_session_parts WHERE session_id = %s", (upload_id,))
+            # Raises if a concurrent upload took the space after the check above
+            record_usage(user_id, files=1, files_bytes=session['total_size'])
+            record_objects([(session['s3_key'], session['total_size'])])
+            bump_listing_version(FILES, user_id)
+            conn.commit()
+        except Exception:
+            # Hand the session back so the client can free space or fix
+            # things up and try again; an assembled object is picked up by
+            # the retry, or deleted with the session when it is aborted or expires
+            conn.rollback()
+            reopen(upload_id, claimed_at)
+            raise
+
+        return jsonify({
+            "success": True,
+            "message": "File uploaded successfully",
+            "file_id": file_id,
+            "filename": session['filename']
+        })
+
+    except QuotaExceeded as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 413
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
+@uploads_bp.route('/<upload_id>', methods=['DELETE'])
+def abort_upload(upload_id):
+    """Abandon an upload and discard its chunks"""
+    try:
+        auth_header = request.headers.get('Authorization')
+        if not auth_header or not auth_header.startswith('Bearer '):
+            return jsonify({"error": "Authentication required"}), 401
+
+        token = auth_header.split(' ')[1]
+        user_id = get_user_from_token(token)
+
+        if not user_id:
+            return jsonify({"error": "Invalid or expired token"}), 401
+
+        cursor.execute(
+            """DELETE FROM upload_sessions
+               WHERE id = %s AND user_id = %s AND (status = %s OR (status = %s AND updated_at < %s))
+               RETURNING s3_key, s3_upload_id""",
+            (upload_id, user_id, OPEN, COMPLETING, lease_cutoff())
+        )
+        session = cursor.fetchone()
+        if not session:
+            conn.rollback()
+            return jsonify({"error": "Upload session not found or not open"}), 404
+        discard_upload(session)
+        conn.commit()
+
+        return jsonify({"success": True, "message": "Upload aborted"})
+
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
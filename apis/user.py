@@ -1,15 +1,55 @@
 from flask import Blueprint, request, jsonify
+import jwt
+import os
+from dotenv import load_dotenv
 from services.database import cursor, conn
+from services.listing_versions import (
+    USERS, bump_listing_version, listing_etag, not_modified_response, with_etag)
+from services.purge import purge_account, get_purge_job
+from services.replicas import use_replica
+from services.user_import import CSV, NDJSON, ON_CONFLICT, import_users
+from utils.auth import is_admin_request
 from utils.validators import validate_input
 
+# Load environment variables
+load_dotenv()
+
+# Get secret key from environment variable
+SECRET_KEY = os.getenv(
+    "JWT_SECRET_KEY", "your-secret-key-here-change-this-in-production")
+
 user_bp = Blueprint('user', __name__)
 
 
+def get_user_from_token(token):
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])
+        return payload.get('user_id')
+    except jwt.ExpiredSignatureError:
+        return None
+    except jwt.InvalidTokenError:
+        return None
+
+
+def requesting_user_id():
+    """User id from the Bearer token, or None"""
+    auth_header = request.headers.get('Authorization')
+    if not auth_header or not auth_header.startswith('Bearer '):
+        return None
+    return get_user_from_token(auth_header.split(' ')[1])
+
+
 @user_bp.route('/', methods=['GET'])
 def get_users():
+    use_replica(USERS)
+    etag = listing_etag(USERS)
+    not_modified = not_modified_response(etag)
+    if not_modified:
+        return not_modified
+
     cursor.execute("SELECT id, name, email FROM users")
     users = cursor.fetchall()
-    return jsonify({"users": users})
+    return with_etag(jsonify({"users": users}), etag)
 
 
 @user_bp.route('/', methods=['POST'])
@@ -25,6 +65,7 @@ def create_user():
         result = cursor.fetchone()
         if result:
             user_id = result["id"]
+            bump_listing_version(USERS)
             conn.commit()
             return jsonify({"id": user_id, "message": "User created"})
         else:
@@ -33,6 +74,49 @@ def create_user():
         return jsonify({"error": str(e)}), 500
 
 
+def _is_ndjson(mimetype, filename=''):
+    return mimetype in ('application/x-ndjson', 'application/jsonl') or filename.endswith(('.ndjson', '.jsonl'))
+
+
+@user_bp.route('/import', methods=['POST'])
+def import_user_rows():
+    """Create users in bulk from a CSV or NDJSON request body or uploaded file (admin)
+
+    The body is the file itself, or a multipart form with it as 'file'. The
+    format comes from ?format=, or the Content-Type (text/csv or
+    application/x-ndjson) of the body or file, or the file's .ndjson/.jsonl
+    name. ?on_conflict=update updates users whose email already exists
+    instead of skipping them. Rows that fail validation are listed with
+    their line numbers; the rest are imported.
+    """
+    try:
+        if not is_admin_request():
+            return jsonify({"error": "Admin access required"}), 403
+
+        if request.mimetype == 'multipart/form-data':
+            if 'file' not in request.files:
+                return jsonify({"error": "No file provided"}), 400
+            file = request.files['file']
+            # Large parts spill to a SpooledTemporaryFile, which only has the
+            # io interface TextIOWrapper needs from Python 3.11
+            stream = getattr(file.stream, '_file', file.stream)
+            ndjson = _is_ndjson(file.mimetype, file.filename or '')
+        else:
+            stream = request.stream
+            ndjson = _is_ndjson(request.mimetype)
+
+        import_format = request.args.get('format') or (NDJSON if ndjson else CSV)
+        if import_format not in (CSV, NDJSON):
+            return jsonify({"error": "format must be csv or ndjson"}), 400
+        on_conflict = request.args.get('on_conflict', 'skip')
+        if on_conflict not in ON_CONFLICT:
+            return jsonify({"error": "on_conflict must be skip or update"}), 400
+
+        return jsonify(import_users(stream, import_format, on_conflict))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 @user_bp.route('/', methods=['PUT'])
 def update_user():
     try:
@@ -43,7 +127,45 @@ def update_user():
 
         cursor.execute("UPDATE users SET name=%s, email=%s WHERE id=%s",
                        (data["name"], data["email"], data["id"]))
+        bump_listing_version(USERS)
         conn.commit()
         return jsonify({"message": "User updated"})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
+
+
+@user_bp.route('/<int:user_id>', methods=['DELETE'])
+def delete_user(user_id):
+    """Delete an account with all its files, logos and uploads (admin, or the user themselves)
+
+    The rows go straight away; stored objects are deleted in the background
+    and the purge's progress is at status_url.
+    """
+    try:
+        if not is_admin_request() and requesting_user_id() != user_id:
+            return jsonify({"error": "Admin access or the account's own token required"}), 403
+
+        purge_id = purge_account(user_id)
+        if not purge_id:
+            return jsonify({"error": "User not found"}), 404
+
+        return jsonify({
+            "success": True,
+            "purge_id": purge_id,
+            "status_url": f"/users/purges/{purge_id}"
+        }), 202
+    except Exception as e:
+        conn.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
+@user_bp.route('/purges/<purge_id>', methods=['GET'])
+def get_purge(purge_id):
+    """Progress of an account purge"""
+    try:
+        job = get_purge_job(purge_id)
+        if not job or (not is_admin_request() and requesting_user_id() != job['user_id']):
+            return jsonify({"error": "Purge not found"}), 404
+        return jsonify(job)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Compare importing a folder of files one POST at a time against /upload-batch.
+
+Boots the app against the local stand-ins (see harness.py), then uploads the
+same N files through /server-files/upload (one request each) and through a
+single /server-files/upload-batch request.
+
+Usage:
+    python benchmarks/bench_batch_upload.py [--files 200] [--file-size 65536]
+"""
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+
+def login(session, base_url):
+    credentials = {"name": "Batch Bench", "email": f"batch-{time.time()}@example.com",
+                   "password": "bench-password"}
+    session.post(f"{base_url}/auth/register", json=credentials).raise_for_status()
+    response = session.post(f"{base_url}/auth/login", json=credentials)
+    response.raise_for_status()
+    return {'Authorization': f"Bearer {response.json()['token']}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--file-size', type=int, default=64 * 1024)
+    parser.add_argument('--postgres-dsn')
+    parser.add_argument('--pg-bin')
+    parser.add_argument('--s3-endpoint')
+    args = parser.parse_args()
+
+    import requests
+
+    bodies = [(f"invoice-{i}.pdf", os.urandom(args.file_size)) for i in range(args.files)]
+    with harness.postgres_standin(args.postgres_dsn, args.pg_bin) as pg, \
+            harness.s3_standin(args.s3_endpoint) as s3:
+        harness.configure_environment(pg.dsn, s3.endpoint)
+        with harness.AppServer() as app:
+            session = requests.Session()
+            headers = login(session, app.base_url)
+
+            started = time.perf_counter()
+            for name, body in bodies:
+                session.post(f"{app.base_url}/server-files/upload", headers=headers,
+                             files={'file': (name, body, 'application/pdf')}).raise_for_status()
+            single = time.perf_counter() - started
+
+            started = time.perf_counter()
+            response = session.post(f"{app.base_url}/server-files/upload-batch", headers=headers,
+                                    files=[('files', (name, body, 'application/pdf')) for name, body in bodies])
+            response.raise_for_status()
+            batch = time.perf_counter() - started
+            assert response.json()["uploaded"] == args.files
+
+    print(f"{args.files} files x {args.file_size} bytes")
+    print(f"  one request per file: {single:8.3f}s ({args.files / single:8.1f} files/s)")
+    print(f"  /upload-batch:        {batch:8.3f}s ({args.files / batch:8.1f} files/s)")
+    print(f"  speedup:              {single / batch:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
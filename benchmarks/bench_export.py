@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Measure /export throughput and memory as the exported table grows.
+
+Boots the app against the local stand-ins (see harness.py), bulk-inserts
+file rows for one user with generate_series, then streams the user's export
+as NDJSON and CSV at growing row counts, reporting rows/s, MB/s and the
+app's peak traced allocation during each export (which should stay flat as
+the table grows). For comparison it also loads the same rows with
+fetchall(), as the listing endpoints do, and reports that peak.
+
+Usage:
+    python benchmarks/bench_export.py [--rows 1000000] [--steps 3]
+"""
+
+import argparse
+import csv
+import io
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+
+def login(session, base_url):
+    credentials = {"name": "Export Bench", "email": f"export-{time.time()}@example.com",
+                   "password": "bench-password"}
+    user_id = session.post(f"{base_url}/auth/register", json=credentials).json()["user_id"]
+    response = session.post(f"{base_url}/auth/login", json=credentials)
+    response.raise_for_status()
+    return user_id, {'Authorization': f"Bearer {response.json()['token']}"}
+
+
+def add_rows(dsn, user_id, start, stop):
+    import psycopg2
+    connection = psycopg2.connect(dsn)
+    with connection, connection.cursor() as cur:
+        cur.execute("""
+            INSERT INTO user_files (user_id, filename, s3_key, file_size, file_type, created_at)
+            SELECT %s, 'invoice-' || g || '.pdf', 'user_' || %s || '/blobs/' || left(md5(g::text), 2) || '/' || md5(g::text),
+                   50000 + g %% 200000, 'pdf', now() - g * interval '1 second'
+            FROM generate_series(%s, %s) g
+        """, (user_id, user_id, start + 1, stop))
+        cur.execute("ANALYZE user_files")
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--steps', type=int, default=3, help="Row counts measured, growing tenfold up to --rows")
+    parser.add_argument('--postgres-dsn')
+    parser.add_argument('--pg-bin')
+    parser.add_argument('--s3-endpoint')
+    args = parser.parse_args()
+
+    import requests
+
+    with harness.postgres_standin(args.postgres_dsn, args.pg_bin) as pg, \
+            harness.s3_standin(args.s3_endpoint) as s3:
+        harness.configure_environment(pg.dsn, s3.endpoint)
+        with harness.AppServer() as app:
+            session = requests.Session()
+            user_id, headers = login(session, app.base_url)
+
+            def export(export_format):
+                response = session.get(f"{app.base_url}/export/files", headers=headers,
+                                       params={"format": export_format}, stream=True)
+                response.raise_for_status()
+                received = lines = 0
+                for chunk in response.iter_content(256 * 1024):
+                    received += len(chunk)
+                    lines += chunk.count(b'\n')
+                return received, lines
+
+            def load_all():
+                from services.database import cursor, release_connection
+                cursor.execute(
+                    "SELECT id, user_id, filename, s3_key, file_size, file_type, source_type, created_at FROM user_files WHERE user_id = %s ORDER BY created_at DESC",
+                    (user_id,))
+                rows = cursor.fetchall()
+                release_connection()
+                return len(rows)
+
+            counts = sorted({max(1, args.rows // 10 ** step) for step in range(args.steps)})
+            inserted = 0
+            print(f"{'rows':>9s} {'format':>6s} {'MB':>7s} {'seconds':>8s} {'rows/s':>10s} {'MB/s':>7s} "
+                  f"{'peak alloc MB':>13s}")
+            for count in counts:
+                add_rows(pg.dsn, user_id, inserted, count)
+                inserted = count
+                for export_format in ('ndjson', 'csv'):
+                    started = time.perf_counter()
+                    received, lines = export(export_format)
+                    elapsed = time.perf_counter() - started
+                    assert lines == count + (export_format == 'csv'), (lines, count)
+                    # Tracing slows the app down, so memory is measured on a
+                    # separate pass; the app runs in this process, so
+                    # tracemalloc sees its allocations
+                    tracemalloc.start()
+                    export(export_format)
+                    peak = tracemalloc.get_traced_memory()[1]
+                    tracemalloc.stop()
+                    print(f"{count:9d} {export_format:>6s} {received / 1e6:7.1f} {elapsed:8.3f} "
+                          f"{count / elapsed:10,.0f} {received / 1e6 / elapsed:7.1f} {peak / 1e6:13.1f}")
+                tracemalloc.start()
+                load_all()
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f"{count:9d} {'fetchall() for comparison':>34s} {peak / 1e6:21.1f}")
+
+            # The CSV parses back into the rows that were exported
+            response = session.get(f"{app.base_url}/export/files", headers=headers, params={"format": "csv"})
+            rows = list(csv.DictReader(io.StringIO(response.text)))
+            assert len(rows) == inserted and rows[0]['user_id'] == str(user_id)
+            print(f"csv round trip: {len(rows)} rows")
+
+
+if __name__ == "__main__":
+    main()
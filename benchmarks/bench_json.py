@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the JSON providers on the payload shapes the API handles.
+
+Compares Flask's default provider against services.json_provider for:
+  - logo listings (RealDictRow rows with datetimes), including the old
+    per-row dict() copy the endpoint used to do
+  - file listings
+  - a multi-megabyte /pdf/convert request body (parse)
+  - a large /logos/url-to-base64 response (serialize)
+
+Usage:
+    python benchmarks/bench_json.py [--rows 1000] [--html-mb 5]
+"""
+
+import argparse
+import base64
+import datetime
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from flask.json.provider import DefaultJSONProvider  # noqa: E402
+from psycopg2.extras import RealDictRow  # noqa: E402
+from services.json_provider import FastJSONProvider, orjson  # noqa: E402
+
+
+def make_logo_rows(count):
+    now = datetime.datetime(2024, 5, 1, 12, 30, 15, 123456)
+    return [RealDictRow(
+        id=i,
+        filename=f"logo-{i}.png",
+        s3_key=f"logos/user42/3f2b9c1e-{i:08d}-logo-{i}.png",
+        logo_url=f"https://bucket.s3.amazonaws.com/logos/user42/3f2b9c1e-{i:08d}-logo-{i}.png",
+        file_size=20000 + i,
+        content_type='image/png',
+        created_at=now - datetime.timedelta(minutes=i),
+    ) for i in range(count)]
+
+
+def make_file_rows(count):
+    now = datetime.datetime(2024, 5, 1, 12, 30, 15, 123456)
+    return [RealDictRow(
+        id=i,
+        filename=f"invoice-{i}.pdf",
+        s3_key=f"user_42/9a7e6d2c-{i:08d}-invoice-{i}.pdf",
+        created_at=now - datetime.timedelta(hours=i),
+        file_size=150000 + i,
+    ) for i in range(count)]
+
+
+def make_html_body(megabytes):
+    row = "<tr><td>Widget</td><td>2</td><td>$19.99</td><td>$39.98</td></tr>\n"
+    html = "<html><body><table>" + row * (megabytes * 1024 * 1024 // len(row)) + "</table></body></html>"
+    return ('{"html_content": %s, "filename": "invoice.pdf"}' % FastJSONProvider(Flask(__name__)).dumps(html)).encode()
+
+
+def timeit(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--html-mb', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    if orjson is None:
+        print("orjson is not installed; both columns would use the stdlib encoder")
+        return
+
+    app = Flask(__name__)
+    default = DefaultJSONProvider(app)
+    fast = FastJSONProvider(app)
+
+    logos = make_logo_rows(args.rows)
+    files = make_file_rows(args.rows)
+    html_body = make_html_body(args.html_mb)
+    image = base64.b64encode(os.urandom(5 * 1024 * 1024)).decode()
+    base64_payload = {"success": True, "base64": image,
+                      "data_url": f"data:image/png;base64,{image}",
+                      "content_type": "image/png", "file_size": 5 * 1024 * 1024}
+
+    cases = [
+        (f"get_logos serialize ({args.rows} rows, dict copy)",
+         lambda: default.dumps({"success": True, "logos": [dict(row) for row in logos]}),
+         lambda: fast.dumps({"success": True, "logos": logos})),
+        (f"get_files serialize ({args.rows} rows)",
+         lambda: default.dumps({"files": files}),
+         lambda: fast.dumps({"files": files})),
+        (f"/pdf/convert parse ({len(html_body) // (1024 * 1024)} MB html_content)",
+         lambda: default.loads(html_body),
+         lambda: fast.loads(html_body)),
+        ("url-to-base64 serialize (5 MB image)",
+         lambda: default.dumps(base64_payload),
+         lambda: fast.dumps(base64_payload)),
+    ]
+
+    print(f"{'payload':55s} {'default ms':>12s} {'orjson ms':>12s} {'speedup':>8s}")
+    for name, baseline, candidate in cases:
+        baseline_ms = timeit(baseline, args.repeat)
+        candidate_ms = timeit(candidate, args.repeat)
+        print(f"{name:55s} {baseline_ms:12.2f} {candidate_ms:12.2f} {baseline_ms / candidate_ms:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+"""
+Measure server-side prepared statements on the hot query set.
+
+Boots the app against the local stand-ins (see harness.py), drives login,
+upload, listing and delete once through the Flask test client to capture
+every statement marked with prepared() and its parameters, then loads the
+synthetic dataset from query_plans.py so the replayed ids land on real rows.
+
+Each statement is then replayed on one of the app's pooled connections with
+DB_PREPARED_STATEMENTS off and on, reporting per-execution latency and the
+CPU time the PostgreSQL backend spent (from /proc, so only with a local
+server). Writes are rolled back after every execution. Last, the connection
+is closed, terminated and has its statements deallocated to check they are
+prepared again without errors.
+
+Usage:
+    python benchmarks/bench_prepared.py [--iterations 5000] [--users 100000]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+import query_plans  # noqa: E402
+
+PNG = b"\x89PNG\r\n\x1a\n" + b"\0" * 64
+
+
+def backend_cpu(pid):
+    """Seconds of CPU a local backend has used, or None if it isn't visible from here"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return None
+    # utime and stime, fields 14 and 15 of stat(5)
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def capture(client):
+    """Run the hot paths once and return each prepared statement with the parameters it was given"""
+    from services.database import InstrumentedCursor, PreparedSQL
+    captured = {}
+    original_execute = InstrumentedCursor.execute
+
+    def execute(cursor, query, vars=None):
+        if isinstance(query, PreparedSQL):
+            captured.setdefault(query, vars)
+        return original_execute(cursor, query, vars)
+
+    InstrumentedCursor.execute = execute
+    try:
+        credentials = {"name": "Prepared", "email": "prepared@example.com", "password": "bench-password"}
+        client.post('/auth/register', json=credentials)
+        token = client.post('/auth/login', json=credentials).get_json()["token"]
+        auth = {'Authorization': f"Bearer {token}"}
+        file_id = client.post('/server-files/upload', headers=auth, data={
+            'file': (io.BytesIO(b"%PDF-1.4 prepared"), 'prepared.pdf', 'application/pdf')}).get_json()["file_id"]
+        client.get('/server-files/', headers=auth)
+        client.get(f'/server-files/download/{file_id}', headers=auth)
+        logo_id = client.post('/logos/', headers=auth, data={
+            'logo': (io.BytesIO(PNG), 'logo.png', 'image/png')}).get_json()["logo_id"]
+        client.get('/logos/', headers=auth)
+        client.get(f'/logos/{logo_id}', headers=auth)
+        client.get('/storage/usage', headers=auth)
+        client.delete(f'/server-files/delete/{file_id}', headers=auth)
+    finally:
+        InstrumentedCursor.execute = original_execute
+    return captured
+
+
+def replay(statement, vars, iterations):
+    """Latencies of running one statement on this thread's connection, and the backend CPU it took"""
+    from services.database import conn, cursor
+    write = not statement.lstrip().upper().startswith('SELECT')
+    pid = conn.get_backend_pid()
+    latencies = []
+    cpu_before = backend_cpu(pid)
+    for _ in range(iterations):
+        started = time.perf_counter()
+        cursor.execute(statement, vars)
+        if cursor.description:
+            cursor.fetchall()
+        latencies.append(time.perf_counter() - started)
+        if write:
+            conn.rollback()
+    conn.rollback()
+    cpu_after = backend_cpu(pid)
+    cpu = None if cpu_before is None or cpu_after is None else cpu_after - cpu_before
+    return latencies, cpu
+
+
+def server_prepared():
+    """Names of the statements prepared on this thread's connection, as the server sees them"""
+    from services.database import conn, cursor
+    cursor.execute("SELECT name FROM pg_prepared_statements")
+    names = {row['name'] for row in cursor.fetchall()}
+    conn.rollback()
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--iterations', type=int, default=5000, help="Executions per statement and mode")
+    parser.add_argument('--users', type=int, default=100000, help="Synthetic users loaded before replaying")
+    parser.add_argument('--pg-bin')
+    args = parser.parse_args()
+
+    with harness.ThrowawayPostgres(args.pg_bin) as pg, harness.MotoS3() as s3:
+        harness.configure_environment(pg.dsn, s3.endpoint, extra={
+            'OUTBOX_WORKERS': '0', 'CACHE_INVALIDATION_ENABLED': 'False', 'USAGE_RECONCILE_INTERVAL': '0'})
+        import server
+        from services import database
+        from services.s3 import ensure_bucket_exists
+
+        server.init_database()
+        ensure_bucket_exists()
+        captured = capture(server.create_app().test_client())
+        database.release_connection()
+        print(f"Captured {len(captured)} prepared statements; generating {args.users:,} synthetic users...")
+        query_plans.generate_dataset(pg.dsn, args.users, 5, 1)
+
+        print(f"{'prepared':>8s} {'p50 ms':>8s} {'p99 ms':>8s} {'mean ms':>8s} {'cpu us/q':>9s}  statement")
+        totals = {False: [0.0, 0.0], True: [0.0, 0.0]}
+        for statement, vars in captured.items():
+            for enabled in (False, True):
+                database.DB_PREPARED_STATEMENTS = enabled
+                # Warm up: the first executions prepare, and plan with the parameters each time
+                replay(statement, vars, 10)
+                latencies, cpu = replay(statement, vars, args.iterations)
+                summary = harness.summarize_latencies(latencies, sum(latencies))
+                totals[enabled][0] += summary["mean_ms"]
+                cpu_per_query = None if cpu is None else cpu / args.iterations * 1e6
+                if cpu_per_query is not None:
+                    totals[enabled][1] += cpu_per_query
+                print(f"{'on' if enabled else 'off':>8s} {summary['p50_ms']:8.3f} {summary['p99_ms']:8.3f} "
+                      f"{summary['mean_ms']:8.3f} "
+                      f"{'n/a' if cpu_per_query is None else f'{cpu_per_query:.1f}':>9s}  "
+                      f"{' '.join(statement.split())[:70]}")
+        for enabled in (False, True):
+            mean, cpu = totals[enabled]
+            print(f"{'on' if enabled else 'off':>8s} {'':8s} {'':8s} {mean:8.3f} {cpu:9.1f}  "
+                  f"one of each statement")
+
+        database.DB_PREPARED_STATEMENTS = True
+        hot = next(iter(captured))
+
+        # A new connection starts with nothing prepared
+        database.conn.close()
+        database.cursor.execute(hot, captured[hot])
+        assert server_prepared() == {hot.name}, server_prepared()
+        print("closed connection replaced: statement prepared again on the new one")
+
+        # A backend killed while the connection sat idle in the pool
+        pid = database.conn.get_backend_pid()
+        database.release_connection()
+        import psycopg2
+        admin = psycopg2.connect(pg.dsn)
+        admin.autocommit = True
+        with admin.cursor() as cur:
+            cur.execute("SELECT pg_terminate_backend(%s)", (pid,))
+        admin.close()
+        time.sleep(0.2)
+        database.cursor.execute(hot, captured[hot])
+        assert database.conn.get_backend_pid() != pid and server_prepared() == {hot.name}
+        print("terminated backend replaced: statement prepared again on the new one")
+
+        # Statements deallocated behind the app's back
+        database.cursor.execute("DEALLOCATE ALL")
+        database.conn.commit()
+        database.cursor.execute(hot, captured[hot])
+        database.cursor.fetchall()
+        assert server_prepared() == {hot.name}, server_prepared()
+        print("DEALLOCATE ALL: statement prepared again and executed without an error")
+        database.release_connection()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+Check and measure read replica routing against two local PostgreSQL instances.
+
+Boots a throwaway primary and a streaming standby cloned from it with
+pg_basebackup (see harness.py), points the app at both with
+DB_REPLICA_HOSTS, and then, with the listing cache off so every listing
+read queries the database:
+
+1. reads file listings in a burst, counting where each was served;
+2. pauses replay on the replica and checks that a user sees their own
+   upload and a new account can log in straight away, while another user
+   keeps reading from the replica until DB_REPLICA_MAX_LAG runs out;
+3. resumes replay and checks reads move back to the replica;
+4. stops the replica and checks reads fall back to the primary without
+   errors, and return once it is back.
+
+Usage:
+    python benchmarks/bench_replicas.py [--reads 2000] [--max-lag 2]
+"""
+
+import argparse
+import io
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+CHECK_INTERVAL = 0.1
+
+
+def set_replay(dsn, paused):
+    import psycopg2
+    connection = psycopg2.connect(dsn)
+    connection.autocommit = True
+    with connection.cursor() as cur:
+        cur.execute("SELECT pg_wal_replay_pause()" if paused else "SELECT pg_wal_replay_resume()")
+    connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--reads', type=int, default=2000, help="Listing reads in the measured burst")
+    parser.add_argument('--max-lag', type=float, default=2.0, help="DB_REPLICA_MAX_LAG for the run")
+    parser.add_argument('--pg-bin')
+    parser.add_argument('--s3-endpoint')
+    args = parser.parse_args()
+
+    import requests
+
+    with harness.ThrowawayPostgres(args.pg_bin) as primary, harness.ThrowawayReplica(primary) as replica, \
+            harness.s3_standin(args.s3_endpoint) as s3:
+        harness.configure_environment(primary.dsn, s3.endpoint, extra={
+            'DB_REPLICA_HOSTS': replica.address,
+            'DB_REPLICA_MAX_LAG': str(args.max_lag),
+            'DB_REPLICA_CHECK_INTERVAL': str(CHECK_INTERVAL),
+            'LISTING_CACHE_MAX_BYTES': '0'})
+        with harness.AppServer() as app:
+            session = requests.Session()
+            base_url = app.base_url
+
+            def account(name):
+                credentials = {"name": name, "email": f"{name}-{time.time()}@example.com",
+                               "password": "bench-password"}
+                session.post(f"{base_url}/auth/register", json=credentials).raise_for_status()
+                response = session.post(f"{base_url}/auth/login", json=credentials)
+                response.raise_for_status()
+                return credentials, {'Authorization': f"Bearer {response.json()['token']}"}
+
+            def routed():
+                text = session.get(f"{base_url}/metrics").text
+                return {target: float(count) for target, count in
+                        re.findall(r'db_replica_reads_total\{target="(\w+)"\} (\S+)', text)}
+
+            def list_files(headers):
+                before = routed()
+                response = session.get(f"{base_url}/server-files/", headers=headers)
+                response.raise_for_status()
+                after = routed()
+                target = next(t for t in after if after[t] != before.get(t, 0))
+                return target, [f['filename'] for f in response.json()['files']]
+
+            def wait_for(target, headers, timeout=10):
+                deadline = time.time() + timeout
+                while time.time() < deadline:
+                    if list_files(headers)[0] == target:
+                        return
+                    time.sleep(CHECK_INTERVAL)
+                raise AssertionError(f"reads never moved to the {target}")
+
+            _, alice = account('alice')
+            _, bob = account('bob')
+            wait_for('replica', bob)
+
+            # 1. Where a burst of listing reads runs
+            before = routed()
+            started = time.perf_counter()
+            for _ in range(args.reads):
+                session.get(f"{base_url}/server-files/", headers=bob).raise_for_status()
+            elapsed = time.perf_counter() - started
+            after = routed()
+            on_replica = after.get('replica', 0) - before.get('replica', 0)
+            on_primary = after.get('primary', 0) - before.get('primary', 0)
+            print(f"{args.reads} listing reads in {elapsed:.2f}s ({args.reads / elapsed:,.0f}/s): "
+                  f"{on_replica:.0f} served by the replica, {on_primary:.0f} by the primary")
+            assert on_replica == args.reads, (on_primary, on_replica)
+
+            # 2. Replay paused: the replica falls behind
+            set_replay(replica.dsn, paused=True)
+            session.post(f"{base_url}/server-files/upload", headers=alice, files={
+                'file': ('fresh.pdf', io.BytesIO(b"%PDF-1.4 fresh"), 'application/pdf')}).raise_for_status()
+            target, files = list_files(alice)
+            assert target == 'primary' and 'fresh.pdf' in files, (target, files)
+            print(f"own upload visible immediately: read from the {target}")
+            carol, _ = account('carol')
+            print("account registered during the lag can log in")
+            target, _ = list_files(bob)
+            assert target == 'replica', target
+            print("other users keep reading from the lagging replica")
+            time.sleep(args.max_lag + 2 * CHECK_INTERVAL)
+            target, _ = list_files(bob)
+            assert target == 'primary', target
+            print(f"after {args.max_lag}s of lag everyone reads from the primary")
+
+            # 3. Replay resumed
+            set_replay(replica.dsn, paused=False)
+            wait_for('replica', alice)
+            assert 'fresh.pdf' in list_files(alice)[1]
+            print("replica caught up: reads back on the replica, with the upload")
+
+            # 4. Replica down and back
+            replica.stop()
+            started = time.perf_counter()
+            for _ in range(20):
+                session.get(f"{base_url}/server-files/", headers=bob).raise_for_status()
+            session.post(f"{base_url}/auth/login", json=carol).raise_for_status()
+            print(f"replica stopped: reads served by the primary without errors "
+                  f"({(time.perf_counter() - started) * 1000 / 21:.1f} ms each)")
+            replica.start()
+            wait_for('replica', bob, timeout=30)
+            print("replica restarted: reads back on the replica")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+"""
+Measure download tail latency and failure behaviour against a slow or failing S3.
+
+Boots the app against the local stand-ins (see harness.py) with a FaultyS3
+proxy between the app and S3, uploads N files, then downloads them through
+/server-files/download from --concurrency clients under each scenario:
+
+- healthy:   no injected faults
+- slow tail: --slow-fraction of S3 requests take --slow-ms longer, first
+             with plain GETs, then with hedged GETs (S3_HEDGE_GETS)
+- outage:    every S3 request fails with 503 SlowDown, first with the
+             circuit breaker disabled, then enabled; shows how long each
+             failing download holds its worker
+
+Reports p50/p95/p99 latency, failed downloads and hedges sent/won.
+
+Usage:
+    python benchmarks/bench_s3_faults.py [--files 50] [--requests 1000] [--slow-fraction 0.02] [--slow-ms 400]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+
+def run(base_url, headers, file_ids, requests_count, concurrency):
+    import requests
+
+    local = threading.local()
+
+    def download(index):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        started = time.perf_counter()
+        response = local.session.get(
+            f"{base_url}/server-files/download/{file_ids[index % len(file_ids)]}", headers=headers)
+        return response.status_code == 200, time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(download, range(requests_count)))
+    summary = harness.summarize_latencies([latency for _, latency in results], time.perf_counter() - started)
+    summary['failed'] = sum(1 for ok, _ in results if not ok)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=50)
+    parser.add_argument('--file-size', type=int, default=16 * 1024)
+    parser.add_argument('--requests', type=int, default=1000)
+    parser.add_argument('--outage-requests', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--slow-fraction', type=float, default=0.02)
+    parser.add_argument('--slow-ms', type=float, default=400)
+    parser.add_argument('--postgres-dsn')
+    parser.add_argument('--pg-bin')
+    parser.add_argument('--s3-endpoint')
+    args = parser.parse_args()
+
+    import requests
+
+    with harness.postgres_standin(args.postgres_dsn, args.pg_bin) as pg, \
+            harness.s3_standin(args.s3_endpoint) as s3, \
+            harness.FaultyS3(s3.endpoint) as faults:
+        harness.configure_environment(pg.dsn, faults.endpoint, extra={
+            'UPLOAD_GC_INTERVAL': '0', 'STORAGE_CACHE_DIR': '', 'S3_BREAKER_RESET': '60'})
+        with harness.AppServer() as app:
+            from services import s3 as s3_module
+            from services.metrics import S3_HEDGED_REQUESTS
+
+            session = requests.Session()
+            credentials = {"name": "Fault Bench", "email": f"faults-{time.time()}@example.com",
+                           "password": "bench-password"}
+            session.post(f"{app.base_url}/auth/register", json=credentials).raise_for_status()
+            token = session.post(f"{app.base_url}/auth/login", json=credentials).json()['token']
+            headers = {'Authorization': f"Bearer {token}"}
+            response = session.post(f"{app.base_url}/server-files/upload-batch", headers=headers, files=[
+                ('files', (f"invoice-{i}.pdf", os.urandom(args.file_size), 'application/pdf'))
+                for i in range(args.files)])
+            response.raise_for_status()
+            file_ids = [result['file_id'] for result in response.json()['results']]
+
+            def scenario(name, requests_count, slow_fraction=0.0, error_fraction=0.0,
+                         hedge=False, breaker=0):
+                faults.slow_fraction, faults.slow_latency = slow_fraction, args.slow_ms / 1000
+                faults.error_fraction = error_fraction
+                s3_module.S3_HEDGE_GETS = hedge
+                s3_module.s3_breaker.threshold = breaker
+                s3_module.s3_breaker.record(True)
+                if hedge:
+                    # Fill the latency window the hedge delay comes from
+                    run(app.base_url, headers, file_ids, s3_module.HEDGE_MIN_SAMPLES * 2, args.concurrency)
+                hedges_before = dict(S3_HEDGED_REQUESTS._values)
+                summary = run(app.base_url, headers, file_ids, requests_count, args.concurrency)
+                summary['name'] = name
+                summary['hedges'] = '/'.join(
+                    str(S3_HEDGED_REQUESTS._values.get((outcome,), 0) - hedges_before.get((outcome,), 0))
+                    for outcome in ('sent', 'won'))
+                return summary
+
+            slow = f"slow tail ({args.slow_fraction:.0%} +{args.slow_ms:g}ms)"
+            results = [
+                scenario("healthy", args.requests),
+                scenario(f"{slow}", args.requests, slow_fraction=args.slow_fraction),
+                scenario(f"{slow}, hedged", args.requests, slow_fraction=args.slow_fraction, hedge=True),
+                scenario("outage, no breaker", args.outage_requests, error_fraction=1.0),
+                scenario("outage, breaker", args.outage_requests, error_fraction=1.0,
+                         breaker=s3_module.S3_BREAKER_THRESHOLD or 5),
+            ]
+
+    print(f"{args.requests} downloads of {args.file_size // 1024} KB per scenario "
+          f"({args.outage_requests} during outages), {args.concurrency} clients")
+    print(f"{'scenario':38s} {'p50 ms':>8s} {'p95 ms':>8s} {'p99 ms':>8s} {'failed':>7s} {'hedges':>9s}")
+    for result in results:
+        print(f"{result['name']:38s} {result['p50_ms']:8.1f} {result['p95_ms']:8.1f} "
+              f"{result['p99_ms']:8.1f} {result['failed']:7d} {result['hedges']:>9s}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+"""
+Compare download throughput of the S3 and local storage backends.
+
+For each backend, boots the app under gunicorn (sync workers, which hand
+file responses to sendfile(2)) against the local stand-ins (see harness.py),
+uploads N files, then downloads them through /server-files/download from
+--concurrency clients. Reports MB/s, request latency and the CPU seconds the
+app's processes spent per GB served: on the local backend file bytes go
+from disk to socket inside the kernel, so it should be a small fraction of
+the S3 backend's, which buffers every object in Python.
+
+Needs gunicorn (requirements-bench.txt) and Linux /proc for the CPU column.
+
+Usage:
+    python benchmarks/bench_storage_backends.py [--files 40] [--file-size 4194304] [--concurrency 8]
+"""
+
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+
+def process_tree(pid):
+    pids = [pid]
+    for child in pids:
+        try:
+            with open(f"/proc/{child}/task/{child}/children") as f:
+                pids += [int(p) for p in f.read().split()]
+        except OSError:
+            pass
+    return pids
+
+
+def cpu_seconds(pids):
+    """User + system CPU seconds of live processes, from /proc"""
+    ticks = os.sysconf('SC_CLK_TCK')
+    total = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            total += (int(fields[11]) + int(fields[12])) / ticks
+        except OSError:
+            pass
+    return total
+
+
+def start_gunicorn(workers):
+    import requests
+
+    port = harness.free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f"127.0.0.1:{port}",
+         '--log-level', 'warning', 'server:create_app()'],
+        cwd=harness.ROOT)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            requests.get(f"http://127.0.0.1:{port}/", timeout=5)
+            # Let every worker boot before counting CPU
+            time.sleep(1)
+            return process, f"http://127.0.0.1:{port}"
+        except requests.RequestException:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("gunicorn did not start")
+
+
+def run_backend(backend, args, dsn, s3_endpoint):
+    import requests
+
+    root = tempfile.mkdtemp(prefix='bench-storage-')
+    harness.configure_environment(dsn, s3_endpoint, extra={
+        'STORAGE_BACKEND': backend, 'STORAGE_ROOT': root, 'UPLOAD_GC_INTERVAL': '0'})
+    subprocess.run([sys.executable, '-c', 'import server; server.init_database(); '
+                    'from services.storage import storage; storage.ensure_ready()'],
+                   cwd=harness.ROOT, check=True, stdout=subprocess.DEVNULL)
+    process, base_url = start_gunicorn(args.workers)
+    try:
+        session = requests.Session()
+        credentials = {"name": "Storage Bench", "email": f"storage-{backend}-{time.time()}@example.com",
+                       "password": "bench-password"}
+        session.post(f"{base_url}/auth/register", json=credentials).raise_for_status()
+        token = session.post(f"{base_url}/auth/login", json=credentials).json()['token']
+        headers = {'Authorization': f"Bearer {token}"}
+
+        file_ids = []
+        for start in range(0, args.files, 10):
+            batch = [('files', (f"invoice-{i}.pdf", os.urandom(args.file_size), 'application/pdf'))
+                     for i in range(start, min(start + 10, args.files))]
+            response = session.post(f"{base_url}/server-files/upload-batch", headers=headers, files=batch)
+            response.raise_for_status()
+            file_ids += [r["file_id"] for r in response.json()["results"]]
+
+        downloads = [file_ids[i % len(file_ids)] for i in range(args.files * args.rounds)]
+        local = threading.local()
+
+        def download(file_id):
+            if not hasattr(local, 'session'):
+                local.session = requests.Session()
+            started = time.perf_counter()
+            response = local.session.get(f"{base_url}/server-files/download/{file_id}", headers=headers, stream=True)
+            response.raise_for_status()
+            size = sum(len(chunk) for chunk in response.iter_content(256 * 1024))
+            return size, time.perf_counter() - started
+
+        pids = process_tree(process.pid)
+        cpu_before = cpu_seconds(pids)
+        started = time.perf_counter()
+        with ThreadPoolExecutor(args.concurrency) as pool:
+            results = list(pool.map(download, downloads))
+        elapsed = time.perf_counter() - started
+        cpu = cpu_seconds(pids) - cpu_before
+
+        total = sum(size for size, _ in results)
+        assert total == len(downloads) * args.file_size
+        summary = harness.summarize_latencies([latency for _, latency in results], elapsed)
+        return {'backend': backend, 'mb_per_s': total / elapsed / (1024 * 1024),
+                'p50_ms': summary['p50_ms'], 'p99_ms': summary['p99_ms'],
+                'cpu_per_gb': cpu / (total / 1024 ** 3)}
+    finally:
+        process.terminate()
+        process.wait()
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=40)
+    parser.add_argument('--file-size', type=int, default=4 * 1024 * 1024)
+    parser.add_argument('--rounds', type=int, default=5, help="times each file is downloaded")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--backends', default='s3,local')
+    parser.add_argument('--postgres-dsn')
+    parser.add_argument('--pg-bin')
+    parser.add_argument('--s3-endpoint')
+    args = parser.parse_args()
+
+    results = []
+    with harness.postgres_standin(args.postgres_dsn, args.pg_bin) as pg, \
+            harness.s3_standin(args.s3_endpoint) as s3:
+        for backend in args.backends.split(','):
+            results.append(run_backend(backend, args, pg.dsn, s3.endpoint))
+
+    print(f"{args.files * args.rounds} downloads of {args.file_size // 1024} KB, "
+          f"{args.concurrency} clients, {args.workers} gunicorn workers")
+    print(f"{'backend':8s} {'MB/s':>8s} {'p50 ms':>8s} {'p99 ms':>8s} {'CPU s/GB':>9s}")
+    for result in results:
+        print(f"{result['backend']:8s} {result['mb_per_s']:8.1f} {result['p50_ms']:8.1f} "
+              f"{result['p99_ms']:8.1f} {result['cpu_per_gb']:9.2f}")
+
+
+if __name__ == "__main__":
+    main()
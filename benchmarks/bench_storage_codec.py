@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark of the storage codec on invoice-shaped documents.
+
+For HTML and plain-text invoices of several sizes, reports the compression
+ratio, compress and decompress throughput and the storage saved for gzip
+and zstd at a few levels, and which encoding services.storage_codec picks
+for each document. Used to choose the STORAGE_*_LEVEL defaults: objects are
+compressed once on upload and decompressed on every download that does not
+accept the stored encoding.
+
+Usage:
+    python benchmarks/bench_storage_codec.py [--sizes 4,64,512,4096] [--repeat 5]
+"""
+
+import argparse
+import io
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services import storage_codec  # noqa: E402
+from services.storage_codec import decode_chunks, encode_stream, storage_encoding, zstandard  # noqa: E402
+
+ITEMS = ["Consulting hours", "Website hosting (monthly)", "Logo design", "Support retainer",
+         "Travel expenses", "Software licence", "Printing", "Domain renewal"]
+
+
+def make_html(kilobytes, seed=42):
+    rng = random.Random(seed)
+    head = ("<!DOCTYPE html><html><head><meta charset=\"utf-8\"><style>"
+            "body{font-family:Helvetica,Arial,sans-serif;margin:40px}table{width:100%;border-collapse:collapse}"
+            "td,th{padding:6px 8px;border-bottom:1px solid #ddd}.total{font-weight:bold}</style></head><body>"
+            "<h1>Invoice INV-2024-0042</h1><p>Acme Ltd, 1 Main Street, Springfield</p><table>"
+            "<tr><th>Description</th><th>Qty</th><th>Unit</th><th>Amount</th></tr>\n")
+    rows = []
+    size = len(head)
+    while size < kilobytes * 1024:
+        qty = rng.randint(1, 40)
+        unit = rng.randint(100, 50000) / 100
+        row = (f"<tr><td>{rng.choice(ITEMS)}</td><td>{qty}</td><td>${unit:,.2f}</td>"
+               f"<td class=\"amount\">${qty * unit:,.2f}</td></tr>\n")
+        rows.append(row)
+        size += len(row)
+    return (head + "".join(rows) + "</table><p class=\"total\">Total due</p></body></html>").encode()
+
+
+def make_text(kilobytes, seed=7):
+    rng = random.Random(seed)
+    lines = ["INVOICE INV-2024-0042", "Acme Ltd", ""]
+    size = 0
+    while size < kilobytes * 1024:
+        qty = rng.randint(1, 40)
+        unit = rng.randint(100, 50000) / 100
+        line = f"{rng.choice(ITEMS):30s} {qty:4d} x {unit:10,.2f} = {qty * unit:12,.2f}"
+        lines.append(line)
+        size += len(line) + 1
+    return "\n".join(lines).encode()
+
+
+def best_of(fn, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def measure(data, encoding, repeat):
+    encoded_time, encoded = best_of(lambda: encode_stream(io.BytesIO(data), encoding).read(), repeat)
+    chunks = [encoded[i:i + storage_codec.CHUNK_SIZE] for i in range(0, len(encoded), storage_codec.CHUNK_SIZE)]
+    decoded_time, decoded = best_of(lambda: b"".join(decode_chunks(chunks, encoding)), repeat)
+    assert decoded == data
+    return len(encoded), encoded_time, decoded_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--sizes', default='4,64,512,4096', help="document sizes in KB")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    codecs = [('gzip', level) for level in (1, 6, 9)]
+    if zstandard is not None:
+        codecs += [('zstd', level) for level in (3, 9, 15)]
+    else:
+        print("zstandard is not installed; only gzip is measured")
+
+    print(f"{'document':22s} {'codec':9s} {'ratio':>7s} {'saved':>8s} {'comp MB/s':>10s} {'decomp MB/s':>12s}")
+    for kilobytes in (int(size) for size in args.sizes.split(',')):
+        for kind, content_type, data in (('html', 'text/html', make_html(kilobytes)),
+                                         ('text', 'text/plain', make_text(kilobytes))):
+            name = f"{kind} {kilobytes} KB"
+            for encoding, level in codecs:
+                storage_codec.STORAGE_GZIP_LEVEL = storage_codec.STORAGE_ZSTD_LEVEL = level
+                size, encode_time, decode_time = measure(data, encoding, args.repeat)
+                megabytes = len(data) / (1024 * 1024)
+                print(f"{name:22s} {encoding + '-' + str(level):9s} {len(data) / size:6.1f}x "
+                      f"{(len(data) - size) / 1024:7.0f}K {megabytes / encode_time:10.1f} "
+                      f"{megabytes / decode_time:12.1f}")
+            print(f"{name:22s} stored as: {storage_encoding(content_type, len(data)) or 'identity'}")
+
+
+if __name__ == "__main__":
+    main()
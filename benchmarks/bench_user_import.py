@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""
+Measure bulk user import throughput against one registration per user.
+
+Boots the app against the local stand-ins (see harness.py), registers a
+sample of users one POST /auth/register at a time, then imports growing
+CSV and NDJSON files through POST /users/import and reports users/s for
+each. A last import re-sends the largest file with on_conflict=update, so
+every row takes the conflict path.
+
+Usage:
+    python benchmarks/bench_user_import.py [--users 200000] [--register 500]
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+ADMIN_TOKEN = 'bench-admin'
+
+
+def csv_body(prefix, count):
+    lines = ["name,email,password"]
+    lines.extend(f"User {i},{prefix}{i}@example.com,password-{i}" for i in range(count))
+    return ('\n'.join(lines) + '\n').encode()
+
+
+def ndjson_body(prefix, count):
+    return ''.join(json.dumps({"name": f"User {i}", "email": f"{prefix}{i}@example.com",
+                               "password": f"password-{i}"}) + '\n' for i in range(count)).encode()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=200000, help="Rows in the largest import")
+    parser.add_argument('--steps', type=int, default=3, help="File sizes measured, growing tenfold up to --users")
+    parser.add_argument('--register', type=int, default=500, help="Users registered one by one for comparison")
+    parser.add_argument('--postgres-dsn')
+    parser.add_argument('--pg-bin')
+    parser.add_argument('--s3-endpoint')
+    args = parser.parse_args()
+
+    import requests
+
+    with harness.postgres_standin(args.postgres_dsn, args.pg_bin) as pg, \
+            harness.s3_standin(args.s3_endpoint) as s3:
+        harness.configure_environment(pg.dsn, s3.endpoint, extra={'ADMIN_TOKEN': ADMIN_TOKEN})
+        with harness.AppServer() as app:
+            session = requests.Session()
+            admin = {'X-Admin-Token': ADMIN_TOKEN}
+
+            print(f"{'method':>24s} {'users':>9s} {'seconds':>8s} {'users/s':>10s}")
+            started = time.perf_counter()
+            for i in range(args.register):
+                response = session.post(f"{app.base_url}/auth/register", json={
+                    "name": f"User {i}", "email": f"register{i}@example.com", "password": f"password-{i}"})
+                response.raise_for_status()
+            elapsed = time.perf_counter() - started
+            print(f"{'POST /auth/register':>24s} {args.register:9d} {elapsed:8.3f} {args.register / elapsed:10,.0f}")
+
+            def run(label, body, content_type, expected, **params):
+                started = time.perf_counter()
+                response = session.post(f"{app.base_url}/users/import", data=body, params=params,
+                                        headers={**admin, 'Content-Type': content_type})
+                elapsed = time.perf_counter() - started
+                response.raise_for_status()
+                report = response.json()
+                assert report[expected] == report['rows'], report
+                print(f"{label:>24s} {report['rows']:9d} {elapsed:8.3f} {report['rows'] / elapsed:10,.0f}")
+
+            counts = sorted({max(1, args.users // 10 ** step) for step in range(args.steps)})
+            for count in counts:
+                run('import csv', csv_body(f"csv{count}-", count), 'text/csv', 'created')
+                run('import ndjson', ndjson_body(f"ndjson{count}-", count), 'application/x-ndjson', 'created')
+            largest = counts[-1]
+            run('import csv, all updated', csv_body(f"csv{largest}-", largest), 'text/csv', 'updated',
+                on_conflict='update')
+
+            # Imported passwords work like registered ones
+            response = session.post(f"{app.base_url}/auth/login", json={
+                "email": f"csv{largest}-0@example.com", "password": "password-0"})
+            response.raise_for_status()
+            print("imported user can log in")
+
+
+if __name__ == "__main__":
+    main()
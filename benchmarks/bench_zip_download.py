@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+"""
+Measure /server-files/download-zip throughput, memory and resume behaviour.
+
+Boots the app against the local stand-ins (see harness.py), uploads N files,
+then downloads them one request per file and as one archive with growing
+file counts, reporting throughput and the app's peak traced allocation
+during each archive download (which should stay flat as it grows). Finally
+it cuts a download short and resumes it with Range/If-Range, checking the
+stitched archive is identical and valid.
+
+Usage:
+    python benchmarks/bench_zip_download.py [--files 400] [--file-size 65536]
+"""
+
+import argparse
+import io
+import os
+import sys
+import time
+import tracemalloc
+import zipfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+
+def login(session, base_url):
+    credentials = {"name": "Zip Bench", "email": f"zip-{time.time()}@example.com",
+                   "password": "bench-password"}
+    session.post(f"{base_url}/auth/register", json=credentials).raise_for_status()
+    response = session.post(f"{base_url}/auth/login", json=credentials)
+    response.raise_for_status()
+    return {'Authorization': f"Bearer {response.json()['token']}"}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--files', type=int, default=400)
+    parser.add_argument('--file-size', type=int, default=64 * 1024)
+    parser.add_argument('--postgres-dsn')
+    parser.add_argument('--pg-bin')
+    parser.add_argument('--s3-endpoint')
+    args = parser.parse_args()
+
+    import requests
+
+    with harness.postgres_standin(args.postgres_dsn, args.pg_bin) as pg, \
+            harness.s3_standin(args.s3_endpoint) as s3:
+        harness.configure_environment(pg.dsn, s3.endpoint)
+        with harness.AppServer() as app:
+            session = requests.Session()
+            headers = login(session, app.base_url)
+            file_ids = []
+            for start in range(0, args.files, 100):
+                batch = [('files', (f"invoice-{i}.pdf", os.urandom(args.file_size), 'application/pdf'))
+                         for i in range(start, min(start + 100, args.files))]
+                response = session.post(f"{app.base_url}/server-files/upload-batch",
+                                        headers=headers, files=batch)
+                response.raise_for_status()
+                file_ids += [r["file_id"] for r in response.json()["results"]]
+
+            url = f"{app.base_url}/server-files/download-zip"
+
+            def download(count):
+                response = session.post(url, headers=headers, json={"file_ids": file_ids[:count]},
+                                        stream=True)
+                response.raise_for_status()
+                return sum(len(chunk) for chunk in response.iter_content(256 * 1024))
+
+            started = time.perf_counter()
+            for file_id in file_ids:
+                session.get(f"{app.base_url}/server-files/download/{file_id}",
+                            headers=headers).raise_for_status()
+            single = time.perf_counter() - started
+            print(f"one request per file: {args.files} files in {single:.3f}s")
+
+            print(f"{'files':>6s} {'archive MB':>10s} {'seconds':>8s} {'MB/s':>8s} {'peak alloc MB':>13s}")
+            for count in sorted({max(1, args.files // 8), max(1, args.files // 2), args.files}):
+                started = time.perf_counter()
+                received = download(count)
+                elapsed = time.perf_counter() - started
+                # Tracing slows the app down, so memory is measured on a
+                # separate pass; the app runs in this process, so
+                # tracemalloc sees its allocations
+                tracemalloc.start()
+                download(count)
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+                print(f"{count:6d} {received / 1e6:10.1f} {elapsed:8.3f} "
+                      f"{received / 1e6 / elapsed:8.1f} {peak / 1e6:13.1f}")
+
+            # Interrupt halfway, then resume from where the client stopped
+            response = session.get(url, headers=headers, params={"ids": ','.join(map(str, file_ids))})
+            full = response.content
+            etag = response.headers['ETag']
+            partial = full[:len(full) // 2]
+            resumed = session.get(url, headers={**headers, 'Range': f"bytes={len(partial)}-",
+                                                'If-Range': etag},
+                                  params={"ids": ','.join(map(str, file_ids))})
+            assert resumed.status_code == 206, resumed.status_code
+            assert partial + resumed.content == full, "resumed archive differs"
+            archive = zipfile.ZipFile(io.BytesIO(full))
+            assert archive.testzip() is None and len(archive.namelist()) == len(file_ids)
+            print(f"resume from byte {len(partial)}: 206, stitched archive identical and valid")
+
+
+if __name__ == "__main__":
+    main()
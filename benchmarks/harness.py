@@ -0,0 +1,383 @@
+"""
+Local stand-ins for the benchmark suite.
+
+Boots a throwaway PostgreSQL cluster (initdb + pg_ctl in a temp directory)
+and a moto S3 server, points the app's environment at them, and serves the
+real Flask app from a background thread. Nothing here talks to AWS or to a
+shared database. FaultyS3 sits in front of either S3 stand-in to make it
+slow or failing on demand, and ThrowawayReplica adds a streaming standby
+of the throwaway cluster.
+
+Either stand-in can be replaced by a real service with --postgres-dsn or
+--s3-endpoint when benchmarking against production-like infrastructure.
+"""
+
+import http.client
+import logging
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+BENCH_BUCKET = 'bench-invoice-files'
+
+
+# Per-request access logs from the app and moto would swamp the report
+logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def find_pg_bin(pg_bin=None):
+    """Locate the directory holding initdb/pg_ctl"""
+    candidates = [pg_bin, os.getenv('PG_BIN')]
+    initdb = shutil.which('initdb')
+    if initdb:
+        candidates.append(os.path.dirname(initdb))
+    try:
+        candidates.append(subprocess.run(['pg_config', '--bindir'], capture_output=True,
+                                         text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        pass
+    candidates.extend(sorted(
+        (os.path.join('/usr/lib/postgresql', version, 'bin')
+         for version in (os.listdir('/usr/lib/postgresql') if os.path.isdir('/usr/lib/postgresql') else [])),
+        reverse=True))
+    for candidate in candidates:
+        if candidate and os.path.exists(os.path.join(candidate, 'initdb')):
+            return candidate
+    raise RuntimeError("initdb not found; install PostgreSQL, set PG_BIN, or pass --postgres-dsn")
+
+
+class ThrowawayPostgres:
+    """A PostgreSQL cluster living in a temp directory for the duration of a run"""
+
+    def __init__(self, pg_bin=None, dbname='bench', settings=None):
+        self.pg_bin = find_pg_bin(pg_bin)
+        self.dbname = dbname
+        self.settings = settings or {}
+        self.port = free_port()
+        self.datadir = None
+
+    def __enter__(self):
+        self.datadir = tempfile.mkdtemp(prefix='invoice-bench-pg-')
+        subprocess.run([os.path.join(self.pg_bin, 'initdb'), '-D', self.datadir, '-U', 'postgres',
+                        '--auth=trust', '-E', 'UTF8'], check=True, capture_output=True)
+        options = [f"-p {self.port}", f"-k {self.datadir}", "-c listen_addresses=127.0.0.1",
+                   "-c fsync=off", "-c synchronous_commit=off", "-c full_page_writes=off"]
+        options.extend(f"-c {key}={value}" for key, value in self.settings.items())
+        subprocess.run([os.path.join(self.pg_bin, 'pg_ctl'), '-D', self.datadir, '-w',
+                        '-l', os.path.join(self.datadir, 'server.log'),
+                        '-o', ' '.join(options), 'start'], check=True, capture_output=True)
+        import psycopg2
+        admin = psycopg2.connect(dbname='postgres', user='postgres',
+                                 host='127.0.0.1', port=self.port)
+        admin.autocommit = True
+        admin.cursor().execute(f'CREATE DATABASE "{self.dbname}"')
+        admin.close()
+        return self
+
+    def __exit__(self, *exc):
+        subprocess.run([os.path.join(self.pg_bin, 'pg_ctl'), '-D', self.datadir,
+                        '-m', 'immediate', 'stop'], capture_output=True)
+        shutil.rmtree(self.datadir, ignore_errors=True)
+
+    @property
+    def dsn(self):
+        return f"postgresql://postgres@127.0.0.1:{self.port}/{self.dbname}"
+
+
+class ThrowawayReplica:
+    """A streaming standby of a ThrowawayPostgres, cloned with pg_basebackup"""
+
+    def __init__(self, primary, settings=None):
+        self.primary = primary
+        self.pg_bin = primary.pg_bin
+        self.dbname = primary.dbname
+        self.settings = settings or {}
+        self.port = free_port()
+        self.datadir = None
+
+    def __enter__(self):
+        self.datadir = tempfile.mkdtemp(prefix='invoice-bench-replica-')
+        # -R writes standby.signal and the primary's connection settings
+        subprocess.run([os.path.join(self.pg_bin, 'pg_basebackup'), '-D', self.datadir, '-h', '127.0.0.1',
+                        '-p', str(self.primary.port), '-U', 'postgres', '-R', '-X', 'stream'],
+                       check=True, capture_output=True)
+        self.start()
+        return self
+
+    def start(self):
+        options = [f"-p {self.port}", f"-k {self.datadir}", "-c listen_addresses=127.0.0.1", "-c fsync=off"]
+        options.extend(f"-c {key}={value}" for key, value in self.settings.items())
+        subprocess.run([os.path.join(self.pg_bin, 'pg_ctl'), '-D', self.datadir, '-w',
+                        '-l', os.path.join(self.datadir, 'server.log'),
+                        '-o', ' '.join(options), 'start'], check=True, capture_output=True)
+
+    def stop(self):
+        subprocess.run([os.path.join(self.pg_bin, 'pg_ctl'), '-D', self.datadir,
+                        '-m', 'immediate', 'stop'], capture_output=True)
+
+    def __exit__(self, *exc):
+        self.stop()
+        shutil.rmtree(self.datadir, ignore_errors=True)
+
+    @property
+    def address(self):
+        return f"127.0.0.1:{self.port}"
+
+    @property
+    def dsn(self):
+        return f"postgresql://postgres@127.0.0.1:{self.port}/{self.dbname}"
+
+
+class ExternalPostgres:
+    """Use an existing database given as a postgresql:// DSN"""
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+class MotoS3:
+    """An in-process moto S3 server"""
+
+    def __init__(self):
+        self.port = free_port()
+        self.server = None
+
+    def __enter__(self):
+        from moto.server import ThreadedMotoServer
+        self.server = ThreadedMotoServer(ip_address='127.0.0.1', port=self.port, verbose=False)
+        self.server.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.stop()
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.port}"
+
+
+class ExternalS3:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        pass
+
+
+def configure_environment(dsn, s3_endpoint, bucket=BENCH_BUCKET, extra=None):
+    """Point the app's configuration at the stand-ins; must run before importing the app"""
+    parsed = urlparse(dsn)
+    os.environ.update({
+        'DB_NAME': parsed.path.lstrip('/'),
+        'DB_USER': parsed.username or 'postgres',
+        'DB_PASSWORD': parsed.password or '',
+        'DB_HOST': parsed.hostname or '127.0.0.1',
+        'DB_PORT': str(parsed.port or 5432),
+        'S3_ENDPOINT_URL': s3_endpoint,
+        'S3_BUCKET_NAME': bucket,
+        'AWS_ACCESS_KEY_ID': os.getenv('BENCH_AWS_ACCESS_KEY_ID', 'testing'),
+        'AWS_SECRET_ACCESS_KEY': os.getenv('BENCH_AWS_SECRET_ACCESS_KEY', 'testing'),
+        'AWS_REGION': 'us-east-1',
+        'DEBUG': 'False',
+    })
+    os.environ.update(extra or {})
+
+
+class AppServer:
+    """Serve the real Flask app on a background thread"""
+
+    def __init__(self, threaded=True):
+        self.threaded = threaded
+        self.port = free_port()
+        self.server = None
+        self.thread = None
+
+    def __enter__(self):
+        import server
+        from werkzeug.serving import make_server
+        from services.storage import storage
+
+        server.init_database()
+        storage.ensure_ready()
+        app = server.create_app()
+        self.server = make_server('127.0.0.1', self.port, app, threaded=self.threaded)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self._wait_ready()
+        return self
+
+    def _wait_ready(self, timeout=10):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                with socket.create_connection(('127.0.0.1', self.port), timeout=0.5):
+                    return
+            except OSError:
+                time.sleep(0.05)
+        raise RuntimeError("App server did not start")
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+
+class _FaultyS3Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Hop-by-hop headers, and Expect, which the handler has already answered
+    DROPPED_HEADERS = {'connection', 'keep-alive', 'transfer-encoding', 'expect'}
+
+    def log_message(self, *args):
+        pass
+
+    def _proxy(self):
+        faults = self.server.faults
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if faults.roll() < faults.error_fraction:
+            payload = (b'<?xml version="1.0" encoding="UTF-8"?><Error><Code>SlowDown</Code>'
+                       b'<Message>Please reduce your request rate.</Message></Error>')
+            self.send_response(503)
+            self.send_header('Content-Type', 'application/xml')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+            return
+        time.sleep(faults.slow_latency if faults.roll() < faults.slow_fraction else faults.latency)
+
+        upstream = http.client.HTTPConnection(faults.upstream.hostname, faults.upstream.port, timeout=60)
+        try:
+            upstream.request(self.command, self.path, body=body, headers={
+                name: value for name, value in self.headers.items()
+                if name.lower() not in self.DROPPED_HEADERS})
+            response = upstream.getresponse()
+            data = response.read()
+        finally:
+            upstream.close()
+        self.send_response(response.status)
+        for name, value in response.getheaders():
+            if name.lower() not in self.DROPPED_HEADERS and (
+                    name.lower() != 'content-length' or self.command == 'HEAD'):
+                self.send_header(name, value)
+        if self.command != 'HEAD':
+            self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(data)
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = _proxy
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clients drop connections when they give up on a slow response
+        pass
+
+
+class FaultyS3:
+    """Proxy in front of another S3 endpoint that injects latency and errors
+
+    Every request waits `latency` seconds, a `slow_fraction` of them
+    `slow_latency` seconds instead, and an `error_fraction` of them is
+    answered 503 SlowDown without reaching the upstream. The attributes can
+    be changed while it runs.
+    """
+
+    def __init__(self, upstream, latency=0.0, slow_fraction=0.0, slow_latency=0.0, error_fraction=0.0, seed=1):
+        self.upstream = urlparse(upstream)
+        self.latency = latency
+        self.slow_fraction = slow_fraction
+        self.slow_latency = slow_latency
+        self.error_fraction = error_fraction
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self.port = free_port()
+        self.server = None
+
+    def roll(self):
+        with self._random_lock:
+            return self._random.random()
+
+    def __enter__(self):
+        self.server = _QuietHTTPServer(('127.0.0.1', self.port), _FaultyS3Handler)
+        self.server.faults = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+    @property
+    def endpoint(self):
+        return f"http://127.0.0.1:{self.port}"
+
+
+def postgres_standin(dsn=None, pg_bin=None, settings=None):
+    return ExternalPostgres(dsn) if dsn else ThrowawayPostgres(pg_bin, settings=settings)
+
+
+def s3_standin(endpoint=None):
+    return ExternalS3(endpoint) if endpoint else MotoS3()
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def summarize_latencies(latencies, elapsed):
+    """p50/p95/p99 (ms) and throughput for a list of latencies in seconds"""
+    ordered = sorted(latencies)
+    count = len(ordered)
+    return {
+        "count": count,
+        "req_per_sec": round(count / elapsed, 2) if elapsed else None,
+        "mean_ms": round(sum(ordered) / count * 1000, 3) if count else None,
+        "p50_ms": round(percentile(ordered, 0.50) * 1000, 3) if count else None,
+        "p95_ms": round(percentile(ordered, 0.95) * 1000, 3) if count else None,
+        "p99_ms": round(percentile(ordered, 0.99) * 1000, 3) if count else None,
+        "max_ms": round(ordered[-1] * 1000, 3) if count else None,
+    }
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test.
+
+Boots the app against a throwaway PostgreSQL cluster and a moto S3 server,
+seeds users and files, then drives a weighted mix of login, list, upload,
+download and convert requests from concurrent workers over real HTTP.
+Per-endpoint p50/p95/p99 latency, error counts and req/s are written as JSON
+so runs can be compared across commits.
+
+Usage:
+    python benchmarks/loadtest.py --concurrency 8 --duration 30 --output run.json
+    python benchmarks/loadtest.py --compare baseline.json run.json
+
+Requires the packages in requirements-bench.txt and PostgreSQL server
+binaries (initdb/pg_ctl) unless --postgres-dsn points at an existing database.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+DEFAULT_MIX = "login=1,list=6,upload=2,download=4,convert=1"
+SEED_PASSWORD = 'bench-password'
+
+INVOICE_HTML = """<div class="invoice"><h1>Invoice #{number}</h1>
+<table>{rows}</table><p>Total due: ${total}</p></div>"""
+
+
+def parse_mix(spec):
+    mix = {}
+    for part in spec.split(','):
+        name, _, weight = part.partition('=')
+        if name.strip():
+            mix[name.strip()] = float(weight or 1)
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise SystemExit(f"Unknown operations in --mix: {', '.join(sorted(unknown))}")
+    return mix
+
+
+def seed(dsn, s3_endpoint, bucket, users, files_per_user, file_size):
+    """Insert users and files directly through SQL and S3 so seeding is fast"""
+    import boto3
+    import psycopg2
+    from psycopg2.extras import execute_values
+
+    s3 = boto3.client('s3', endpoint_url=s3_endpoint, region_name='us-east-1',
+                      aws_access_key_id=os.environ['AWS_ACCESS_KEY_ID'],
+                      aws_secret_access_key=os.environ['AWS_SECRET_ACCESS_KEY'])
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    password_hash = hashlib.sha256(SEED_PASSWORD.encode()).hexdigest()
+    run_id = int(time.time())
+    accounts = execute_values(cur, "INSERT INTO users (name, email, password_hash) VALUES %s RETURNING id, email", [
+        (f"Bench User {i}", f"bench{i}-{run_id}@example.com", password_hash)
+        for i in range(users)
+    ], fetch=True)
+
+    body = os.urandom(file_size)
+    rows = []
+    for user_id, _ in accounts:
+        for n in range(files_per_user):
+            key = f"user_{user_id}/seed-{n}-invoice-{n}.pdf"
+            s3.put_object(Bucket=bucket, Key=key, Body=body, ContentType='application/pdf')
+            rows.append((user_id, f"invoice-{n}.pdf", key, file_size))
+    execute_values(cur, "INSERT INTO user_files (user_id, filename, s3_key, file_size) VALUES %s", rows)
+    conn.commit()
+    conn.close()
+    return [{"user_id": user_id, "email": email} for user_id, email in accounts]
+
+
+class Worker(threading.Thread):
+    def __init__(self, base_url, account, mix, deadline, request_budget, file_size, results, lock, rng_seed):
+        super().__init__(daemon=True)
+        import requests
+        self.session = requests.Session()
+        self.base_url = base_url
+        self.account = account
+        self.operations = list(mix)
+        self.weights = [mix[name] for name in self.operations]
+        self.deadline = deadline
+        self.request_budget = request_budget
+        self.file_size = file_size
+        self.results = results
+        self.lock = lock
+        self.random = random.Random(rng_seed)
+        self.token = None
+        self.file_ids = []
+
+    def record(self, name, started, ok):
+        elapsed = time.perf_counter() - started
+        with self.lock:
+            entry = self.results.setdefault(name, {"latencies": [], "errors": 0})
+            entry["latencies"].append(elapsed)
+            if not ok:
+                entry["errors"] += 1
+
+    def auth_headers(self):
+        return {'Authorization': f"Bearer {self.token}"}
+
+    def run(self):
+        op_login(self)
+        while time.time() < self.deadline and self.request_budget.take():
+            name = self.random.choices(self.operations, self.weights)[0]
+            try:
+                OPERATIONS[name](self)
+            except Exception:
+                # Transport failures have no meaningful latency; count them only
+                with self.lock:
+                    self.results.setdefault(name, {"latencies": [], "errors": 0})["errors"] += 1
+
+
+class RequestBudget:
+    """Shared cap on the total number of requests (None for unlimited)"""
+
+    def __init__(self, total):
+        self.remaining = total
+        self.lock = threading.Lock()
+
+    def take(self):
+        if self.remaining is None:
+            return True
+        with self.lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+def op_login(worker):
+    started = time.perf_counter()
+    response = worker.session.post(f"{worker.base_url}/auth/login", json={
+        "email": worker.account["email"], "password": SEED_PASSWORD})
+    ok = response.status_code == 200
+    if ok:
+        worker.token = response.json()["token"]
+    worker.record('login', started, ok)
+
+
+def op_list(worker):
+    started = time.perf_counter()
+    response = worker.session.get(f"{worker.base_url}/server-files/", headers=worker.auth_headers())
+    ok = response.status_code == 200
+    if ok:
+        worker.file_ids = [f["id"] for f in response.json()["files"]]
+    worker.record('list', started, ok)
+
+
+def op_upload(worker):
+    body = os.urandom(worker.file_size)
+    started = time.perf_counter()
+    response = worker.session.post(
+        f"{worker.base_url}/server-files/upload", headers=worker.auth_headers(),
+        files={'file': (f"upload-{worker.random.randint(0, 10 ** 9)}.pdf", body, 'application/pdf')})
+    worker.record('upload', started, response.status_code == 200)
+
+
+def op_download(worker):
+    if not worker.file_ids:
+        op_list(worker)
+        if not worker.file_ids:
+            return
+    file_id = worker.random.choice(worker.file_ids)
+    started = time.perf_counter()
+    response = worker.session.get(f"{worker.base_url}/server-files/download/{file_id}",
+                                  headers=worker.auth_headers())
+    worker.record('download', started, response.status_code == 200)
+
+
+def op_convert(worker):
+    rows = ''.join(f"<tr><td>Item {i}</td><td>{i}</td><td>${i * 3}.00</td></tr>" for i in range(40))
+    html = INVOICE_HTML.format(number=worker.random.randint(1000, 9999), rows=rows, total=2340)
+    started = time.perf_counter()
+    response = worker.session.post(f"{worker.base_url}/pdf/convert",
+                                   json={"html_content": html, "filename": "bench.pdf"})
+    worker.record('convert', started, response.status_code == 200)
+
+
+OPERATIONS = {
+    'login': op_login,
+    'list': op_list,
+    'upload': op_upload,
+    'download': op_download,
+    'convert': op_convert,
+}
+
+
+def run(args):
+    mix = parse_mix(args.mix)
+    with harness.postgres_standin(args.postgres_dsn, args.pg_bin) as pg, \
+            harness.s3_standin(args.s3_endpoint) as s3:
+        harness.configure_environment(pg.dsn, s3.endpoint, args.bucket)
+        with harness.AppServer() as app:
+            print(f"App at {app.base_url}; seeding {args.users} users x {args.files_per_user} files...")
+            accounts = seed(pg.dsn, s3.endpoint, args.bucket, args.users,
+                            args.files_per_user, args.file_size)
+
+            results = {}
+            lock = threading.Lock()
+            budget = RequestBudget(args.requests)
+            deadline = time.time() + args.duration
+            workers = [Worker(app.base_url, accounts[i % len(accounts)], mix, deadline, budget,
+                              args.file_size, results, lock, args.seed + i)
+                       for i in range(args.concurrency)]
+            print(f"Running {args.concurrency} workers for up to {args.duration}s...")
+            started = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - started
+
+    endpoints = {}
+    all_latencies = []
+    total_errors = 0
+    for name, entry in sorted(results.items()):
+        endpoints[name] = harness.summarize_latencies(entry["latencies"], elapsed)
+        endpoints[name]["errors"] = entry["errors"]
+        all_latencies.extend(entry["latencies"])
+        total_errors += entry["errors"]
+    overall = harness.summarize_latencies(all_latencies, elapsed)
+    overall["errors"] = total_errors
+
+    return {
+        "revision": harness.git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "config": {
+            "concurrency": args.concurrency, "duration": args.duration, "requests": args.requests,
+            "mix": mix, "users": args.users, "files_per_user": args.files_per_user,
+            "file_size": args.file_size,
+        },
+        "elapsed_seconds": round(elapsed, 3),
+        "overall": overall,
+        "endpoints": endpoints,
+    }
+
+
+def compare(baseline_path, candidate_path):
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+    print(f"{'endpoint':10s} {'metric':12s} {baseline.get('revision') or 'baseline':>12s} "
+          f"{candidate.get('revision') or 'candidate':>12s} {'change':>8s}")
+    names = sorted(set(baseline["endpoints"]) | set(candidate["endpoints"]))
+    for name in names + ['overall']:
+        before = baseline["overall"] if name == 'overall' else baseline["endpoints"].get(name, {})
+        after = candidate["overall"] if name == 'overall' else candidate["endpoints"].get(name, {})
+        for metric in ('req_per_sec', 'p50_ms', 'p95_ms', 'p99_ms', 'errors'):
+            old, new = before.get(metric), after.get(metric)
+            change = f"{(new - old) / old * 100:+.1f}%" if old and new is not None else ''
+            print(f"{name:10s} {metric:12s} {str(old):>12s} {str(new):>12s} {change:>8s}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, default=30, help="Seconds to run")
+    parser.add_argument('--requests', type=int, default=None, help="Stop after this many requests")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Weighted operations (default {DEFAULT_MIX})")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--files-per-user', type=int, default=25)
+    parser.add_argument('--file-size', type=int, default=64 * 1024)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--postgres-dsn', help="Use an existing database instead of a throwaway cluster")
+    parser.add_argument('--pg-bin', help="Directory containing initdb/pg_ctl")
+    parser.add_argument('--s3-endpoint', help="Use an existing S3-compatible endpoint instead of moto")
+    parser.add_argument('--bucket', default=harness.BENCH_BUCKET)
+    parser.add_argument('--output', help="Write the JSON report here (default: stdout)")
+    parser.add_argument('--compare', nargs=2, metavar=('BASELINE', 'CANDIDATE'),
+                        help="Compare two JSON reports instead of running")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    report = run(args)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+        print(f"Report written to {args.output}")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,505 @@
+#!/usr/bin/env python3
+"""
+SQL query-plan regression suite.
+
+1. Boots the app against a throwaway PostgreSQL cluster and moto S3, then
+   drives every endpoint once through the Flask test client while recording
+   each SQL statement (and its parameters) the handlers execute.
+2. Loads a synthetic dataset (millions of users, files and logos by default)
+   and ANALYZEs it.
+3. Runs EXPLAIN (ANALYZE, BUFFERS) for every captured statement at that scale
+   and fails when a plan contains a sequential scan of a large table or an
+   explicit sort (except by a value computed from the statement's own
+   parameters, such as a search rank), unless the statement is allow-listed
+   below.
+
+Statements found by scanning apis/ and services/ for cursor.execute() literals
+that the scenario did not exercise are reported so new queries cannot slip
+through without a plan check.
+
+Usage:
+    python benchmarks/query_plans.py [--users 1000000] [--files-per-user 5] [--output plans.json]
+
+Exits with status 1 when any plan regresses.
+"""
+
+import argparse
+import ast
+import glob
+import io
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import harness  # noqa: E402
+
+# Statements whose full scan or sort is intentional, with the reason
+ALLOWED_PLANS = {
+    "SELECT id, name, email FROM users": "GET /users returns every user by design",
+    "SELECT part_number, size, ": "at most 10000 parts per session, found via the primary key; "
+                                  "the planner may sort the few rows of a bitmap scan",
+    "INSERT INTO users (name, email, password_hash) SELECT": "sorts one import's staging rows so user ids "
+                                                             "follow the file's order",
+    "WITH folded AS ( DELETE FROM storage_prefix_changes": "sorts one batch of folded directories so "
+                                                           "concurrent folds lock counters in the same order",
+    "INSERT INTO storage_prefixes (prefix, objects, bytes) SELECT COALESCE": "seeds the storage summary "
+                                                                             "counters once, from every row",
+    "SELECT prefix, objects, bytes FROM storage_prefixes": "the storage summary reconciliation compares "
+                                                           "every directory with its recount",
+}
+
+# Tables smaller than this are cheap to scan whatever the plan says
+DEFAULT_SCAN_THRESHOLD = 10000
+
+SORT_NODES = {'Sort', 'Incremental Sort'}
+
+
+def normalize(sql):
+    if isinstance(sql, bytes):
+        sql = sql.decode()
+    return ' '.join(str(sql).split())
+
+
+def is_data_statement(sql):
+    return sql.split(' ', 1)[0].upper() in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'WITH')
+
+
+def static_statements():
+    """Map normalized SQL literals passed to .execute() in apis/ and services/ to their locations"""
+    found = {}
+    paths = sorted(glob.glob(os.path.join(harness.ROOT, 'apis', '*.py')) +
+                   glob.glob(os.path.join(harness.ROOT, 'services', '*.py')))
+    for path in paths:
+        if path.endswith('schema.py'):
+            continue
+        with open(path) as f:
+            tree = ast.parse(f.read(), path)
+        for node in ast.walk(tree):
+            if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute)
+                    and node.func.attr in ('execute', 'executemany') and node.args):
+                continue
+            statement = node.args[0]
+            # Hot statements are wrapped in prepared("...")
+            if (isinstance(statement, ast.Call) and isinstance(statement.func, ast.Name)
+                    and statement.func.id == 'prepared' and statement.args):
+                statement = statement.args[0]
+            if isinstance(statement, ast.Constant) and isinstance(statement.value, str):
+                sql = normalize(statement.value)
+                if is_data_statement(sql):
+                    location = f"{os.path.relpath(path, harness.ROOT)}:{node.lineno}"
+                    found.setdefault(sql, []).append(location)
+    return found
+
+
+class StatementRecorder:
+    """Wraps the app's cursor class to record every data statement it executes"""
+
+    def __init__(self):
+        self.statements = {}
+
+    def install(self):
+        from services.database import InstrumentedCursor
+        recorder = self
+        original_execute = InstrumentedCursor.execute
+
+        def execute(cursor, query, vars=None):
+            sql = normalize(query)
+            if is_data_statement(sql):
+                recorder.statements[sql] = vars
+            return original_execute(cursor, query, vars)
+
+        InstrumentedCursor.execute = execute
+
+
+def run_scenario(client):
+    """Exercise every database-backed endpoint once"""
+    user_id = client.post('/auth/register', json={"name": "Plan User", "email": "plans@example.com",
+                                                  "password": "plan-password"}).get_json()["user_id"]
+    token = client.post('/auth/login', json={"email": "plans@example.com",
+                                             "password": "plan-password"}).get_json()["token"]
+    auth = {'Authorization': f"Bearer {token}"}
+
+    client.post('/users/', json={"name": "Other", "email": "other-plans@example.com"})
+    client.put('/users/', json={"id": user_id, "name": "Plan User", "email": "plans@example.com"})
+    client.get('/users/')
+    admin = {'X-Admin-Token': 'plan-admin'}
+    client.post('/users/import?on_conflict=update', headers=admin, content_type='text/csv',
+                data="name,email,password\nImported,imported@example.com,pw\nOther,other-plans@example.com,\n")
+    client.post('/users/import', headers=admin, content_type='application/x-ndjson',
+                data='{"name": "Imported", "email": "imported@example.com"}\n')
+    client.post('/users/import', headers=admin, data={
+        'file': (io.BytesIO(b"name,email\nUploaded,uploaded@example.com\n"), 'users.csv', 'text/csv')})
+
+    upload = client.post('/server-files/upload', headers=auth, data={
+        'file': (io.BytesIO(b"%PDF-1.4 plan"), 'plan.pdf', 'application/pdf')})
+    file_id = upload.get_json()["file_id"]
+    client.get('/server-files/', headers=auth)
+    client.get(f'/server-files/download/{file_id}', headers=auth)
+    client.get(f'/server-files/download-zip?ids={file_id}', headers=auth).get_data()
+    client.get('/server-files/download-zip?since=2000-01-01', headers=auth).get_data()
+    client.delete(f'/server-files/delete/{file_id}', headers=auth)
+
+    html = client.post('/server-files/upload', headers=auth, data={
+        'file': (io.BytesIO(b"<html><body><h1>Invoice</h1><p>Consulting services</p></body></html>"),
+                 'invoice.html', 'text/html')})
+    client.get('/server-files/search?q=invoice consulting', headers=auth)
+    client.get('/export/files', headers=auth).get_data()
+    client.get('/export/logos?format=csv', headers=auth).get_data()
+    client.get('/export/files?format=csv', headers=admin).get_data()
+    client.get('/export/logos', headers=admin).get_data()
+
+    from services.blobs import reap_blobs
+    from services.upload_sessions import collect_abandoned_uploads
+    client.post('/server-files/uploads', headers=auth, json={"filename": "abandoned.pdf", "size": 4})
+    collect_abandoned_uploads(ttl=0)
+    # A multipart upload that storage no longer knows, and no object
+    from services.storage import UploadNotFound, storage
+    gone = client.post('/server-files/uploads', headers=auth,
+                       json={"filename": "gone.pdf", "size": 4}).get_json()["upload_id"]
+    client.put(f'/server-files/uploads/{gone}?offset=0', headers=auth, data=b"%PDF")
+
+    def upload_gone(key, upload_id, parts):
+        raise UploadNotFound(upload_id)
+
+    storage.complete_multipart_upload = upload_gone
+    client.post(f'/server-files/uploads/{gone}/complete', headers=auth)
+    del storage.complete_multipart_upload
+    session = client.post('/server-files/uploads', headers=auth,
+                          json={"filename": "resumable.pdf", "size": 4}).get_json()["upload_id"]
+    client.post(f'/server-files/uploads/{session}/complete', headers=auth)
+    client.put(f'/server-files/uploads/{session}?offset=0', headers=auth, data=b"%PDF")
+    client.get(f'/server-files/uploads/{session}', headers=auth)
+    client.post(f'/server-files/uploads/{session}/complete', headers=auth)
+    client.post(f'/server-files/uploads/{session}/complete', headers=auth)
+    aborted = client.post('/server-files/uploads', headers=auth,
+                          json={"filename": "aborted.pdf", "size": 4}).get_json()["upload_id"]
+    client.delete(f'/server-files/uploads/{aborted}', headers=auth)
+    reap_blobs()
+
+    client.post('/upload/', data={'user_id': str(user_id),
+                                  'file': (io.BytesIO(b"legacy"), 'legacy.txt', 'text/plain')})
+    client.post('/delete/', json={"key": "no-such-key"})
+
+    png = b"\x89PNG\r\n\x1a\n" + b"\0" * 64
+    logo = client.post('/logos/', headers=auth, data={
+        'logo': (io.BytesIO(png), 'logo.png', 'image/png')})
+    logo_id = logo.get_json()["logo_id"]
+    client.get('/logos/', headers=auth)
+    client.get(f'/logos/{logo_id}', headers=auth)
+    client.delete(f'/logos/{logo_id}', headers=auth)
+
+    batch = client.post('/server-files/upload-batch', headers=auth, data={'files': [
+        (io.BytesIO(b"%PDF-1.4 batch one"), 'one.pdf', 'application/pdf'),
+        (io.BytesIO(b"%PDF-1.4 batch two"), 'two.pdf', 'application/pdf')]})
+    client.post('/server-files/delete-batch', headers=auth,
+                json={"file_ids": [r["file_id"] for r in batch.get_json()["results"]]})
+
+    purged_id = client.post('/auth/register', json={"name": "Purged User", "email": "purged@example.com",
+                                                    "password": "plan-password"}).get_json()["user_id"]
+    purged_auth = {'Authorization': "Bearer " + client.post('/auth/login', json={
+        "email": "purged@example.com", "password": "plan-password"}).get_json()["token"]}
+    client.post('/server-files/upload', headers=purged_auth, data={
+        'file': (io.BytesIO(b"%PDF-1.4 purged"), 'purged.pdf', 'application/pdf')})
+    client.post('/logos/', headers=purged_auth, data={'logo': (io.BytesIO(png), 'logo.png', 'image/png')})
+    client.post('/server-files/uploads', headers=purged_auth, json={"filename": "open.pdf", "size": 4})
+    purge_url = client.delete(f'/users/{purged_id}', headers=purged_auth).get_json()["status_url"]
+
+    # Everything queued above, an upload's orphan cleanup and an entry that fails
+    from services import outbox
+    from services.blobs import DISCARD_UPLOADS, FILES_PREFIX, blob_key
+    from services.database import conn
+    outbox.enqueue(DISCARD_UPLOADS, {'blobs': [[blob_key(FILES_PREFIX, user_id, '0' * 64), '0' * 64, 1]],
+                                     'keys': [f"user_{user_id}/orphan.pdf"]})
+    outbox.enqueue('no-such-kind', {})
+    from services.search import queue_extraction
+    queue_extraction([html.get_json()["file_id"]])
+    conn.commit()
+    while outbox.drain():
+        pass
+    client.get(purge_url, headers=purged_auth)
+
+    from services.usage import reconcile_usage
+    reconcile_usage()
+    client.get('/storage/usage', headers=auth)
+    client.get('/storage/')
+    client.get(f'/storage/?user_id={user_id}', headers=auth)
+    client.get(f'/storage/summary?user_id={user_id}&depth=2', headers=auth)
+    from services.storage_summary import fold_changes, reconcile_prefixes
+    fold_changes()
+    reconcile_prefixes()
+    client.get(f'/storage/summary?user_id={user_id}', headers=admin)
+
+
+def generate_dataset(dsn, users, files_per_user, logos_per_user):
+    """Bulk-generate synthetic rows with generate_series and refresh statistics"""
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    cur = conn.cursor()
+    # Upload session ids are random text; keep the scenario's so the replayed
+    # statements find their session
+    cur.execute("SELECT id FROM upload_sessions")
+    scenario_sessions = [row[0] for row in cur.fetchall()]
+    # Drop the scenario's rows and restart the sequences so the captured ids
+    # land on synthetic rows and replayed INSERTs do not hit unique keys
+    cur.execute("TRUNCATE users, user_files, user_logos, listing_versions, upload_sessions, blobs, purge_jobs, "
+                "purge_job_objects, outbox, storage_usage, user_import_rows, storage_prefixes, "
+                "storage_prefix_changes RESTART IDENTITY CASCADE")
+    steps = [
+        ("users", """
+            INSERT INTO users (name, email, password_hash, created_at)
+            SELECT 'User ' || g, 'user' || g || '@synthetic.test', md5(g::text),
+                   now() - (g %% 1000) * interval '1 hour'
+            FROM generate_series(1, %(users)s) g
+        """),
+        # Skewed per-user counts averaging files_per_user
+        # Each with a few lines of invoice text drawn from a small vocabulary
+        ("user_files", """
+            INSERT INTO user_files (user_id, filename, s3_key, file_size, file_type, original_content, created_at)
+            SELECT u.id, 'invoice-' || f || '.pdf', 'user_' || u.id || '/synthetic-' || f || '.pdf',
+                   50000 + (u.id * f) %% 200000, 'pdf',
+                   'Invoice INV-' || u.id || '-' || f || ' ' ||
+                   (ARRAY['consulting', 'hosting', 'design', 'licence', 'support', 'training', 'audit',
+                          'catering', 'freight', 'repairs'])[1 + (u.id * f) %% 10] || ' services for customer ' ||
+                   md5(u.id::text) || ', due ' || (u.id * 13 + f) %% 28 || ' days, total ' ||
+                   (u.id * f * 37) %% 10000 || ' ' ||
+                   (ARRAY['EUR', 'USD', 'GBP'])[1 + (u.id + f) %% 3],
+                   now() - ((u.id * 31 + f * 17) %% 525600) * interval '1 minute'
+            FROM users u
+            CROSS JOIN LATERAL generate_series(1, 1 + (u.id * 7919) %% (2 * %(files)s)) f
+            WHERE u.email LIKE '%%@synthetic.test'
+        """),
+        ("user_logos", """
+            INSERT INTO user_logos (user_id, filename, s3_key, logo_url, file_size, content_type, created_at)
+            SELECT u.id, 'logo-' || l || '.png', 'logos/user' || u.id || '/synthetic-' || l || '.png',
+                   'https://synthetic.s3.amazonaws.com/logos/user' || u.id || '/synthetic-' || l || '.png',
+                   20000, 'image/png', now() - ((u.id + l) %% 10000) * interval '1 minute'
+            FROM users u CROSS JOIN generate_series(1, %(logos)s) l
+            WHERE u.email LIKE '%%@synthetic.test'
+        """),
+        ("listing_versions", """
+            INSERT INTO listing_versions (scope, user_id, version)
+            SELECT s.scope, u.id, 1 FROM users u CROSS JOIN (VALUES ('files'), ('logos')) s(scope)
+            WHERE u.email LIKE '%%@synthetic.test'
+            ON CONFLICT DO NOTHING
+        """),
+        ("storage_usage", """
+            INSERT INTO storage_usage (user_id, files_count, files_bytes, logos_count, logos_bytes)
+            SELECT u.id,
+                   (SELECT count(*) FROM user_files f WHERE f.user_id = u.id),
+                   (SELECT COALESCE(sum(file_size), 0) FROM user_files f WHERE f.user_id = u.id),
+                   (SELECT count(*) FROM user_logos l WHERE l.user_id = u.id),
+                   (SELECT COALESCE(sum(file_size), 0) FROM user_logos l WHERE l.user_id = u.id)
+            FROM users u
+        """),
+        # One content blob per user, a few of them waiting to be reaped
+        ("blobs", """
+            INSERT INTO blobs (s3_key, sha256, size, content_type, ref_count)
+            SELECT 'user_' || g || '/blobs/' || left(md5(g::text), 2) || '/' || md5(g::text), md5(g::text), 100000,
+                   'application/pdf', g %% 50
+            FROM generate_series(1, %(users)s) g
+        """),
+        # Counters for the files, logos and blobs above, as seed_prefixes() builds them
+        ("storage_prefixes", """
+            INSERT INTO storage_prefixes (prefix, objects, bytes)
+            SELECT substring(k FROM '^.*/'), count(*), sum(s) FROM (
+                SELECT s3_key, file_size FROM user_files UNION ALL SELECT s3_key, file_size FROM user_logos
+                UNION ALL SELECT s3_key, size FROM blobs) AS o(k, s)
+            GROUP BY 1
+        """),
+        # Changes of recent uploads not folded in yet
+        ("storage_prefix_changes", """
+            INSERT INTO storage_prefix_changes (prefix, objects, bytes)
+            SELECT 'user_' || g || '/', 1, 100000 FROM generate_series(1, 500) g
+        """),
+        # A resumable upload in flight for every tenth user, mostly recent
+        ("upload_sessions", """
+            INSERT INTO upload_sessions (id, user_id, filename, s3_key, s3_upload_id, total_size,
+                                         chunk_size, created_at, updated_at)
+            SELECT md5(u.id::text), u.id, 'large.pdf', 'user_' || u.id || '/synthetic-large.pdf',
+                   md5(u.id::text || 'upload'), 50000000, 8388608,
+                   now() - (u.id %% 100) * interval '1 hour', now() - (u.id %% 100) * interval '1 hour'
+            FROM users u WHERE u.email LIKE '%%@synthetic.test' AND u.id %% 10 = 0
+            UNION ALL
+            SELECT s, 1, 'resumable.pdf', 'user_1/resumable.pdf', md5(s), 4, 5242880, now(), now()
+            FROM unnest(%(sessions)s::text[]) s
+        """),
+        ("upload_session_parts", """
+            INSERT INTO upload_session_parts (session_id, part_number, size, sha256, etag)
+            SELECT s.id, p, 8388608, md5(s.id || p), md5(p || s.id)
+            FROM upload_sessions s CROSS JOIN generate_series(1, 4) p
+        """),
+        # Ten account purges in flight, with their objects still to delete
+        ("purge_job_objects", """
+            INSERT INTO purge_job_objects (job_id, s3_key)
+            SELECT 'synthetic-' || g %% 10, 'user_' || g || '/synthetic.pdf' FROM generate_series(1, %(users)s) g
+        """),
+        # The orphan cleanup of every upload in flight, due in the next hour,
+        # and a few parked entries that ran out of attempts
+        ("outbox", """
+            INSERT INTO outbox (kind, payload, attempts, available_at, failed_at)
+            SELECT 'discard_uploads', jsonb_build_object('blobs', '[]'::jsonb, 'keys', jsonb_build_array(s.s3_key)),
+                   0, now() + (s.user_id %% 60) * interval '1 minute', NULL
+            FROM upload_sessions s
+            UNION ALL
+            SELECT 'release_objects', '{"keys": []}'::jsonb, 10, now() - g * interval '1 minute', now()
+            FROM generate_series(1, 100) g
+        """),
+    ]
+    params = {"users": users, "files": files_per_user, "logos": logos_per_user,
+              "sessions": scenario_sessions}
+    for table, statement in steps:
+        started = time.perf_counter()
+        cur.execute(statement, params)
+        print(f"  {table:18s} {cur.rowcount:>10,d} rows in {time.perf_counter() - started:.1f}s")
+    cur.execute("VACUUM ANALYZE")
+    cur.execute("""SELECT relname, reltuples::bigint FROM pg_class
+                   WHERE relkind = 'r' AND relnamespace = 'public'::regnamespace""")
+    sizes = dict(cur.fetchall())
+    conn.close()
+    return sizes
+
+
+def walk(plan):
+    yield plan
+    for child in plan.get('Plans', []):
+        yield from walk(child)
+
+
+def check_plan(plan, table_sizes, scan_threshold):
+    """Return the problems found in a JSON plan tree"""
+    problems = []
+    for node in walk(plan):
+        node_type = node.get('Node Type')
+        if node_type == 'Seq Scan':
+            relation = node.get('Relation Name')
+            if table_sizes.get(relation, 0) >= scan_threshold:
+                problems.append(f"Seq Scan on {relation} ({table_sizes[relation]:,} rows)")
+        elif node_type in SORT_NODES:
+            keys = node.get('Sort Key', [])
+            # An order computed from the statement's own values (a search
+            # rank) can't come from any index; other sorts could have
+            if keys and "'::" in keys[0]:
+                continue
+            method = node.get('Sort Method', '')
+            problems.append(f"{node_type} on {', '.join(node.get('Sort Key', []))} {method}".strip())
+    return problems
+
+
+def explain_all(dsn, statements, table_sizes, scan_threshold):
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    results = []
+    for sql, vars in sorted(statements.items()):
+        entry = {"sql": sql}
+        try:
+            # The first run warms the cache; report the second for steady-state timings
+            for _ in range(2):
+                cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + sql, vars)
+                explained = cur.fetchone()[0][0]
+                conn.rollback()
+        except psycopg2.Error as e:
+            conn.rollback()
+            entry.update(error=str(e).strip(), problems=["EXPLAIN failed"])
+            results.append(entry)
+            continue
+        finally:
+            conn.rollback()
+
+        plan = explained['Plan']
+        problems = check_plan(plan, table_sizes, scan_threshold)
+        allowed = next((reason for prefix, reason in ALLOWED_PLANS.items() if sql.startswith(prefix)), None)
+        entry.update(
+            root=plan.get('Node Type'),
+            execution_ms=round(explained.get('Execution Time', 0), 3),
+            planning_ms=round(explained.get('Planning Time', 0), 3),
+            shared_hit=plan.get('Shared Hit Blocks', 0),
+            shared_read=plan.get('Shared Read Blocks', 0),
+            problems=[] if allowed else problems,
+            allowed=allowed if problems else None,
+        )
+        results.append(entry)
+    conn.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--files-per-user', type=int, default=5)
+    parser.add_argument('--logos-per-user', type=int, default=1)
+    parser.add_argument('--scan-threshold', type=int, default=DEFAULT_SCAN_THRESHOLD,
+                        help="Flag sequential scans of tables with at least this many rows")
+    parser.add_argument('--postgres-dsn', help="Use an existing (empty) database instead of a throwaway cluster")
+    parser.add_argument('--pg-bin', help="Directory containing initdb/pg_ctl")
+    parser.add_argument('--strict', action='store_true',
+                        help="Also fail when a statement in the source was not exercised")
+    parser.add_argument('--output', help="Write the JSON report here")
+    args = parser.parse_args()
+
+    with harness.postgres_standin(args.postgres_dsn, args.pg_bin) as pg, harness.MotoS3() as s3:
+        # The scenario drains the outbox itself so its statements are recorded in order,
+        # and reads every listing version from the database
+        harness.configure_environment(pg.dsn, s3.endpoint, extra={
+            'OUTBOX_WORKERS': '0', 'CACHE_INVALIDATION_ENABLED': 'False', 'USAGE_RECONCILE_INTERVAL': '0',
+            'STORAGE_SUMMARY_FOLD_INTERVAL': '0', 'STORAGE_SUMMARY_RECONCILE_INTERVAL': '0',
+            'ADMIN_TOKEN': 'plan-admin'})
+        import server
+        from services.s3 import ensure_bucket_exists
+
+        recorder = StatementRecorder()
+        recorder.install()
+        server.init_database()
+        ensure_bucket_exists()
+        print("Capturing statements...")
+        run_scenario(server.create_app().test_client())
+        captured = recorder.statements
+        # Release the setup connection so it holds no locks during generation
+        from services.database import release_connection
+        release_connection()
+
+        print(f"Generating synthetic dataset ({args.users:,} users)...")
+        table_sizes = generate_dataset(pg.dsn, args.users, args.files_per_user, args.logos_per_user)
+        print(f"Explaining {len(captured)} statements...")
+        results = explain_all(pg.dsn, captured, table_sizes, args.scan_threshold)
+
+    sources = static_statements()
+    for entry in results:
+        entry["sources"] = sources.get(entry["sql"], [])
+    unexercised = {sql: locations for sql, locations in sources.items() if sql not in captured}
+
+    failures = [entry for entry in results if entry["problems"]]
+    for entry in results:
+        status = 'FAIL' if entry["problems"] else ('ok*' if entry.get("allowed") else 'ok')
+        timing = f"{entry['execution_ms']:9.3f} ms" if 'execution_ms' in entry else ' ' * 12
+        print(f"{status:4s} {timing}  {entry.get('root', ''):22s} {entry['sql'][:90]}")
+        for problem in entry["problems"]:
+            print(f"{'':20s}- {problem}")
+        if entry.get("error"):
+            print(f"{'':20s}  {entry['error']}")
+    for sql, locations in unexercised.items():
+        print(f"MISS {'':12s} not exercised by the scenario: {sql[:70]} ({', '.join(locations)})")
+
+    report = {
+        "revision": harness.git_revision(),
+        "dataset": {"users": args.users, "files_per_user": args.files_per_user,
+                    "logos_per_user": args.logos_per_user, "table_rows": table_sizes},
+        "statements": results,
+        "unexercised": unexercised,
+    }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.output}")
+
+    failed = bool(failures) or (args.strict and bool(unexercised))
+    print(f"{len(results)} statements, {len(failures)} regressed, {len(unexercised)} not exercised")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+#!/usr/bin/env python3
+"""
+Apply the schema changes too slow to make at every server start
+(STAGED_MIGRATIONS in services/schema.py).
+
+Adding user_files.search_vector to a database created before search
+existed rewrites the table under an ACCESS EXCLUSIVE lock, which holds up
+every read and write of user_files until it is done, so run this off-peak.
+The search index is then built without blocking writes. Running it again
+is harmless.
+"""
+
+from services.schema import apply_staged_migrations, init_database, staged_migrations_pending
+
+
+def main():
+    init_database()
+    if not staged_migrations_pending():
+        print("✅ Schema is up to date")
+        return
+    print("Applying staged schema migrations...")
+    apply_staged_migrations()
+    print("✅ Staged schema migrations applied")
+
+
+if __name__ == "__main__":
+    main()
@@ -9,10 +9,25 @@ from apis.download import download_bp
 from apis.echo import echo_bp
 from apis.auth import auth_bp
 from apis.server_files import server_files_bp
+from apis.uploads import uploads_bp
 from apis.logo import logo_bp
 from apis.html_to_pdf import html_to_pdf_bp
-from services.database import cursor, conn
-from services.s3 import ensure_bucket_exists
+from apis.metrics import metrics_bp
+from apis.profiling import profiling_bp
+from apis.export import export_bp
+from services.schema import init_database
+from services.database import init_database_pool
+from services.storage import storage
+from services.metrics import init_metrics
+from services.profiling import init_profiling
+from services.compression import init_compression
+from services.json_provider import init_json_provider
+from services.upload_sessions import init_upload_sessions
+from services.outbox import init_outbox
+from services.invalidation import init_cache_invalidation
+from services.replicas import init_replicas
+from services.usage import init_storage_usage
+from services.storage_summary import init_storage_summary
 import os
 from dotenv import load_dotenv
 
@@ -23,6 +38,12 @@ load_dotenv()
 def create_app():
     app = Flask(__name__)
 
+    # orjson-backed request parsing and response serialization
+    init_json_provider(app)
+
+    # Per-request pooled database connections
+    init_database_pool(app)
+
     # Disable Flask's default OPTIONS handling and trailing slash redirects
     app.config['CORS_HEADERS'] = 'Content-Type'
     app.url_map.strict_slashes = False  # This prevents redirects for trailing slashes
@@ -33,10 +54,37 @@ def create_app():
                   "http://localhost:8080", "*"],
          methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
          allow_headers=["Content-Type", "Authorization",
-                        "X-Requested-With", "Accept"],
+                        "X-Requested-With", "Accept", "Upload-Offset", "X-Chunk-SHA256"],
          supports_credentials=True,
          max_age=3600)
 
+    # Request timing hooks - registered first so preflight requests are counted too
+    init_metrics(app)
+
+    # On-demand profiling of signed or admin-armed requests
+    init_profiling(app)
+
+    # Negotiated gzip/brotli compression of JSON and text responses
+    init_compression(app)
+
+    # Background garbage collection of abandoned resumable uploads
+    init_upload_sessions(app)
+
+    # Workers that perform storage side effects queued by committed transactions
+    init_outbox(app)
+
+    # Listing versions and cached listings kept current by other processes' writes
+    init_cache_invalidation(app)
+
+    # Read-only requests served by replicas that have the writes they need to see
+    init_replicas(app)
+
+    # Periodic recount of per-user storage usage from the file and logo rows
+    init_storage_usage(app)
+
+    # Per-directory object counters behind /storage/summary, folded and reconciled in the background
+    init_storage_summary(app)
+
     # Global OPTIONS handler - this MUST come before blueprint registration
     @app.before_request
     def handle_preflight():
@@ -44,7 +92,7 @@ def create_app():
             response = app.make_default_options_response()
             response.headers["Access-Control-Allow-Origin"] = "*"
             response.headers["Access-Control-Allow-Methods"] = "GET, POST, PUT, DELETE, OPTIONS"
-            response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Requested-With, Accept"
+            response.headers["Access-Control-Allow-Headers"] = "Content-Type, Authorization, X-Requested-With, Accept, Upload-Offset, X-Chunk-SHA256"
             response.headers["Access-Control-Allow-Credentials"] = "true"
             response.headers["Access-Control-Max-Age"] = "3600"
             return response
@@ -59,75 +107,22 @@ def create_app():
     app.register_blueprint(echo_bp, url_prefix='/echo')
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(server_files_bp, url_prefix='/server-files')
+    app.register_blueprint(uploads_bp, url_prefix='/server-files/uploads')
     app.register_blueprint(logo_bp, url_prefix='/logos')
     app.register_blueprint(html_to_pdf_bp, url_prefix='/pdf')
+    app.register_blueprint(metrics_bp, url_prefix='/metrics')
+    app.register_blueprint(profiling_bp, url_prefix='/admin/profiles')
+    app.register_blueprint(export_bp, url_prefix='/export')
 
     return app
 
 
-def init_database():
-    """Initialize database tables"""
-    # Create users table with password support
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id SERIAL PRIMARY KEY,
-        name TEXT NOT NULL,
-        email TEXT NOT NULL UNIQUE,
-        password_hash TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-
-    # Create user_files table with proper schema
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS user_files (
-        id SERIAL PRIMARY KEY,
-        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-        filename TEXT NOT NULL,
-        s3_key TEXT NOT NULL,
-        file_size INTEGER,
-        file_type TEXT DEFAULT 'unknown',
-        source_type TEXT DEFAULT 'upload',
-        original_content TEXT DEFAULT '',
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-
-    # Create user_logos table for logo uploads
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS user_logos (
-        id SERIAL PRIMARY KEY,
-        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-        filename TEXT NOT NULL,
-        s3_key TEXT NOT NULL,
-        logo_url TEXT NOT NULL,
-        file_size INTEGER,
-        content_type TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-
-    # Create indexes for better performance
-    cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)")
-    cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_user_files_user_id ON user_files(user_id)")
-    cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_user_files_created_at ON user_files(created_at)")
-    cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_user_logos_user_id ON user_logos(user_id)")
-    cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_user_logos_created_at ON user_logos(created_at)")
-
-    conn.commit()
-
-
 if __name__ == "__main__":
     # Initialize database
     init_database()
 
-    # Ensure S3 bucket exists
-    ensure_bucket_exists()
+    # Ensure the S3 bucket or local storage directory exists
+    storage.ensure_ready()
 
     # Create and run Flask app
     app = create_app()
@@ -142,6 +137,7 @@ if __name__ == "__main__":
     print("  POST /auth/register       - User registration")
     print("  GET  /server-files        - List user files")
     print("  POST /server-files/upload - Upload file")
+    print("  POST /server-files/uploads - Start a resumable upload")
     print("  GET  /server-files/download/{id} - Download file")
     print("  DELETE /server-files/delete/{id} - Delete file")
     print("  POST /pdf/generate        - Generate PDF from HTML content/URL/file")
@@ -149,5 +145,7 @@ if __name__ == "__main__":
     print("  GET  /pdf/download/{id}   - Download generated PDF")
     print("  GET  /pdf/list/{user_id}  - List user's PDFs")
     print("  DELETE /pdf/delete/{id}   - Delete PDF file")
+    print("  GET  /metrics             - Prometheus metrics")
+    print("  GET  /admin/profiles      - List request profiles (admin)")
 
     app.run(host='0.0.0.0', port=port, debug=debug)
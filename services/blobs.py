@@ -0,0 +1,265 @@
+"""
+Content-addressed blob storage.
+
+Uploaded files and logos are stored under a key derived from the SHA-256 of
+their content, in the uploading user's directory (user_42/blobs/ab/abcd...,
+logos/user42/blobs/...), so a user's identical uploads share one stored
+object. Blobs are never shared between users: whether an upload was
+deduplicated, and the type it is served with, only ever depend on the
+user's own uploads. Rows keep their own content type, so a file is served
+with the type it was uploaded with whichever upload stored the blob.
+The blobs table counts the user_files/user_logos rows pointing at each key;
+an upload of content that is already stored only bumps the count and skips
+the PUT, and the object is deleted when the last reference goes.
+
+Reference counts change in the caller's transaction. Taking a reference
+row-locks the blob until commit, and objects are only deleted by
+reap_blobs() while it holds the same lock on a zero-count row, so an upload
+never skips the PUT for an object that is about to disappear. A blob whose
+count drops to zero is reaped by an outbox entry (services/outbox.py)
+written with the release, so it goes shortly after the releasing
+transaction commits; a row left at zero is also reaped by the periodic
+sweep, or revived (and re-uploaded) by the next upload of the same content.
+
+Keys that are not content-addressed (rows written before this existed, and
+resumable uploads) keep their own object, deleted by the same outbox entry.
+Blobs stored before they were kept per user (blobs/..., logos/blobs/...)
+are still counted and reaped the same way.
+
+Blob rows are counted in the storage summary (services/storage_summary.py)
+as they are inserted and reaped, in the same transactions.
+
+Objects are uploaded before the rows that record them commit. Uploads first
+commit a delayed cleanup of the objects they are about to write
+(guard_uploads, on a connection of its own so the upload's transaction stays
+one unit) and cancel it with their rows, so a request that fails or dies
+between the PUT and the commit leaves no orphan behind.
+"""
+
+import hashlib
+import re
+from collections import Counter
+from psycopg2.extras import execute_values
+from services.database import cursor, conn
+from services.listing_versions import bump_storage_version
+from services.outbox import OUTBOX_ORPHAN_GRACE, cancel, enqueue, enqueue_committed, handler
+from services.storage import storage, DELETE_BATCH
+from services.storage_codec import encode_stream, storage_encoding
+from services.storage_summary import record_objects
+
+# Directories per user, formatted with the user's id by blob_key()
+FILES_PREFIX = 'user_{user_id}/blobs'
+# Logos live under logos/ so the bucket policy keeps them publicly readable
+LOGOS_PREFIX = 'logos/user{user_id}/blobs'
+# Per-user blobs, and the shared ones stored before them
+BLOB_KEY = re.compile(r'(?:user_\d+/|logos/(?:user\d+/)?)?blobs/')
+
+HASH_CHUNK_SIZE = 1024 * 1024
+REAP_BATCH = 1000
+
+# Outbox entry kinds
+RELEASE_OBJECTS = 'release_objects'
+DISCARD_UPLOADS = 'discard_uploads'
+
+
+def hash_stream(stream):
+    """SHA-256 and size of a seekable stream, read in chunks; rewinds it"""
+    digest = hashlib.sha256()
+    size = 0
+    stream.seek(0)
+    while True:
+        chunk = stream.read(HASH_CHUNK_SIZE)
+        if not chunk:
+            break
+        digest.update(chunk)
+        size += len(chunk)
+    stream.seek(0)
+    return digest.hexdigest(), size
+
+
+def blob_key(prefix, user_id, sha256):
+    return f"{prefix.format(user_id=user_id)}/{sha256[:2]}/{sha256}"
+
+
+def is_blob_key(s3_key):
+    return BLOB_KEY.match(s3_key) is not None
+
+
+def acquire_blobs(blobs):
+    """Take one reference per (s3_key, sha256, size, content_type, content_encoding) entry.
+
+    Runs in the caller's transaction and returns the keys whose object has
+    to be uploaded: blobs that are new or had no references left. A stored
+    blob keeps the encoding it was uploaded with.
+    """
+    counts = Counter(blob[0] for blob in blobs)
+    details = {blob[0]: blob for blob in blobs}
+    # Sorted so concurrent batches lock shared blobs in the same order
+    rows = execute_values(
+        cursor,
+        """INSERT INTO blobs (s3_key, sha256, size, content_type, content_encoding, ref_count) VALUES %s
+           ON CONFLICT (s3_key) DO UPDATE SET ref_count = blobs.ref_count + EXCLUDED.ref_count,
+               content_encoding = CASE WHEN blobs.ref_count = 0 THEN EXCLUDED.content_encoding ELSE blobs.content_encoding END
+           RETURNING s3_key, ref_count, size, xmax = 0 AS inserted""",
+        [details[key] + (counts[key],) for key in sorted(counts)],
+        fetch=True
+    )
+    record_objects([(row['s3_key'], row['size']) for row in rows if row['inserted']])
+    return {row['s3_key'] for row in rows if row['ref_count'] == counts[row['s3_key']]}
+
+
+def put_blob(s3_key, stream, content_type, size, content_encoding=None):
+    """Upload a blob's content, compressed with content_encoding if given"""
+    if content_encoding:
+        stream = encode_stream(stream, content_encoding)
+    stream.seek(0)
+    storage.put(s3_key, stream, content_type, content_encoding, {'original-size': str(size)})
+
+
+def guard_uploads(blobs=(), s3_keys=()):
+    """Commit a delayed cleanup of objects about to be uploaded; returns its outbox id.
+
+    blobs are (s3_key, sha256, size) entries, s3_keys any other keys. The
+    entry commits on its own, leaving the caller's transaction untouched;
+    cancel() it in the transaction that records the objects.
+    """
+    return enqueue_committed(DISCARD_UPLOADS, {'blobs': [list(blob) for blob in blobs], 'keys': list(s3_keys)},
+                             delay=OUTBOX_ORPHAN_GRACE)
+
+
+def store_blob(stream, content_type, user_id, prefix=FILES_PREFIX, compress=True):
+    """Store one of user_id's uploads by content; returns (s3_key, size, uploaded).
+
+    Takes a reference in the caller's transaction, which must record it
+    before committing; uploaded is False when the user had already stored
+    the content and the PUT was skipped. Text documents are compressed
+    unless compress is False.
+    """
+    sha256, size = hash_stream(stream)
+    s3_key = blob_key(prefix, user_id, sha256)
+    guard = guard_uploads([(s3_key, sha256, size)])
+    content_encoding = storage_encoding(content_type, size) if compress else None
+    uploaded = bool(acquire_blobs([(s3_key, sha256, size, content_type, content_encoding)]))
+    if uploaded:
+        put_blob(s3_key, stream, content_type, size, content_encoding)
+        bump_storage_version()
+    cancel(guard)
+    return s3_key, size, uploaded
+
+
+def release_blobs(s3_keys):
+    """Drop one blob reference per key in the caller's transaction; other keys are ignored"""
+    counts = Counter(key for key in s3_keys if is_blob_key(key))
+    if counts:
+        execute_values(
+            cursor,
+            "UPDATE blobs SET ref_count = blobs.ref_count - v.n FROM (VALUES %s) AS v(s3_key, n) WHERE blobs.s3_key = v.s3_key",
+            sorted(counts.items())
+        )
+
+
+def release_objects(s3_keys):
+    """Drop one reference per key in the caller's transaction.
+
+    The objects are deleted by the outbox once the caller commits: other
+    keys outright, blobs if nothing references them any more. Returns how
+    many distinct keys were queued.
+    """
+    release_blobs(s3_keys)
+    keys = list(dict.fromkeys(s3_keys))
+    # One entry per DeleteObjects call, so workers share big releases and
+    # a failure only retries its own batch
+    for start in range(0, len(keys), DELETE_BATCH):
+        enqueue(RELEASE_OBJECTS, {'keys': keys[start:start + DELETE_BATCH]})
+    return len(keys)
+
+
+def record_released(objects):
+    """Take deleted rows' (s3_key, size) objects off the storage summary in the caller's transaction.
+
+    Blobs are left to reap_blobs(), and legacy rows whose key has no
+    directory name no object (apis/upload.py).
+    """
+    record_objects([(key, size) for key, size in objects if '/' in key and not is_blob_key(key)], removed=True)
+
+
+def delete_objects(s3_keys):
+    """Delete objects that are not content-addressed; raises if any remain"""
+    if not s3_keys:
+        return
+    failed = storage.delete(s3_keys)
+    bump_storage_version()
+    if failed:
+        raise RuntimeError(f"{len(failed)} of {len(s3_keys)} objects could not be deleted")
+
+
+@handler(RELEASE_OBJECTS)
+def _release_objects(payload):
+    keys = payload['keys']
+    delete_objects([key for key in keys if not is_blob_key(key)])
+    blob_keys = [key for key in keys if is_blob_key(key)]
+    if blob_keys:
+        reap_blobs(blob_keys)
+
+
+@handler(DISCARD_UPLOADS)
+def _discard_uploads(payload):
+    if payload['blobs']:
+        # A zero-count row makes the blob reapable; one already there means
+        # another upload took a reference, and one being inserted makes
+        # this wait for that upload to commit or roll back
+        rows = execute_values(
+            cursor,
+            "INSERT INTO blobs (s3_key, sha256, size) VALUES %s ON CONFLICT (s3_key) DO NOTHING RETURNING s3_key, size",
+            [tuple(blob) for blob in payload['blobs']],
+            fetch=True
+        )
+        record_objects([(row['s3_key'], row['size']) for row in rows])
+        conn.commit()
+        reap_blobs([blob[0] for blob in payload['blobs']])
+    if payload['keys']:
+        cursor.execute("SELECT s3_key FROM user_files WHERE s3_key = ANY(%s)", (payload['keys'],))
+        recorded = {row['s3_key'] for row in cursor.fetchall()}
+        conn.commit()
+        delete_objects([key for key in payload['keys'] if key not in recorded])
+
+
+def reap_blobs(s3_keys=None):
+    """Delete unreferenced blobs (only s3_keys if given); returns how many.
+
+    Must run in its own transaction, after the releases are committed.
+    The sweep (no s3_keys) logs failures and leaves the rows for next
+    time; with s3_keys they are raised, for the outbox to retry.
+    """
+    reaped = 0
+    try:
+        while True:
+            if s3_keys is None:
+                cursor.execute(
+                    "DELETE FROM blobs WHERE s3_key IN (SELECT s3_key FROM blobs WHERE ref_count = 0 LIMIT %s FOR UPDATE SKIP LOCKED) AND ref_count = 0 RETURNING s3_key, size",
+                    (REAP_BATCH,)
+                )
+            else:
+                cursor.execute(
+                    "DELETE FROM blobs WHERE s3_key = ANY(%s) AND ref_count = 0 RETURNING s3_key, size",
+                    (list(s3_keys),)
+                )
+            rows = cursor.fetchall()
+            keys = [row['s3_key'] for row in rows]
+            if keys:
+                record_objects([(row['s3_key'], row['size']) for row in rows], removed=True)
+                failed = storage.delete(keys)
+                bump_storage_version()
+                if failed:
+                    # Keep the rows so the next sweep retries
+                    raise RuntimeError(f"{len(failed)} of {len(keys)} objects could not be deleted")
+            conn.commit()
+            reaped += len(keys)
+            if s3_keys is not None or len(keys) < REAP_BATCH:
+                return reaped
+    except Exception as e:
+        conn.rollback()
+        if s3_keys is not None:
+            raise
+        print(f"❌ Failed to reap unreferenced blobs: {e}")
+        return reaped
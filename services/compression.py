@@ -0,0 +1,109 @@
+"""
+Negotiated response compression.
+
+Compresses textual responses (JSON, HTML, plain text, CSV, NDJSON) with
+brotli or gzip depending on the client's Accept-Encoding header. Buffered
+responses below COMPRESSION_MIN_SIZE are left alone; streamed responses are
+compressed chunk by chunk so they keep streaming. File downloads sent with
+send_file (direct passthrough) are never touched.
+"""
+
+import os
+import zlib
+from dotenv import load_dotenv
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; fall back to gzip only
+    brotli = None
+
+# Load environment variables
+load_dotenv()
+
+COMPRESSION_ENABLED = os.getenv('COMPRESSION_ENABLED', 'True').lower() == 'true'
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+# Low brotli qualities compress dynamic content faster than gzip -6 at a better ratio
+BROTLI_QUALITY = int(os.getenv('COMPRESSION_BROTLI_QUALITY', '4'))
+
+COMPRESSIBLE_MIMETYPES = {
+    'application/json',
+    'application/x-ndjson',
+    'application/javascript',
+    'application/xml',
+    'image/svg+xml',
+}
+
+
+def is_compressible(mimetype):
+    return bool(mimetype) and (mimetype.startswith('text/') or mimetype in COMPRESSIBLE_MIMETYPES)
+
+
+def choose_encoding(accept_encodings):
+    """Pick the best supported content coding from a parsed Accept-Encoding header"""
+    offered = ['br', 'gzip'] if brotli is not None else ['gzip']
+    return accept_encodings.best_match(offered)
+
+
+def compress_bytes(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_stream(chunks, encoding):
+    """Compress an iterable of str/bytes chunks incrementally"""
+    if encoding == 'br':
+        compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+        compress, finish = compressor.process, compressor.finish
+    else:
+        compressor = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)
+        compress, finish = compressor.compress, compressor.flush
+
+    try:
+        for chunk in chunks:
+            if isinstance(chunk, str):
+                chunk = chunk.encode('utf-8')
+            out = compress(chunk)
+            if out:
+                yield out
+        yield finish()
+    finally:
+        close = getattr(chunks, 'close', None)
+        if close is not None:
+            close()
+
+
+def init_compression(app):
+    """Register an after_request hook that compresses eligible responses"""
+    if not COMPRESSION_ENABLED:
+        return
+
+    from flask import request
+
+    @app.after_request
+    def compress_response(response):
+        if (response.status_code < 200 or response.status_code in (204, 206, 304)
+                or response.direct_passthrough
+                or 'Content-Encoding' in response.headers
+                or request.method == 'HEAD'
+                or not is_compressible(response.mimetype)):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        encoding = choose_encoding(request.accept_encodings)
+        if not encoding:
+            return response
+
+        if response.is_streamed:
+            response.response = compress_stream(response.response, encoding)
+            response.headers.pop('Content-Length', None)
+        else:
+            data = response.get_data()
+            if len(data) < COMPRESSION_MIN_SIZE:
+                return response
+            response.set_data(compress_bytes(data, encoding))
+
+        response.headers['Content-Encoding'] = encoding
+        return response
@@ -1,8 +1,18 @@
 import psycopg2
+import psycopg2.errors
+import psycopg2.extensions
+import psycopg2.pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
 from psycopg2.extras import RealDictCursor
+import hashlib
 import os
+import re
+import select
+import threading
 import time
+import uuid
 from dotenv import load_dotenv
+from services.metrics import observe_db_query
 
 # Load environment variables
 load_dotenv()
@@ -14,17 +24,279 @@ DB_PASSWORD = os.getenv("DB_PASSWORD", "postgres")
 DB_HOST = os.getenv("DB_HOST", "db")  # Use "db" (not "localhost") in Docker
 DB_PORT = os.getenv("DB_PORT", "5432")
 
+# Connection pool sizing; size DB_POOL_MAX to the number of worker threads
+DB_POOL_MIN = int(os.getenv("DB_POOL_MIN", "1"))
+DB_POOL_MAX = int(os.getenv("DB_POOL_MAX", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# Rows fetched per round trip by server-side cursors
+DB_CURSOR_ITERSIZE = int(os.getenv("DB_CURSOR_ITERSIZE", "2000"))
+# Run statements marked with prepared() as server-side prepared statements;
+# turn off behind poolers that don't keep sessions (PgBouncer transaction mode)
+DB_PREPARED_STATEMENTS = os.getenv("DB_PREPARED_STATEMENTS", "True").lower() == "true"
+
+_PLACEHOLDER = re.compile(r'%[s%]')
+
+
+class PreparedSQL(str):
+    """SQL text of a statement that runs as a server-side prepared statement.
+
+    It is still the plain SQL string everywhere else (logs, metrics, EXPLAIN).
+    Positional %s parameters only.
+    """
+
+    def __new__(cls, sql):
+        statement = super().__new__(cls, sql)
+        statement.name = 'stmt_' + hashlib.sha1(sql.encode()).hexdigest()[:16]
+        count = 0
+
+        def number(match):
+            nonlocal count
+            if match.group() == '%%':
+                return '%'
+            count += 1
+            return f"${count}"
+
+        statement.prepare_sql = f"PREPARE {statement.name} AS {_PLACEHOLDER.sub(number, sql)}"
+        statement.execute_sql = f"EXECUTE {statement.name}" + (f" ({', '.join(['%s'] * count)})" if count else "")
+        return statement
+
+
+# SQL text -> its PreparedSQL, built once per process
+_statements = {}
+
+
+def prepared(sql):
+    """Mark a hot statement to be parsed and planned once per connection instead of on every call"""
+    statement = _statements.get(sql)
+    if statement is None:
+        statement = _statements[sql] = PreparedSQL(sql)
+    return statement
+
+
+class PreparingConnection(psycopg2.extensions.connection):
+    """Connection that remembers which statements it has prepared; a new one starts with none"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.prepared = set()
+
+
+class InstrumentedCursor(RealDictCursor):
+    """RealDictCursor that records the latency of every statement"""
+
+    def execute(self, query, vars=None):
+        start = time.perf_counter()
+        try:
+            if isinstance(query, PreparedSQL) and DB_PREPARED_STATEMENTS and self.name is None:
+                result = self._execute_prepared(query, vars)
+            else:
+                result = super().execute(query, vars)
+        except Exception:
+            observe_db_query(query, time.perf_counter() - start, failed=True)
+            raise
+        observe_db_query(query, time.perf_counter() - start)
+        return result
+
+    def _execute_prepared(self, statement, vars):
+        connection = self.connection
+        prepared = getattr(connection, 'prepared', None)
+        if prepared is None:
+            return super().execute(statement, vars)
+        # Only a statement that starts its transaction can be retried
+        starts_transaction = connection.info.transaction_status == TRANSACTION_STATUS_IDLE
+        if statement.name not in prepared:
+            # PREPARE isn't undone by a rollback, so it only runs once per connection
+            super().execute(statement.prepare_sql)
+            prepared.add(statement.name)
+        try:
+            return super().execute(statement.execute_sql, vars)
+        except psycopg2.errors.InvalidSqlStatementName:
+            # Deallocated behind our back (DISCARD ALL, a pooler handing over
+            # another session): everything has to be prepared again
+            prepared.clear()
+            if not starts_transaction:
+                raise
+            connection.rollback()
+            super().execute(statement.prepare_sql)
+            prepared.add(statement.name)
+            return super().execute(statement.execute_sql, vars)
+
+    def executemany(self, query, vars_list):
+        start = time.perf_counter()
+        try:
+            result = super().executemany(query, vars_list)
+        except Exception:
+            observe_db_query(query, time.perf_counter() - start, failed=True)
+            raise
+        observe_db_query(query, time.perf_counter() - start)
+        return result
+
+
+def _dropped(connection):
+    """Whether the server closed an idle connection (it has nothing else to say to one)"""
+    return bool(select.select([connection], [], [], 0)[0])
+
+
+class ConnectionPool:
+    """Bounded pool of connections; callers block until one is free"""
+
+    def __init__(self, minconn, maxconn, **connect_kwargs):
+        connect_kwargs.setdefault('connection_factory', PreparingConnection)
+        self.connect_kwargs = connect_kwargs
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._idle = []
+        self._lock = threading.Lock()
+        for _ in range(minconn):
+            self._idle.append(psycopg2.connect(**connect_kwargs))
+
+    def getconn(self, timeout=None):
+        if not self._slots.acquire(timeout=timeout):
+            raise psycopg2.pool.PoolError("Timed out waiting for a database connection")
+        try:
+            with self._lock:
+                while self._idle:
+                    candidate = self._idle.pop()
+                    if not candidate.closed and not _dropped(candidate):
+                        return candidate
+                    candidate.close()
+            return psycopg2.connect(**self.connect_kwargs)
+        except Exception:
+            self._slots.release()
+            raise
+
+    def putconn(self, connection):
+        try:
+            if not connection.closed:
+                if connection.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    connection.rollback()
+                with self._lock:
+                    self._idle.append(connection)
+        except psycopg2.Error:
+            connection.close()
+        finally:
+            self._slots.release()
+
+
+# Each thread (one request at a time under the threaded server) works on its
+# own pooled connection, so transactions from concurrent requests never
+# interleave on a shared connection or cursor.
+_local = threading.local()
+
+
+def get_connection():
+    """Return this thread's connection, checking one out of the pool if needed"""
+    connection = getattr(_local, 'conn', None)
+    if connection is None or connection.closed:
+        source = getattr(_local, 'source', None) or pool
+        if connection is not None:
+            source.putconn(connection)
+        connection = source.getconn(timeout=DB_POOL_TIMEOUT)
+        _local.conn = connection
+        _local.source = source
+        _local.cursor = connection.cursor(cursor_factory=InstrumentedCursor)
+    return connection
+
+
+def get_cursor():
+    """Return this thread's RealDictCursor"""
+    get_connection()
+    return _local.cursor
+
+
+def use_pool(source, timeout=None):
+    """Check this thread's connection out of another pool (a replica's) instead of the primary's.
+
+    Returns False, leaving things as they are, if the thread already holds a
+    connection; raises if source has no connection to give. The thread goes
+    back to the primary pool once the connection is released.
+    """
+    if getattr(_local, 'conn', None) is not None:
+        return False
+    connection = source.getconn(timeout=timeout)
+    _local.conn = connection
+    _local.source = source
+    _local.cursor = connection.cursor(cursor_factory=InstrumentedCursor)
+    return True
+
+
+def connection_pool():
+    """The pool this thread's connection came from, or None if it holds none"""
+    if getattr(_local, 'conn', None) is None:
+        return None
+    return getattr(_local, 'source', None) or pool
+
+
+def release_connection(exc=None):
+    """Return this thread's connection to the pool, rolling back any open transaction"""
+    connection = getattr(_local, 'conn', None)
+    if connection is not None:
+        source = getattr(_local, 'source', None) or pool
+        _local.conn = None
+        _local.cursor = None
+        _local.source = None
+        source.putconn(connection)
+
+
+class _ConnectionProxy:
+    def __getattr__(self, name):
+        return getattr(get_connection(), name)
+
+
+class _CursorProxy:
+    def __getattr__(self, name):
+        return getattr(get_cursor(), name)
+
+    def __iter__(self):
+        return iter(get_cursor())
+
+
+# Module-level handles kept for the handlers: `conn` and `cursor` resolve to
+# the calling thread's connection and cursor.
+conn = _ConnectionProxy()
+cursor = _CursorProxy()
+
+
+def stream_query(query, vars=None, itersize=DB_CURSOR_ITERSIZE):
+    """Yield a query's rows in lists of up to itersize from a named server-side cursor.
+
+    Only one batch is in memory at a time, however many rows match. Runs on
+    a connection of its own rather than the thread's, so a streaming
+    response can consume it after the request's connection is released;
+    the connection returns to the pool when the generator is exhausted or
+    closed.
+    """
+    connection = pool.getconn(timeout=DB_POOL_TIMEOUT)
+    try:
+        with connection.cursor(name=f"stream_{uuid.uuid4().hex}", cursor_factory=InstrumentedCursor) as named:
+            named.itersize = itersize
+            named.execute(query, vars)
+            while True:
+                rows = named.fetchmany(itersize)
+                if not rows:
+                    return
+                yield rows
+    finally:
+        # Rolls back, which also drops the cursor if it is still open
+        pool.putconn(connection)
+
+
+def init_database_pool(app):
+    """Return each request's connection to the pool when the request ends"""
+    app.teardown_appcontext(release_connection)
+
+
 # Try connecting with retries
 while True:
     try:
-        conn = psycopg2.connect(
+        pool = ConnectionPool(
+            DB_POOL_MIN,
+            DB_POOL_MAX,
             dbname=DB_NAME,
             user=DB_USER,
             password=DB_PASSWORD,
             host=DB_HOST,
             port=DB_PORT
         )
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
         print("✅ Connected to the database.")
         break
     except psycopg2.OperationalError as e:
@@ -0,0 +1,116 @@
+"""
+Cache invalidation bus over PostgreSQL LISTEN/NOTIFY.
+
+Every listing version bump notifies INVALIDATION_CHANNEL when its write
+commits (services/listing_versions.py). Each app process runs one listener
+thread on a dedicated connection, outside the pool, that applies the
+notifications as they arrive:
+
+- the new version is recorded in known_versions, so listing requests in
+  this process read it from memory instead of querying listing_versions;
+- the listing cache drops the user's entries for that scope;
+- replica routing (services/replicas.py) notes the write, keeping reads of
+  that listing on the primary until a replica has it.
+
+Notifications sent while the listener is disconnected are lost, so on every
+(re)connect the known versions are thrown away and rebuilt from the
+database; while it is down every read queries the database, as without the
+bus. The connection is checked every CACHE_INVALIDATION_HEARTBEAT seconds
+of silence and re-established with backoff.
+"""
+
+import json
+import os
+import select
+import threading
+import time
+import psycopg2
+from flask import g
+from dotenv import load_dotenv
+from services.database import pool
+from services.listing_cache import listing_cache
+from services.listing_versions import INVALIDATION_CHANNEL, known_versions
+from services.replicas import recent_writes
+from services.metrics import (
+    INVALIDATION_EVENTS, INVALIDATION_LAG_SECONDS, INVALIDATION_CONNECTED, INVALIDATION_RECONNECTS)
+
+# Load environment variables
+load_dotenv()
+
+CACHE_INVALIDATION_ENABLED = os.getenv('CACHE_INVALIDATION_ENABLED', 'True').lower() == 'true'
+CACHE_INVALIDATION_HEARTBEAT = float(os.getenv('CACHE_INVALIDATION_HEARTBEAT', '30'))
+RECONNECT_MAX_DELAY = 30
+# Round trip that proves an idle listener connection is still alive
+HEARTBEAT_QUERY = "SELECT 1"
+
+
+def apply_notification(payload):
+    """Record one bump announced on the bus"""
+    event = json.loads(payload)
+    scope, user_id = event['scope'], event['user_id']
+    known_versions.update(scope, user_id, event['version'])
+    recent_writes.note([(scope, user_id)])
+    listing_cache.evict(scope, user_id)
+    INVALIDATION_EVENTS.inc(scope)
+    INVALIDATION_LAG_SECONDS.observe(value=max(0.0, time.time() - event['at']))
+
+
+def _listen(connection):
+    connection.autocommit = True
+    connection.cursor().execute(f"LISTEN {INVALIDATION_CHANNEL}")
+    # Anything learned before this point may have missed notifications
+    known_versions.reset(enabled=True)
+    recent_writes.reset(listening=True)
+    INVALIDATION_CONNECTED.set(value=1)
+    print("✅ Listening for cache invalidations")
+    while True:
+        if select.select([connection], [], [], CACHE_INVALIDATION_HEARTBEAT) == ([], [], []):
+            # Quiet for a while; make sure the connection is still there
+            connection.cursor().execute(HEARTBEAT_QUERY)
+            continue
+        connection.poll()
+        while connection.notifies:
+            notify = connection.notifies.pop(0)
+            try:
+                apply_notification(notify.payload)
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"❌ Ignoring malformed invalidation {notify.payload!r}: {e}")
+
+
+def _listen_loop():
+    delay = 1
+    while True:
+        connection = None
+        try:
+            connection = psycopg2.connect(**pool.connect_kwargs)
+            delay = 1
+            _listen(connection)
+        except Exception as e:
+            known_versions.reset(enabled=False)
+            recent_writes.reset(listening=False)
+            INVALIDATION_CONNECTED.set(value=0)
+            INVALIDATION_RECONNECTS.inc()
+            print(f"❌ Cache invalidation listener disconnected: {e}; retrying in {delay}s")
+        finally:
+            if connection is not None:
+                connection.close()
+        time.sleep(delay)
+        delay = min(delay * 2, RECONNECT_MAX_DELAY)
+
+
+def init_cache_invalidation(app):
+    """Start the listener, and forget this process's copy of versions its requests bump"""
+    if not CACHE_INVALIDATION_ENABLED:
+        return
+
+    @app.teardown_request
+    def forget_bumped_versions(exc=None):
+        # The transaction has committed or rolled back by now; the next read
+        # goes to the database rather than waiting for the notification
+        bumped = g.pop('bumped_versions', None)
+        if bumped:
+            known_versions.forget(bumped)
+
+    # Replicas wait for the bus to report other processes' writes
+    recent_writes.reset(listening=False)
+    threading.Thread(target=_listen_loop, name='cache-invalidation', daemon=True).start()
@@ -0,0 +1,71 @@
+"""
+JSON provider backed by orjson.
+
+orjson serializes dict subclasses (psycopg2's RealDictRow), datetimes, dates
+and UUIDs natively, so query results can be passed to jsonify as-is without
+copying every row into a plain dict or round-tripping datetimes through the
+default encoder. Request bodies are parsed straight from bytes, which keeps
+multi-megabyte html_content payloads from being decoded to str first.
+
+When orjson is not installed the provider falls back to the stdlib json
+module with the same datetime handling, so responses look identical.
+"""
+
+import datetime
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; fall back to the stdlib encoder
+    orjson = None
+
+
+def _default(obj):
+    # Match orjson's RFC 3339 output instead of Flask's HTTP-date format
+    if isinstance(obj, (datetime.datetime, datetime.date)):
+        return obj.isoformat()
+    return DefaultJSONProvider.default(obj)
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider using orjson when available"""
+
+    default = staticmethod(_default)
+    # Key order is preserved as built; sorting would only cost time
+    sort_keys = False
+
+    def _options(self, indent=False):
+        options = orjson.OPT_NON_STR_KEYS
+        if indent:
+            options |= orjson.OPT_INDENT_2
+        if self.sort_keys:
+            options |= orjson.OPT_SORT_KEYS
+        return options
+
+    def _indent(self):
+        return (self.compact is None and self._app.debug) or self.compact is False
+
+    def dumps(self, obj, **kwargs):
+        # Callers passing stdlib-specific arguments get the stdlib encoder
+        if orjson is None or kwargs:
+            return super().dumps(obj, **kwargs)
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default,
+                            option=self._options(indent=self._indent()))
+        return self._app.response_class(body + b"\n", mimetype=self.mimetype)
+
+
+def init_json_provider(app):
+    """Install the fast JSON provider on a Flask app"""
+    app.json_provider_class = FastJSONProvider
+    app.json = FastJSONProvider(app)
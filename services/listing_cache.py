@@ -0,0 +1,114 @@
+"""
+In-process cache of per-user listing responses.
+
+Clients poll their file and logo listings far more often than those change.
+A listing's ETag (services/listing_versions.py) already names the version
+it was built from, and every write bumps that version in its own
+transaction, so a serialized response stored under the ETag is valid for as
+long as the version is current: a request reads the version (one
+primary-key lookup) and serves the stored body without running the listing
+query or serializing rows.
+
+- One entry per (scope, user_id, key); an entry built from an older version
+  is a miss and is replaced by the new one, so stale versions don't pile up.
+- Entries unused for LISTING_CACHE_TTL seconds expire, and least recently
+  used ones are evicted to keep the bodies under LISTING_CACHE_MAX_BYTES.
+- Each worker process has its own cache; versions keep them consistent.
+  The invalidation bus (services/invalidation.py) also evicts a user's
+  entries as soon as another process writes a new version, freeing them
+  before they would expire.
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from dotenv import load_dotenv
+from services.metrics import (
+    LISTING_CACHE_REQUESTS, LISTING_CACHE_HIT_RATIO, LISTING_CACHE_BYTES, LISTING_CACHE_EVICTIONS)
+
+# Load environment variables
+load_dotenv()
+
+# 0 disables the cache
+LISTING_CACHE_MAX_BYTES = int(os.getenv('LISTING_CACHE_MAX_BYTES', str(64 * 1024 * 1024)))
+LISTING_CACHE_TTL = float(os.getenv('LISTING_CACHE_TTL', '300'))
+# Bodies larger than this share of the bound are not cached
+MAX_ENTRY_SHARE = 0.1
+
+
+class ListingCache:
+    def __init__(self, max_bytes, ttl):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # (scope, user_id) -> keys of that listing's entries
+        self._by_listing = {}
+        self._size = 0
+        self._hits = 0
+        self._lookups = 0
+        self._lock = threading.Lock()
+
+    def _record(self, scope, result):
+        LISTING_CACHE_REQUESTS.inc(scope, result)
+        self._lookups += 1
+        self._hits += result == 'hit'
+        LISTING_CACHE_HIT_RATIO.set(value=self._hits / self._lookups)
+
+    def _drop(self, entry_key):
+        _, body, _ = self._entries.pop(entry_key)
+        self._size -= len(body)
+        scope, user_id, key = entry_key
+        keys = self._by_listing[(scope, user_id)]
+        keys.discard(key)
+        if not keys:
+            del self._by_listing[(scope, user_id)]
+
+    def get(self, scope, user_id, version, key=None):
+        """The body stored for this version of a listing, or None"""
+        if self.max_bytes <= 0:
+            return None
+        entry_key = (scope, user_id, key)
+        with self._lock:
+            entry = self._entries.get(entry_key)
+            if entry is None or entry[0] != version or time.monotonic() - entry[2] > self.ttl:
+                self._record(scope, 'miss')
+                return None
+            self._entries[entry_key] = (version, entry[1], time.monotonic())
+            self._entries.move_to_end(entry_key)
+            self._record(scope, 'hit')
+            return entry[1]
+
+    def put(self, scope, user_id, version, body, key=None):
+        """Store a serialized listing built from version; returns body"""
+        if len(body) > self.max_bytes * MAX_ENTRY_SHARE:
+            return body
+        entry_key = (scope, user_id, key)
+        now = time.monotonic()
+        with self._lock:
+            if entry_key in self._entries:
+                self._drop(entry_key)
+            self._entries[entry_key] = (version, body, now)
+            self._by_listing.setdefault((scope, user_id), set()).add(key)
+            self._size += len(body)
+            # Oldest first: expired entries, then whatever exceeds the bound
+            while self._entries:
+                oldest_key, (_, _, used_at) = next(iter(self._entries.items()))
+                if self._size <= self.max_bytes and now - used_at <= self.ttl:
+                    break
+                self._drop(oldest_key)
+                LISTING_CACHE_EVICTIONS.inc()
+            LISTING_CACHE_BYTES.set(value=self._size)
+        return body
+
+    def evict(self, scope, user_id):
+        """Drop every entry of one user's listing; returns how many"""
+        with self._lock:
+            keys = list(self._by_listing.get((scope, user_id), ()))
+            for key in keys:
+                self._drop((scope, user_id, key))
+            LISTING_CACHE_BYTES.set(value=self._size)
+        return len(keys)
+
+
+listing_cache = ListingCache(LISTING_CACHE_MAX_BYTES, LISTING_CACHE_TTL)
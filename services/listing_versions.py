@@ -0,0 +1,160 @@
+"""
+Per-user listing versions.
+
+Every write that changes what a listing endpoint returns bumps a version
+counter in the same transaction as the write. Listing endpoints derive a
+weak ETag from the counter, so a client polling an unchanged listing costs
+one primary-key lookup and a 304 instead of a query plus serialization.
+
+Global listings (all users) use user_id 0. The bucket listing is the
+exception: every upload and delete changes it, so a version row would
+serialize all writers on one row lock. Its version is a sequence instead,
+moved on with nextval() (no lock, never rolled back) once a change has
+been made in storage.
+
+Each bump also sends a NOTIFY on INVALIDATION_CHANNEL, delivered when the
+write commits. Processes subscribed to it (services/invalidation.py) keep
+the versions they have seen in known_versions and answer reads from there
+without a query; a process that wrote a version forgets its own copy as
+soon as the request ends, so its next read goes to the database.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from flask import g, has_request_context, request, Response
+from dotenv import load_dotenv
+from services.database import cursor, prepared
+
+# Load environment variables
+load_dotenv()
+
+FILES = 'files'
+LOGOS = 'logos'
+USERS = 'users'
+STORAGE = 'storage'
+
+GLOBAL_USER_ID = 0
+
+INVALIDATION_CHANNEL = 'listing_versions'
+# (scope, user_id) versions remembered per process
+KNOWN_VERSIONS_SIZE = int(os.getenv('LISTING_KNOWN_VERSIONS', '100000'))
+
+
+class KnownVersions:
+    """Latest listing versions seen on the invalidation bus, LRU bounded.
+
+    Only consulted while the bus is connected. A reader that went to the
+    database stores what it read unless a reset or forget happened since
+    it looked (the generation moved on), so a slow read can't overwrite
+    news from the bus.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.enabled = False
+        self.generation = 0
+        self._versions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, scope, user_id):
+        if not self.enabled:
+            return None
+        with self._lock:
+            version = self._versions.get((scope, user_id))
+            if version is not None:
+                self._versions.move_to_end((scope, user_id))
+            return version
+
+    def update(self, scope, user_id, version, generation=None):
+        """Record a version unless a newer one is known"""
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            key = (scope, user_id)
+            if self._versions.get(key, -1) < version:
+                self._versions[key] = version
+            self._versions.move_to_end(key)
+            while len(self._versions) > self.size:
+                self._versions.popitem(last=False)
+
+    def forget(self, keys):
+        with self._lock:
+            self.generation += 1
+            for key in keys:
+                self._versions.pop(key, None)
+
+    def reset(self, enabled):
+        """Drop everything, e.g. when notifications may have been missed"""
+        with self._lock:
+            self.generation += 1
+            self._versions.clear()
+            self.enabled = enabled
+
+
+known_versions = KnownVersions(KNOWN_VERSIONS_SIZE)
+
+
+def bump_listing_version(scope, user_id=GLOBAL_USER_ID):
+    """Increment a listing version; the caller commits with its own transaction"""
+    cursor.execute(
+        prepared("""WITH bumped AS (
+               INSERT INTO listing_versions (scope, user_id, version) VALUES (%s, %s, 1)
+               ON CONFLICT (scope, user_id) DO UPDATE SET version = listing_versions.version + 1
+               RETURNING version)
+           SELECT version, pg_notify(%s, json_build_object(
+               'scope', %s::text, 'user_id', %s::int, 'version', version,
+               'at', extract(epoch FROM clock_timestamp()))::text)
+           FROM bumped"""),
+        (scope, user_id, INVALIDATION_CHANNEL, scope, user_id)
+    )
+    if has_request_context():
+        g.setdefault('bumped_versions', set()).add((scope, user_id))
+    return cursor.fetchone()['version']
+
+
+def bump_storage_version():
+    """Mark the bucket listing as changed; call after the change was made in storage"""
+    cursor.execute(prepared("SELECT nextval('storage_listing_version')"))
+
+
+def get_storage_version():
+    # last_value is already 1 before the first nextval()
+    cursor.execute(prepared(
+        "SELECT CASE WHEN is_called THEN last_value ELSE 0 END AS version FROM storage_listing_version"))
+    return cursor.fetchone()['version']
+
+
+def get_listing_version(scope, user_id=GLOBAL_USER_ID):
+    version = known_versions.get(scope, user_id)
+    if version is not None:
+        return version
+    generation = known_versions.generation
+    cursor.execute(
+        prepared("SELECT version FROM listing_versions WHERE scope = %s AND user_id = %s"),
+        (scope, user_id)
+    )
+    row = cursor.fetchone()
+    version = row['version'] if row else 0
+    if known_versions.enabled:
+        known_versions.update(scope, user_id, version, generation)
+    return version
+
+
+def listing_etag(scope, user_id=GLOBAL_USER_ID):
+    """Weak ETag for a listing, derived from its version counter"""
+    return f"{scope}-{user_id}-{get_listing_version(scope, user_id)}"
+
+
+def not_modified_response(etag):
+    """Return a 304 response if the client already holds this ETag, else None"""
+    if request.if_none_match.contains_weak(etag):
+        return with_etag(Response(status=304), etag)
+    return None
+
+
+def with_etag(response, etag):
+    """Attach a weak ETag to a listing response and ask clients to revalidate"""
+    response.set_etag(etag, weak=True)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
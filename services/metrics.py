@@ -0,0 +1,408 @@
+"""
+Lightweight Prometheus-style instrumentation.
+
+Holds process-wide counters, gauges and histograms and renders them in the
+Prometheus text exposition format for the /metrics endpoint. Everything is
+kept in plain dicts guarded by a lock so recording a sample costs a bisect
+and a couple of additions, which is cheap enough to leave on in production.
+"""
+
+import os
+import re
+import threading
+import time
+from bisect import bisect_left
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'True').lower() == 'true'
+
+# Default latency buckets in seconds (roughly the Prometheus client defaults)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Size buckets in bytes for rendered documents
+SIZE_BUCKETS = (1024, 10 * 1024, 50 * 1024, 100 * 1024, 500 * 1024,
+                1024 * 1024, 5 * 1024 * 1024, 20 * 1024 * 1024)
+
+
+def _escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape_label(value)}"' for name,
+             value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class _Metric:
+    metric_type = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _check(self, labels):
+        # Only called when a new series is created, keeping the hot path short
+        if len(labels) != len(self.labelnames):
+            raise ValueError(
+                f"{self.name} expects labels {self.labelnames}, got {labels}")
+
+    def header(self):
+        return [f"# HELP {self.name} {self.documentation}",
+                f"# TYPE {self.name} {self.metric_type}"]
+
+
+class Counter(_Metric):
+    """Monotonically increasing value per label set"""
+    metric_type = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            value = self._values.get(labels)
+            if value is None:
+                self._check(labels)
+                value = 0
+            self._values[labels] = value + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def collect(self):
+        lines = self.header()
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Gauge(_Metric):
+    """Value that can go up and down per label set"""
+    metric_type = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name, documentation, labelnames)
+        self._values = {}
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            value = self._values.get(labels)
+            if value is None:
+                self._check(labels)
+                value = 0
+            self._values[labels] = value + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, *labels, value):
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = value
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def collect(self):
+        lines = self.header()
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.append(
+                f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram(_Metric):
+    """Bucketed distribution of observed values per label set"""
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts..., +Inf count, sum]
+        self._values = {}
+
+    def observe(self, *labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(labels)
+            if series is None:
+                self._check(labels)
+                series = [0] * (len(self.buckets) + 2)
+                self._values[labels] = series
+            series[index] += 1
+            series[-1] += value
+
+    def count(self, *labels):
+        series = self._values.get(labels)
+        return sum(series[:-1]) if series else 0
+
+    def collect(self):
+        lines = self.header()
+        with self._lock:
+            items = [(key, list(series))
+                     for key, series in self._values.items()]
+        for key, series in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), series[:-1]):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+_registry = []
+_registry_lock = threading.Lock()
+
+
+def register(metric):
+    """Add a metric to the process-wide registry and return it"""
+    with _registry_lock:
+        _registry.append(metric)
+    return metric
+
+
+def render_metrics():
+    """Render every registered metric in Prometheus text format"""
+    lines = []
+    with _registry_lock:
+        metrics = list(_registry)
+    for metric in metrics:
+        lines.extend(metric.collect())
+    return '\n'.join(lines) + '\n'
+
+
+# HTTP metrics
+HTTP_REQUESTS = register(Counter(
+    'http_requests_total', 'Total HTTP requests handled.',
+    ('blueprint', 'endpoint', 'method', 'status')))
+HTTP_REQUEST_SECONDS = register(Histogram(
+    'http_request_duration_seconds', 'HTTP request latency in seconds.',
+    ('blueprint', 'endpoint', 'method')))
+HTTP_IN_FLIGHT = register(Gauge(
+    'http_requests_in_flight', 'HTTP requests currently being served.',
+    ('blueprint',)))
+
+# Database metrics
+DB_QUERY_SECONDS = register(Histogram(
+    'db_query_duration_seconds', 'Database statement latency in seconds.',
+    ('operation', 'table')))
+DB_QUERY_ERRORS = register(Counter(
+    'db_query_errors_total', 'Database statements that raised an error.',
+    ('operation', 'table')))
+DB_REPLICA_READS = register(Counter(
+    'db_replica_reads_total', 'Read-only requests by where they were served (replica, primary).',
+    ('target',)))
+DB_REPLICA_UP = register(Gauge(
+    'db_replica_up', 'Whether a replica answered its last check as a standby (1) or not (0).',
+    ('replica',)))
+DB_REPLICA_STALENESS_SECONDS = register(Gauge(
+    'db_replica_staleness_seconds', 'Time since a replica was last seen holding every primary commit.',
+    ('replica',)))
+
+# S3 metrics
+S3_REQUEST_SECONDS = register(Histogram(
+    's3_request_duration_seconds', 'S3 API call latency in seconds.',
+    ('operation',)))
+S3_REQUEST_ERRORS = register(Counter(
+    's3_request_errors_total', 'S3 API calls that returned an error.',
+    ('operation',)))
+S3_CIRCUIT_STATE = register(Gauge(
+    's3_circuit_state', 'S3 circuit breaker state (0 closed, 1 half-open, 2 open).'))
+S3_CIRCUIT_REJECTIONS = register(Counter(
+    's3_circuit_rejections_total', 'S3 calls refused without a request while the breaker was open.'))
+S3_HEDGED_REQUESTS = register(Counter(
+    's3_hedged_requests_total', 'Hedged GetObject requests (sent, and won when the hedge answered first).',
+    ('outcome',)))
+
+# Object cache metrics
+STORAGE_CACHE_REQUESTS = register(Counter(
+    'storage_cache_requests_total', 'Object cache lookups by result (hit, revalidated, miss, bypass).',
+    ('result',)))
+STORAGE_CACHE_HIT_RATIO = register(Gauge(
+    'storage_cache_hit_ratio', 'Share of object cache lookups served without fetching the object.'))
+STORAGE_CACHE_BYTES_SAVED = register(Counter(
+    'storage_cache_bytes_saved_total', 'Object bytes served from the cache instead of storage.'))
+STORAGE_CACHE_EVICTIONS = register(Counter(
+    'storage_cache_evictions_total', 'Objects evicted from the cache to stay under its size bound.'))
+
+# Listing cache metrics
+LISTING_CACHE_REQUESTS = register(Counter(
+    'listing_cache_requests_total', 'Listing cache lookups by scope and result (hit, miss).',
+    ('scope', 'result')))
+LISTING_CACHE_HIT_RATIO = register(Gauge(
+    'listing_cache_hit_ratio', 'Share of listing cache lookups served from the cache.'))
+LISTING_CACHE_BYTES = register(Gauge(
+    'listing_cache_bytes', 'Bytes of serialized listings held by the cache.'))
+LISTING_CACHE_EVICTIONS = register(Counter(
+    'listing_cache_evictions_total', 'Listings evicted from the cache as expired or to stay under its bound.'))
+
+# Cache invalidation bus metrics
+INVALIDATION_EVENTS = register(Counter(
+    'cache_invalidation_events_total', 'Listing version notifications received, by scope.',
+    ('scope',)))
+INVALIDATION_LAG_SECONDS = register(Histogram(
+    'cache_invalidation_lag_seconds', 'Time from a listing version bump to its notification arriving.'))
+INVALIDATION_CONNECTED = register(Gauge(
+    'cache_invalidation_connected', 'Whether the invalidation listener is connected (1) or not (0).'))
+INVALIDATION_RECONNECTS = register(Counter(
+    'cache_invalidation_reconnects_total', 'Times the invalidation listener lost its connection.'))
+
+# Outbox metrics
+OUTBOX_ENTRIES = register(Counter(
+    'outbox_entries_total', 'Outbox entries handled, by kind and outcome (done, retried, failed).',
+    ('kind', 'outcome')))
+OUTBOX_LAG_SECONDS = register(Histogram(
+    'outbox_lag_seconds', 'Time from an outbox entry becoming due to its handler finishing.',
+    ('kind',)))
+
+# PDF renderer metrics
+PDF_RENDER_SECONDS = register(Histogram(
+    'pdf_render_duration_seconds', 'wkhtmltopdf render time in seconds.',
+    ('endpoint',)))
+PDF_RENDER_BYTES = register(Histogram(
+    'pdf_render_output_bytes', 'Size of rendered PDF documents in bytes.',
+    ('endpoint',), buckets=SIZE_BUCKETS))
+PDF_RENDER_BYTES_TOTAL = register(Counter(
+    'pdf_render_output_bytes_total', 'Total bytes of PDF output rendered.',
+    ('endpoint',)))
+
+
+# SQL statements are labelled by operation and table so label cardinality
+# stays bounded no matter how many distinct statements exist.
+_SQL_TABLE_PATTERN = re.compile(
+    r'\b(?:FROM|INTO|UPDATE|TABLE(?:\s+IF\s+(?:NOT\s+)?EXISTS)?|ON)\s+([A-Za-z_][A-Za-z0-9_]*)',
+    re.IGNORECASE)
+_sql_label_cache = {}
+
+
+def sql_labels(sql):
+    """Return the (operation, table) labels for a SQL statement"""
+    if isinstance(sql, bytes):
+        sql = sql.decode('utf-8', 'replace')
+    elif not isinstance(sql, str):
+        sql = str(sql)
+    labels = _sql_label_cache.get(sql)
+    if labels is None:
+        words = sql.split(None, 1)
+        operation = words[0].upper() if words else 'UNKNOWN'
+        match = _SQL_TABLE_PATTERN.search(sql)
+        table = match.group(1).lower() if match else 'none'
+        labels = (operation, table)
+        if len(_sql_label_cache) < 1024:
+            _sql_label_cache[sql] = labels
+    return labels
+
+
+def observe_db_query(sql, seconds, failed=False):
+    """Record the latency of one database statement"""
+    if not METRICS_ENABLED:
+        return
+    operation, table = sql_labels(sql)
+    DB_QUERY_SECONDS.observe(operation, table, value=seconds)
+    if failed:
+        DB_QUERY_ERRORS.inc(operation, table)
+
+
+def observe_pdf_render(endpoint, seconds, pdf_data):
+    """Record the render time and output size of one PDF"""
+    if not METRICS_ENABLED:
+        return
+    size = len(pdf_data) if pdf_data else 0
+    PDF_RENDER_SECONDS.observe(endpoint, value=seconds)
+    PDF_RENDER_BYTES.observe(endpoint, value=size)
+    PDF_RENDER_BYTES_TOTAL.inc(endpoint, amount=size)
+
+
+def instrument_s3_client(client):
+    """Time every S3 API call made through a boto3 client via its event hooks"""
+    if not METRICS_ENABLED:
+        return client
+
+    def before_call(model, context, **kwargs):
+        context['metrics_start'] = time.perf_counter()
+        context['metrics_operation'] = model.name
+
+    def after_call(model, context, http_response=None, parsed=None, **kwargs):
+        start = context.pop('metrics_start', None)
+        if start is None:
+            return
+        S3_REQUEST_SECONDS.observe(
+            model.name, value=time.perf_counter() - start)
+        if http_response is None or http_response.status_code >= 400:
+            S3_REQUEST_ERRORS.inc(model.name)
+
+    def after_call_error(context, **kwargs):
+        # Connection-level failures carry no operation model, only the context
+        start = context.pop('metrics_start', None)
+        if start is None:
+            return
+        operation = context.get('metrics_operation', 'unknown')
+        S3_REQUEST_SECONDS.observe(
+            operation, value=time.perf_counter() - start)
+        S3_REQUEST_ERRORS.inc(operation)
+
+    client.meta.events.register('before-call.s3', before_call)
+    client.meta.events.register('after-call.s3', after_call)
+    client.meta.events.register('after-call-error.s3', after_call_error)
+    return client
+
+
+def init_metrics(app):
+    """Register request timing hooks on a Flask app"""
+    if not METRICS_ENABLED:
+        return
+
+    from flask import g, request
+
+    @app.before_request
+    def start_request_timer():
+        blueprint = request.blueprint or 'app'
+        g.metrics_start = time.perf_counter()
+        g.metrics_blueprint = blueprint
+        HTTP_IN_FLIGHT.inc(blueprint)
+
+    @app.after_request
+    def record_request_metrics(response):
+        start = g.get('metrics_start')
+        if start is not None:
+            blueprint = g.metrics_blueprint
+            endpoint = request.endpoint or 'unmatched'
+            HTTP_REQUEST_SECONDS.observe(
+                blueprint, endpoint, request.method,
+                value=time.perf_counter() - start)
+            HTTP_REQUESTS.inc(blueprint, endpoint,
+                              request.method, response.status_code)
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        blueprint = g.pop('metrics_blueprint', None)
+        if blueprint is not None:
+            HTTP_IN_FLIGHT.dec(blueprint)
@@ -0,0 +1,313 @@
+"""
+Read-through disk cache for hot stored objects.
+
+Downloads of the same few objects (recent invoices, logos, shared
+templates) would otherwise be a full S3 GET each time. With
+STORAGE_CACHE_DIR set, get_object() keeps up to STORAGE_CACHE_MAX_BYTES of
+them on local disk and serves hits as open files, which the WSGI server can
+sendfile.
+
+- Entries are a data file plus a JSON sidecar naming it, under a directory
+  shared by all worker processes. A refill writes a new data file and
+  switches the sidecar with a rename, so readers never see a torn entry.
+- Entries younger than STORAGE_CACHE_REVALIDATE seconds are served as they
+  are; older ones are revalidated with a HEAD and kept if the ETag still
+  matches.
+- Concurrent misses for a key, in any thread or process, are coalesced
+  with an flock so only one of them fetches the object.
+- Least recently used entries (by data file atime, set on every hit) are
+  evicted once the cache grows past its bound. The same scan, also run at
+  startup, deletes data files no sidecar names once they are older than
+  ORPHAN_GRACE: they were left by a process that died mid-fill.
+- Deletes and overwrites through the S3 client invalidate the key's entry.
+
+Objects larger than STORAGE_CACHE_MAX_OBJECT_SIZE bypass the cache. Only the
+S3 backend is cached; the local backend already serves files from disk.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from dotenv import load_dotenv
+from services.storage import storage, StoredObject, ObjectNotFound, CHUNK_SIZE
+from services.metrics import (
+    STORAGE_CACHE_REQUESTS, STORAGE_CACHE_HIT_RATIO, STORAGE_CACHE_BYTES_SAVED, STORAGE_CACHE_EVICTIONS)
+
+# Load environment variables
+load_dotenv()
+
+# Empty disables the cache
+STORAGE_CACHE_DIR = os.getenv('STORAGE_CACHE_DIR', '')
+STORAGE_CACHE_MAX_BYTES = int(os.getenv('STORAGE_CACHE_MAX_BYTES', str(1024 ** 3)))
+STORAGE_CACHE_MAX_OBJECT_SIZE = int(os.getenv('STORAGE_CACHE_MAX_OBJECT_SIZE', str(64 * 1024 * 1024)))
+STORAGE_CACHE_REVALIDATE = int(os.getenv('STORAGE_CACHE_REVALIDATE', '60'))
+
+# Misses coalesce on one of this many lock files
+LOCK_STRIPES = 4096
+# Eviction frees down to this share of the bound, so it doesn't run on every fill
+EVICT_TO = 0.9
+# Seconds before an unnamed data file or temporary sidecar counts as abandoned;
+# younger ones may still be filling
+ORPHAN_GRACE = 3600
+# S3 calls that remove or replace an object
+INVALIDATING_OPERATIONS = ('DeleteObject', 'DeleteObjects', 'PutObject', 'CopyObject',
+                           'CompleteMultipartUpload')
+
+
+class ObjectCache:
+    def __init__(self, backend, directory, max_bytes, max_object_size=STORAGE_CACHE_MAX_OBJECT_SIZE,
+                 revalidate_after=STORAGE_CACHE_REVALIDATE):
+        self.backend = backend
+        self.directory = os.path.abspath(directory)
+        self.max_bytes = max_bytes
+        self.max_object_size = max_object_size
+        self.revalidate_after = revalidate_after
+        self.locks_dir = os.path.join(self.directory, '.locks')
+        self.tmp_dir = os.path.join(self.directory, '.tmp')
+        os.makedirs(self.locks_dir, exist_ok=True)
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        # Bytes cached, as of the last scan plus this process's fills since
+        self._size = None
+        self._size_lock = threading.Lock()
+        self._hits = 0
+        self._lookups = 0
+        # Clear what crashed processes left and evict if over the bound
+        self._grow(0)
+
+    def _entry_path(self, key):
+        digest = hashlib.sha256(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest[:2], digest)
+
+    def _lock(self, entry_path):
+        """Exclusive flock on the key's lock stripe; works across threads and processes"""
+        stripe = int(os.path.basename(entry_path)[:3], 16) % LOCK_STRIPES
+        lock_file = open(os.path.join(self.locks_dir, f"{stripe:03x}"), 'a')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        return lock_file
+
+    def _record(self, result, saved=0):
+        STORAGE_CACHE_REQUESTS.inc(result)
+        if saved:
+            STORAGE_CACHE_BYTES_SAVED.inc(amount=saved)
+        with self._size_lock:
+            self._lookups += 1
+            self._hits += result in ('hit', 'revalidated')
+            STORAGE_CACHE_HIT_RATIO.set(value=self._hits / self._lookups)
+
+    def _read_entry(self, entry_path):
+        """The entry's sidecar and open data file, or (None, None)"""
+        try:
+            with open(entry_path + '.json') as f:
+                entry = json.load(f)
+            return entry, open(os.path.join(os.path.dirname(entry_path), entry['file']), 'rb')
+        except (OSError, ValueError):
+            return None, None
+
+    def _stored_object(self, key, entry, body):
+        # Reading counts as use for the LRU, whatever the mount's atime setting
+        stat = os.fstat(body.fileno())
+        os.utime(body.fileno(), (time.time(), stat.st_mtime))
+        last_modified = entry['last_modified']
+        if last_modified is not None:
+            last_modified = datetime.fromtimestamp(last_modified, timezone.utc)
+        return StoredObject(key, entry['size'], entry['content_type'], entry['content_encoding'],
+                            entry['metadata'], last_modified, body,
+                            etag=entry['etag'], from_cache=True)
+
+    def _write_sidecar(self, entry_path, entry):
+        temp_path = os.path.join(self.tmp_dir, uuid.uuid4().hex)
+        with open(temp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(temp_path, entry_path + '.json')
+
+    def _fill(self, key, entry_path, stored, old_entry):
+        """Copy a freshly fetched object into the cache and return it served from there"""
+        data_name = f"{os.path.basename(entry_path)}.{uuid.uuid4().hex[:12]}"
+        data_path = os.path.join(os.path.dirname(entry_path), data_name)
+        os.makedirs(os.path.dirname(entry_path), exist_ok=True)
+        try:
+            with open(data_path, 'wb') as f:
+                for chunk in stored.iter_chunks(CHUNK_SIZE):
+                    f.write(chunk)
+        except Exception:
+            if os.path.exists(data_path):
+                os.remove(data_path)
+            raise
+        finally:
+            stored.close()
+        entry = {'key': key, 'file': data_name, 'size': stored.size, 'etag': stored.etag,
+                 'content_type': stored.content_type, 'content_encoding': stored.content_encoding,
+                 'metadata': stored.metadata,
+                 'last_modified': stored.last_modified.timestamp() if stored.last_modified else None,
+                 'validated_at': time.time()}
+        body = open(data_path, 'rb')
+        self._write_sidecar(entry_path, entry)
+        if old_entry:
+            self._remove_file(os.path.join(os.path.dirname(entry_path), old_entry['file']))
+        self._grow(stored.size)
+        return self._stored_object(key, entry, body)
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+    def get(self, key):
+        """Open an object for reading, from the cache when possible"""
+        entry_path = self._entry_path(key)
+        entry, body = self._read_entry(entry_path)
+        if entry and time.time() - entry['validated_at'] < self.revalidate_after:
+            self._record('hit', entry['size'])
+            return self._stored_object(key, entry, body)
+        if body:
+            body.close()
+
+        lock_file = self._lock(entry_path)
+        try:
+            # Someone else may have filled or revalidated it while we waited
+            entry, body = self._read_entry(entry_path)
+            if entry and time.time() - entry['validated_at'] < self.revalidate_after:
+                self._record('hit', entry['size'])
+                return self._stored_object(key, entry, body)
+            if entry:
+                try:
+                    current = self.backend.head(key)
+                except ObjectNotFound:
+                    body.close()
+                    self._remove_entry(entry_path)
+                    raise
+                if current.etag == entry['etag']:
+                    entry['validated_at'] = time.time()
+                    self._write_sidecar(entry_path, entry)
+                    self._record('revalidated', entry['size'])
+                    return self._stored_object(key, entry, body)
+                body.close()
+
+            stored = self.backend.get(key)
+            if stored.size > self.max_object_size:
+                self._record('bypass')
+                return stored
+            self._record('miss')
+            return self._fill(key, entry_path, stored, entry)
+        finally:
+            lock_file.close()
+
+    def _remove_entry(self, entry_path):
+        entry, body = self._read_entry(entry_path)
+        if body:
+            body.close()
+        self._remove_file(entry_path + '.json')
+        if entry:
+            self._remove_file(os.path.join(os.path.dirname(entry_path), entry['file']))
+
+    def invalidate(self, keys):
+        """Drop keys' entries; waits for fills in progress so they can't put one back"""
+        for key in dict.fromkeys(keys):
+            entry_path = self._entry_path(key)
+            if not os.path.exists(entry_path + '.json'):
+                continue
+            lock_file = self._lock(entry_path)
+            try:
+                self._remove_entry(entry_path)
+            finally:
+                lock_file.close()
+
+    def _remove_abandoned(self, items, now):
+        """Delete files older than ORPHAN_GRACE; returns the bytes of those kept"""
+        kept = 0
+        for item in items:
+            try:
+                stat = item.stat()
+            except OSError:
+                continue
+            if now - stat.st_mtime > ORPHAN_GRACE:
+                self._remove_file(item.path)
+            else:
+                kept += stat.st_size
+        return kept
+
+    def _scan(self):
+        """(atime, size, sidecar, data file) of every entry, least recently used first, and
+        the bytes of data files still being filled. Abandoned ones are deleted on the way.
+        """
+        now = time.time()
+        entries = []
+        filling = 0
+        for shard in os.scandir(self.directory):
+            if not shard.is_dir() or shard.name.startswith('.'):
+                continue
+            named = set()
+            unnamed = []
+            for item in os.scandir(shard.path):
+                if not item.name.endswith('.json'):
+                    unnamed.append(item)
+                    continue
+                try:
+                    with open(item.path) as f:
+                        data_name = json.load(f)['file']
+                    data_path = os.path.join(shard.path, data_name)
+                    stat = os.stat(data_path)
+                except (OSError, ValueError, KeyError):
+                    continue
+                named.add(data_name)
+                entries.append((stat.st_atime, stat.st_size, item.path, data_path))
+            filling += self._remove_abandoned([item for item in unnamed if item.name not in named], now)
+        self._remove_abandoned(os.scandir(self.tmp_dir), now)
+        entries.sort()
+        return entries, filling
+
+    def _grow(self, size):
+        with self._size_lock:
+            if self._size is not None:
+                self._size += size
+                if self._size <= self.max_bytes:
+                    return
+            # Other processes fill the same directory, so recount before evicting
+            entries, filling = self._scan()
+            self._size = filling + sum(entry[1] for entry in entries)
+            for _, size, sidecar, data_path in entries:
+                if self._size <= self.max_bytes * EVICT_TO:
+                    break
+                self._remove_file(sidecar)
+                self._remove_file(data_path)
+                self._size -= size
+                STORAGE_CACHE_EVICTIONS.inc()
+
+    def watch_client(self, client):
+        """Invalidate keys an S3 client deletes or overwrites, before and after the call"""
+        def keys_of(params):
+            if 'Delete' in params:
+                return [item['Key'] for item in params['Delete'].get('Objects', [])]
+            return [params['Key']] if 'Key' in params else []
+
+        def before(params, context, **kwargs):
+            context['object_cache_keys'] = keys_of(params)
+            self.invalidate(context['object_cache_keys'])
+
+        def after(context, **kwargs):
+            self.invalidate(context.pop('object_cache_keys', []))
+
+        for operation in INVALIDATING_OPERATIONS:
+            client.meta.events.register(f'before-parameter-build.s3.{operation}', before)
+            client.meta.events.register(f'after-call.s3.{operation}', after)
+            client.meta.events.register(f'after-call-error.s3.{operation}', after)
+
+
+object_cache = None
+if STORAGE_CACHE_DIR and storage.name == 's3':
+    object_cache = ObjectCache(storage, STORAGE_CACHE_DIR, STORAGE_CACHE_MAX_BYTES)
+    for client in storage.clients:
+        object_cache.watch_client(client)
+
+
+def get_object(key):
+    """Open an object for a download, through the cache when it is enabled"""
+    if object_cache is None:
+        return storage.get(key)
+    return object_cache.get(key)
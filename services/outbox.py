@@ -0,0 +1,189 @@
+"""
+Transactional outbox for side effects that must follow a database change.
+
+A request that changes metadata and also needs storage work done (deleting
+the objects of removed rows, say) writes an outbox entry in the same
+transaction with enqueue(). The entry commits or rolls back with the change
+itself, so the work is never lost after a commit nor done for a change that
+never happened, and the request only waits for the commit.
+
+Background workers (OUTBOX_WORKERS threads per process) claim due entries
+with SKIP LOCKED, run the handler registered for their kind outside the
+claiming transaction, and delete them once it succeeds. A claimed entry is
+leased for OUTBOX_LEASE seconds; if the process dies meanwhile another
+worker picks it up when the lease runs out, so handlers must be idempotent.
+Failed entries are retried with exponential backoff and parked (failed_at
+set, kept for inspection) after OUTBOX_MAX_ATTEMPTS attempts.
+
+Entries can be delayed: an upload enqueues the cleanup of its objects to
+run OUTBOX_ORPHAN_GRACE seconds later, commits it before the PUT with
+enqueue_committed(), and cancels it in the transaction that records the
+objects; the cleanup only ever runs for uploads whose rows never committed.
+enqueue_committed() writes on a connection of its own, from a small pool
+(OUTBOX_COMMIT_POOL_MAX) so it never waits on the connections requests
+hold, and leaves the caller's transaction open and uncommitted.
+"""
+
+import os
+import threading
+import time
+from flask import g, has_request_context
+from psycopg2.extras import Json
+from dotenv import load_dotenv
+from services.database import (
+    ConnectionPool, DB_POOL_TIMEOUT, InstrumentedCursor, cursor, conn, pool, release_connection)
+from services.metrics import OUTBOX_ENTRIES, OUTBOX_LAG_SECONDS
+
+# Load environment variables
+load_dotenv()
+
+# Worker threads per process; 0 leaves the outbox to other processes
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '2'))
+# Seconds an idle worker waits before polling again; enqueues in this
+# process wake it straight away
+OUTBOX_POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '1'))
+OUTBOX_BATCH = int(os.getenv('OUTBOX_BATCH', '10'))
+# Seconds a claimed entry is left to its worker before others may retry it
+OUTBOX_LEASE = int(os.getenv('OUTBOX_LEASE', '300'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '10'))
+OUTBOX_RETRY_BASE = float(os.getenv('OUTBOX_RETRY_BASE', '2'))
+OUTBOX_RETRY_MAX = float(os.getenv('OUTBOX_RETRY_MAX', '600'))
+# Seconds after which the objects of an upload that never committed are deleted
+OUTBOX_ORPHAN_GRACE = int(os.getenv('OUTBOX_ORPHAN_GRACE', '3600'))
+# Connections for entries committed apart from the caller's transaction
+OUTBOX_COMMIT_POOL_MAX = int(os.getenv('OUTBOX_COMMIT_POOL_MAX', '4'))
+
+_handlers = {}
+_wakeup = threading.Event()
+_commit_pool = ConnectionPool(0, OUTBOX_COMMIT_POOL_MAX, **pool.connect_kwargs)
+
+
+def handler(kind):
+    """Register a function(payload) that performs entries of this kind"""
+    def register(function):
+        _handlers[kind] = function
+        return function
+    return register
+
+
+def enqueue(kind, payload, delay=0):
+    """Add an entry in the caller's transaction; returns its id.
+
+    Runs delay seconds after the caller commits at the earliest.
+    """
+    cursor.execute(
+        "INSERT INTO outbox (kind, payload, available_at) VALUES (%s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second') RETURNING id",
+        (kind, Json(payload), delay)
+    )
+    if not delay and has_request_context():
+        g.outbox_pending = True
+    return cursor.fetchone()['id']
+
+
+def enqueue_committed(kind, payload, delay=0):
+    """Add an entry and commit it straight away, apart from the caller's transaction; returns its id"""
+    connection = _commit_pool.getconn(timeout=DB_POOL_TIMEOUT)
+    try:
+        with connection.cursor(cursor_factory=InstrumentedCursor) as cur:
+            cur.execute(
+                "INSERT INTO outbox (kind, payload, available_at) VALUES (%s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second') RETURNING id",
+                (kind, Json(payload), delay)
+            )
+            entry_id = cur.fetchone()['id']
+        connection.commit()
+    finally:
+        _commit_pool.putconn(connection)
+    if not delay:
+        wake()
+    return entry_id
+
+
+def cancel(entry_id):
+    """Drop a pending entry in the caller's transaction"""
+    cursor.execute("DELETE FROM outbox WHERE id = %s", (entry_id,))
+
+
+def wake():
+    """Have an idle worker look for due entries now"""
+    _wakeup.set()
+
+
+def _retry_delay(attempts):
+    return min(OUTBOX_RETRY_BASE * 2 ** (attempts - 1), OUTBOX_RETRY_MAX)
+
+
+def drain(limit=OUTBOX_BATCH):
+    """Claim up to limit due entries and run them; returns how many were claimed"""
+    cursor.execute(
+        """UPDATE outbox SET attempts = outbox.attempts + 1,
+               available_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+           FROM (SELECT id, available_at FROM outbox
+                 WHERE failed_at IS NULL AND available_at <= CURRENT_TIMESTAMP
+                 ORDER BY available_at LIMIT %s FOR UPDATE SKIP LOCKED) AS due
+           WHERE outbox.id = due.id
+           RETURNING outbox.id, outbox.kind, outbox.payload, outbox.attempts,
+                     EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - due.available_at) AS waited""",
+        (OUTBOX_LEASE, limit)
+    )
+    entries = cursor.fetchall()
+    conn.commit()
+
+    done = []
+    for entry in entries:
+        started = time.perf_counter()
+        try:
+            function = _handlers.get(entry['kind'])
+            if function is None:
+                raise LookupError(f"No outbox handler for '{entry['kind']}'")
+            function(entry['payload'])
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            parked = entry['attempts'] >= OUTBOX_MAX_ATTEMPTS
+            cursor.execute(
+                """UPDATE outbox SET last_error = %s,
+                       available_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second',
+                       failed_at = CASE WHEN %s THEN CURRENT_TIMESTAMP END
+                   WHERE id = %s""",
+                (str(e), _retry_delay(entry['attempts']), parked, entry['id'])
+            )
+            conn.commit()
+            OUTBOX_ENTRIES.inc(entry['kind'], 'failed' if parked else 'retried')
+            print(f"❌ Outbox entry {entry['id']} ({entry['kind']}) failed on attempt "
+                  f"{entry['attempts']}{', giving up' if parked else ''}: {e}")
+            continue
+        done.append(entry['id'])
+        OUTBOX_ENTRIES.inc(entry['kind'], 'done')
+        OUTBOX_LAG_SECONDS.observe(entry['kind'],
+                                   value=float(entry['waited']) + time.perf_counter() - started)
+
+    if done:
+        cursor.execute("DELETE FROM outbox WHERE id = ANY(%s)", (done,))
+        conn.commit()
+    return len(entries)
+
+
+def _worker_loop():
+    while True:
+        try:
+            claimed = drain()
+        except Exception as e:
+            print(f"❌ Outbox worker failed: {e}")
+            claimed = 0
+        finally:
+            # Rolls back whatever the failure left open
+            release_connection()
+        if not claimed:
+            _wakeup.wait(OUTBOX_POLL_INTERVAL)
+            _wakeup.clear()
+
+
+def init_outbox(app):
+    """Start the outbox workers, and wake one after requests that enqueued work"""
+    @app.teardown_request
+    def wake_after_commit(exc=None):
+        if g.pop('outbox_pending', False):
+            wake()
+
+    for index in range(OUTBOX_WORKERS):
+        threading.Thread(target=_worker_loop, name=f'outbox-{index}', daemon=True).start()
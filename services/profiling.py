@@ -0,0 +1,341 @@
+"""
+On-demand per-request profiling.
+
+A request is profiled when it carries a valid signed X-Profile-Signature
+header, or when an operator has armed the profiler for a path prefix via the
+admin endpoints. The request then runs under cProfile (or a lightweight
+stack sampler) plus tracemalloc, and the captures are written to PROFILE_DIR
+with count and age based retention.
+
+Only one request is profiled at a time per process; concurrent candidates
+simply run unprofiled, so enabling this on a production pod cannot stack up
+profiler overhead.
+"""
+
+import cProfile
+import hashlib
+import hmac
+import io
+import json
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from datetime import datetime
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+PROFILE_SECRET = os.getenv("PROFILE_SECRET", "")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/invoice-profiles")
+PROFILE_MAX_CAPTURES = int(os.getenv("PROFILE_MAX_CAPTURES", "50"))
+PROFILE_MAX_AGE_HOURS = float(os.getenv("PROFILE_MAX_AGE_HOURS", "24"))
+# Signed headers older than this are rejected to limit replay
+PROFILE_SIGNATURE_TTL = int(os.getenv("PROFILE_SIGNATURE_TTL", "300"))
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "10"))
+PROFILE_TOP_ALLOCATIONS = 30
+
+PROFILE_MODES = ('cprofile', 'sample')
+CAPTURE_ID_PATTERN = re.compile(r'^[0-9]{8}T[0-9]{6}-[0-9a-f]{8}$')
+
+# Only one capture may run at a time (tracemalloc is process-wide)
+_capture_lock = threading.Lock()
+
+# Admin toggle: profile the next `remaining` requests whose path starts with prefix
+_armed = {"path_prefix": None, "remaining": 0, "mode": "cprofile"}
+_armed_lock = threading.Lock()
+
+
+def sign_request(method, path, timestamp=None):
+    """Build an X-Profile-Signature header value for a method and path"""
+    timestamp = int(timestamp if timestamp is not None else time.time())
+    message = f"{timestamp}:{method.upper()}:{path}".encode()
+    digest = hmac.new(PROFILE_SECRET.encode(), message,
+                      hashlib.sha256).hexdigest()
+    return f"{timestamp}:{digest}"
+
+
+def verify_signature(header, method, path):
+    """Check a signed profiling header; signatures expire after the TTL"""
+    if not PROFILE_SECRET or not header or ':' not in header:
+        return False
+    timestamp, _ = header.split(':', 1)
+    try:
+        timestamp = int(timestamp)
+    except ValueError:
+        return False
+    if abs(time.time() - timestamp) > PROFILE_SIGNATURE_TTL:
+        return False
+    expected = sign_request(method, path, timestamp)
+    return hmac.compare_digest(header.encode(), expected.encode())
+
+
+def arm(path_prefix, count=1, mode='cprofile'):
+    """Profile the next `count` requests under path_prefix"""
+    with _armed_lock:
+        _armed.update(path_prefix=path_prefix,
+                      remaining=max(int(count), 0), mode=mode)
+        return dict(_armed)
+
+
+def disarm():
+    with _armed_lock:
+        _armed.update(path_prefix=None, remaining=0)
+        return dict(_armed)
+
+
+def armed_state():
+    with _armed_lock:
+        return dict(_armed)
+
+
+def _take_armed(path):
+    with _armed_lock:
+        prefix = _armed["path_prefix"]
+        if prefix is None or _armed["remaining"] <= 0 or not path.startswith(prefix):
+            return None
+        _armed["remaining"] -= 1
+        if _armed["remaining"] == 0:
+            _armed["path_prefix"] = None
+        return _armed["mode"]
+
+
+class StackSampler:
+    """Samples one thread's stack at a fixed interval into collapsed stacks"""
+
+    def __init__(self, thread_id, interval=PROFILE_SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(
+                    f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(stack))] += 1
+
+    def collapsed(self):
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Capture:
+    """Profiler state for a single request"""
+
+    def __init__(self, mode, method, path):
+        self.mode = mode
+        self.method = method
+        self.path = path
+        self.capture_id = f"{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.profiler = None
+        self.sampler = None
+        self.started_tracemalloc = False
+        self.start_time = None
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+            self.started_tracemalloc = True
+        tracemalloc.reset_peak()
+        if self.mode == 'sample':
+            self.sampler = StackSampler(threading.get_ident())
+            self.sampler.start()
+        else:
+            self.profiler = cProfile.Profile()
+            self.profiler.enable()
+        self.start_time = time.perf_counter()
+
+    def stop(self, status_code):
+        duration = time.perf_counter() - self.start_time
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self.sampler is not None:
+            self.sampler.stop()
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        if self.started_tracemalloc:
+            tracemalloc.stop()
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        base = os.path.join(PROFILE_DIR, self.capture_id)
+        artifacts = []
+
+        if self.profiler is not None:
+            self.profiler.dump_stats(base + '.pstats')
+            summary = io.StringIO()
+            pstats.Stats(self.profiler, stream=summary).sort_stats(
+                'cumulative').print_stats(50)
+            with open(base + '.txt', 'w') as f:
+                f.write(summary.getvalue())
+            artifacts.extend(['pstats', 'txt'])
+        if self.sampler is not None:
+            with open(base + '.collapsed', 'w') as f:
+                f.write(self.sampler.collapsed())
+            artifacts.append('collapsed')
+
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+        with open(base + '.allocations.txt', 'w') as f:
+            f.write(f"current={current} peak={peak}\n")
+            for stat in snapshot.statistics('traceback')[:PROFILE_TOP_ALLOCATIONS]:
+                f.write(f"\n{stat.size} bytes in {stat.count} blocks\n")
+                for line in stat.traceback.format():
+                    f.write(f"{line}\n")
+        artifacts.append('allocations.txt')
+
+        metadata = {
+            "id": self.capture_id,
+            "mode": self.mode,
+            "method": self.method,
+            "path": self.path,
+            "status": status_code,
+            "duration_seconds": round(duration, 6),
+            "memory_peak_bytes": peak,
+            "created_at": datetime.utcnow().isoformat(),
+            "artifacts": artifacts,
+        }
+        with open(base + '.json', 'w') as f:
+            json.dump(metadata, f)
+        apply_retention()
+        return metadata
+
+
+def start_capture(method, path, signature_header=None, requested_mode=None):
+    """Start profiling the current request if it is authorized; returns a Capture or None"""
+    signed = verify_signature(signature_header, method, path)
+    if not signed and not _armed["remaining"]:
+        return None
+
+    # One capture at a time; an armed slot is only used once the lock is held,
+    # so requests skipped while another capture runs leave it for the next one
+    if not _capture_lock.acquire(blocking=False):
+        return None
+    if signed:
+        mode = requested_mode if requested_mode in PROFILE_MODES else 'cprofile'
+    else:
+        mode = _take_armed(path)
+        if mode is None:
+            _capture_lock.release()
+            return None
+    capture = Capture(mode, method, path)
+    try:
+        capture.start()
+    except Exception:
+        _capture_lock.release()
+        raise
+    return capture
+
+
+def finish_capture(capture, status_code):
+    try:
+        return capture.stop(status_code)
+    finally:
+        _capture_lock.release()
+
+
+def list_captures():
+    """Return capture metadata, newest first"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    captures = []
+    for name in os.listdir(PROFILE_DIR):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, name)) as f:
+                captures.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    captures.sort(key=lambda capture: capture.get('created_at', ''), reverse=True)
+    return captures
+
+
+def capture_path(capture_id, artifact):
+    """Resolve an artifact file for a capture, or None if it does not exist"""
+    if not CAPTURE_ID_PATTERN.match(capture_id):
+        return None
+    if artifact not in ('pstats', 'txt', 'collapsed', 'allocations.txt', 'json'):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{capture_id}.{artifact}")
+    return path if os.path.isfile(path) else None
+
+
+def apply_retention():
+    """Delete captures beyond PROFILE_MAX_CAPTURES or older than PROFILE_MAX_AGE_HOURS"""
+    if not os.path.isdir(PROFILE_DIR):
+        return
+    groups = {}
+    for name in os.listdir(PROFILE_DIR):
+        capture_id = name.split('.', 1)[0]
+        if CAPTURE_ID_PATTERN.match(capture_id):
+            groups.setdefault(capture_id, []).append(name)
+
+    cutoff = time.time() - PROFILE_MAX_AGE_HOURS * 3600
+    # Capture ids start with a sortable UTC timestamp
+    ordered = sorted(groups, reverse=True)
+    for index, capture_id in enumerate(ordered):
+        paths = [os.path.join(PROFILE_DIR, name) for name in groups[capture_id]]
+        try:
+            newest = max(os.path.getmtime(path) for path in paths)
+        except OSError:
+            continue
+        if index >= PROFILE_MAX_CAPTURES or newest < cutoff:
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def init_profiling(app):
+    """Register hooks that profile authorized requests"""
+    from flask import g, request
+
+    @app.before_request
+    def start_request_profile():
+        if not PROFILE_SECRET and not _armed["remaining"]:
+            return
+        g.profile_capture = start_capture(
+            request.method, request.path,
+            request.headers.get('X-Profile-Signature'),
+            request.headers.get('X-Profile-Mode'))
+
+    @app.after_request
+    def finish_request_profile(response):
+        capture = g.pop('profile_capture', None)
+        if capture is not None:
+            metadata = finish_capture(capture, response.status_code)
+            response.headers['X-Profile-Id'] = metadata['id']
+        return response
+
+    @app.teardown_request
+    def abandon_request_profile(exc):
+        # after_request is skipped on unhandled errors; still release the profiler
+        capture = g.pop('profile_capture', None)
+        if capture is not None:
+            finish_capture(capture, 500)
@@ -0,0 +1,176 @@
+"""
+Bulk deletion of files and whole accounts.
+
+Rows are deleted first, in one transaction that also releases their blob
+references and queues the deletion of their objects in the outbox
+(services/outbox.py), so the request returns after the commit. Objects go
+in DeleteObjects calls of DELETE_BATCH keys, so an account with tens of
+thousands of files costs a few dozen storage calls. Shared blobs are only
+deleted once nothing else references them.
+
+An account purge is one outbox entry. Its keys are staged in
+purge_job_objects rather than in the entry's payload, and it works through
+them in chunks of PURGE_CHUNK keys (DeleteObjects calls in parallel on the
+storage executor). Each chunk's keys leave the staging table in the
+transaction that records its progress in purge_jobs, so if the process dies
+part way the entry runs again once its lease expires and carries on from
+the keys that are left.
+"""
+
+import uuid
+from services.database import cursor, conn
+from services.outbox import enqueue, handler
+from services.storage import storage, storage_executor, DELETE_BATCH, STORAGE_MAX_WORKERS
+from services.blobs import is_blob_key, record_released, release_blobs, release_objects, reap_blobs
+from services.listing_versions import FILES, LOGOS, USERS, bump_listing_version, bump_storage_version
+from services.upload_sessions import COMPLETED
+from services.usage import record_usage
+
+# Keys per progress update; one DeleteObjects call per worker
+PURGE_CHUNK = DELETE_BATCH * STORAGE_MAX_WORKERS
+
+PURGE_ACCOUNT = 'purge_account'
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def delete_released_objects(s3_keys):
+    """Delete the objects of committed, released rows; returns (deleted, failed).
+
+    Blobs still referenced elsewhere are left, and count as neither.
+    """
+    blob_keys = [key for key in s3_keys if is_blob_key(key)]
+    other_keys = [key for key in s3_keys if not is_blob_key(key)]
+    failed = 0
+    if other_keys:
+        failed = len(storage.delete(other_keys))
+        bump_storage_version()
+    reaped = reap_blobs(blob_keys) if blob_keys else 0
+    return len(other_keys) - failed + reaped, failed
+
+
+def purge_files(user_id, file_ids):
+    """Delete a user's files by id; returns (deleted ids, objects queued for deletion)"""
+    cursor.execute(
+        "DELETE FROM user_files WHERE user_id = %s AND id = ANY(%s) RETURNING id, s3_key, file_size",
+        (user_id, list(file_ids))
+    )
+    rows = cursor.fetchall()
+    if not rows:
+        conn.rollback()
+        return [], 0
+    queued = release_objects([row['s3_key'] for row in rows])
+    record_usage(user_id, files=-len(rows), files_bytes=-sum(row['file_size'] or 0 for row in rows))
+    record_released([(row['s3_key'], row['file_size']) for row in rows])
+    bump_listing_version(FILES, user_id)
+    conn.commit()
+    return sorted(row['id'] for row in rows), queued
+
+
+def purge_account(user_id):
+    """Delete a user with everything they own; returns the purge job id, or None if there is no such user.
+
+    The rows go in this call; objects are deleted by the outbox.
+    """
+    # Lock the user first so no upload can add a row the purge would miss
+    cursor.execute("SELECT id FROM users WHERE id = %s FOR UPDATE", (user_id,))
+    if not cursor.fetchone():
+        conn.rollback()
+        return None
+    cursor.execute("DELETE FROM user_files WHERE user_id = %s RETURNING s3_key, file_size", (user_id,))
+    rows = cursor.fetchall()
+    cursor.execute("DELETE FROM user_logos WHERE user_id = %s RETURNING s3_key, file_size", (user_id,))
+    rows += cursor.fetchall()
+    keys = [row['s3_key'] for row in rows]
+    # Completed sessions' objects belong to user_files rows already listed
+    cursor.execute(
+        "DELETE FROM upload_sessions WHERE user_id = %s RETURNING s3_key, s3_upload_id, status",
+        (user_id,)
+    )
+    uploads = [(row['s3_key'], row['s3_upload_id']) for row in cursor.fetchall()
+               if row['status'] != COMPLETED]
+    cursor.execute("DELETE FROM users WHERE id = %s", (user_id,))
+    release_blobs(keys)
+    record_released([(row['s3_key'], row['file_size']) for row in rows])
+
+    job_id = uuid.uuid4().hex
+    distinct_keys = list(dict.fromkeys(keys))
+    cursor.execute(
+        "INSERT INTO purge_jobs (id, user_id, status, objects_total) VALUES (%s, %s, %s, %s)",
+        (job_id, user_id, RUNNING, len(distinct_keys))
+    )
+    cursor.execute(
+        "INSERT INTO purge_job_objects (job_id, s3_key) SELECT %s, unnest(%s::text[])",
+        (job_id, distinct_keys)
+    )
+    enqueue(PURGE_ACCOUNT, {'job_id': job_id, 'user_id': user_id, 'uploads': uploads})
+    for scope in (FILES, LOGOS):
+        bump_listing_version(scope, user_id)
+    bump_listing_version(USERS)
+    conn.commit()
+    return job_id
+
+
+def _finish(job_id, status, error=None):
+    cursor.execute(
+        "UPDATE purge_jobs SET status = %s, error = %s, finished_at = CURRENT_TIMESTAMP WHERE id = %s RETURNING objects_deleted, objects_failed",
+        (status, error, job_id)
+    )
+    job = cursor.fetchone()
+    conn.commit()
+    return job
+
+
+@handler(PURGE_ACCOUNT)
+def _run_purge(payload):
+    job_id, user_id, uploads = payload['job_id'], payload['user_id'], payload['uploads']
+    # A retried entry carries on with the keys still staged; aborts are idempotent
+    cursor.execute(
+        "UPDATE purge_jobs SET status = %s, error = NULL, finished_at = NULL WHERE id = %s",
+        (RUNNING, job_id)
+    )
+    conn.commit()
+    try:
+        list(storage_executor.map(lambda upload: storage.abort_multipart_upload(*upload), uploads))
+        while True:
+            cursor.execute(
+                "SELECT s3_key FROM purge_job_objects WHERE job_id = %s ORDER BY s3_key LIMIT %s",
+                (job_id, PURGE_CHUNK)
+            )
+            chunk = [row['s3_key'] for row in cursor.fetchall()]
+            conn.commit()
+            if not chunk:
+                break
+            deleted, failed = delete_released_objects(chunk)
+            cursor.execute(
+                "DELETE FROM purge_job_objects WHERE job_id = %s AND s3_key = ANY(%s)",
+                (job_id, chunk)
+            )
+            cursor.execute(
+                """UPDATE purge_jobs SET objects_processed = objects_processed + %s,
+                   objects_deleted = objects_deleted + %s, objects_failed = objects_failed + %s
+                   WHERE id = %s""",
+                (len(chunk), deleted, failed, job_id)
+            )
+            conn.commit()
+        job = _finish(job_id, DONE)
+        print(f"🧹 Purged user {user_id}: {job['objects_deleted']} objects deleted, "
+              f"{job['objects_failed']} failed, {len(uploads)} uploads aborted")
+    except Exception as e:
+        # Recorded for the status endpoint; the outbox retries the entry
+        conn.rollback()
+        print(f"❌ Purge of user {user_id} failed: {e}")
+        _finish(job_id, FAILED, str(e))
+        raise
+
+
+def get_purge_job(job_id):
+    cursor.execute(
+        """SELECT id, user_id, status, objects_total, objects_processed, objects_deleted,
+                  objects_failed, error, created_at, finished_at
+           FROM purge_jobs WHERE id = %s""",
+        (job_id,)
+    )
+    return cursor.fetchone()
@@ -0,0 +1,253 @@
+"""
+Read replica routing.
+
+With DB_REPLICA_HOSTS set, read-only handlers call use_replica() before
+their first query to have the request's connection checked out of a
+replica's pool instead of the primary's. The replica is only used if it
+already has every write to the listing the handler reads, so users always
+see their own changes:
+
+- A checker thread samples the primary's WAL position every
+  DB_REPLICA_CHECK_INTERVAL seconds and asks each replica whether it has
+  replayed that far. A replica that has is known to hold every commit made
+  before the sample was taken: its caught_up_at.
+- recent_writes remembers when each (scope, user_id) listing was last
+  written. A request that bumped listing versions records them as soon as
+  it has committed, before its response is sent; writes made by other
+  processes arrive on the invalidation bus (services/invalidation.py).
+- A listing is read from a replica whose caught_up_at is after its last
+  write, and never from one that hasn't caught up for DB_REPLICA_MAX_LAG
+  seconds, is unreachable, or is no longer in recovery. Otherwise, or when
+  every replica connection is busy, the request stays on the primary.
+
+While the invalidation bus is disconnected other processes' writes go
+unseen, so reads stay on the primary until it reconnects and the replicas
+catch up past that point. With the bus turned off
+(CACHE_INVALIDATION_ENABLED=False) only the writing process knows about a
+write; other processes may read data up to DB_REPLICA_MAX_LAG old.
+
+Replicas are physical (streaming) standbys of the primary, reached with the
+primary's database name and credentials.
+"""
+
+import os
+import random
+import threading
+import time
+from collections import OrderedDict
+import psycopg2
+import psycopg2.pool
+from flask import g
+from dotenv import load_dotenv
+from services.database import (
+    ConnectionPool, DB_NAME, DB_USER, DB_PASSWORD, connection_pool, pool, release_connection, use_pool)
+from services.listing_versions import GLOBAL_USER_ID
+from services.metrics import DB_REPLICA_READS, DB_REPLICA_STALENESS_SECONDS, DB_REPLICA_UP
+
+# Load environment variables
+load_dotenv()
+
+# Comma-separated host[:port] of each replica; empty sends everything to the primary
+DB_REPLICA_HOSTS = [host.strip() for host in os.getenv('DB_REPLICA_HOSTS', '').split(',') if host.strip()]
+DB_REPLICA_POOL_MAX = int(os.getenv('DB_REPLICA_POOL_MAX', os.getenv('DB_POOL_MAX', '20')))
+# Replicas further behind than this are not read from at all
+DB_REPLICA_MAX_LAG = float(os.getenv('DB_REPLICA_MAX_LAG', '5'))
+DB_REPLICA_CHECK_INTERVAL = float(os.getenv('DB_REPLICA_CHECK_INTERVAL', '0.5'))
+DB_REPLICA_CONNECT_TIMEOUT = int(os.getenv('DB_REPLICA_CONNECT_TIMEOUT', '2'))
+# Listings whose last write is remembered; forgetting one delays every read instead
+RECENT_WRITES_SIZE = 100000
+# How far the primary has written, and whether a replica has replayed that far
+PRIMARY_POSITION_QUERY = "SELECT pg_current_wal_lsn()"
+REPLICA_POSITION_QUERY = "SELECT pg_is_in_recovery(), pg_last_wal_replay_lsn() >= %s::pg_lsn"
+
+
+class RecentWrites:
+    """When each (scope, user_id) listing was last written, as far as this process knows.
+
+    Writes older than the barrier are not tracked individually: forgetting
+    one, or reconnecting the bus after an outage, moves the barrier forward
+    so that every listing counts as written then. While blind (the bus is
+    down) any listing may have just been written.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.barrier = 0.0
+        self.blind = False
+        self._writes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def note(self, keys, at=None):
+        at = at or time.time()
+        with self._lock:
+            for key in keys:
+                self._writes[key] = max(at, self._writes.get(key, 0.0))
+                self._writes.move_to_end(key)
+            while len(self._writes) > self.size:
+                _, forgotten = self._writes.popitem(last=False)
+                self.barrier = max(self.barrier, forgotten)
+
+    def last_write(self, scope, user_id):
+        with self._lock:
+            if self.blind:
+                return float('inf')
+            return max(self.barrier, self._writes.get((scope, user_id), 0.0))
+
+    def reset(self, listening):
+        """Writes may have gone unnoticed until now; stay blind until listening again"""
+        with self._lock:
+            self._writes.clear()
+            self.barrier = time.time()
+            self.blind = not listening
+
+
+recent_writes = RecentWrites(RECENT_WRITES_SIZE)
+
+
+class Replica:
+    def __init__(self, address):
+        host, _, port = address.partition(':')
+        self.name = address
+        self.pool = ConnectionPool(
+            0,
+            DB_REPLICA_POOL_MAX,
+            dbname=DB_NAME,
+            user=DB_USER,
+            password=DB_PASSWORD,
+            host=host,
+            port=port or '5432',
+            connect_timeout=DB_REPLICA_CONNECT_TIMEOUT,
+            # Refuse writes even if pointed at a primary by mistake
+            options='-c default_transaction_read_only=on'
+        )
+        # None until first checked
+        self.healthy = None
+        self.caught_up_at = 0.0
+
+
+replicas = [Replica(address) for address in DB_REPLICA_HOSTS]
+
+
+def use_replica(scope, user_id=GLOBAL_USER_ID):
+    """Serve this request's queries from a replica that has every write to the listing.
+
+    Call before the request's first query. Returns whether a replica
+    connection was checked out; if not, queries go to the primary as usual.
+    """
+    if not replicas:
+        return False
+    now = time.time()
+    last_write = recent_writes.last_write(scope, user_id)
+    candidates = [replica for replica in replicas
+                  if replica.healthy and replica.caught_up_at > last_write
+                  and now - replica.caught_up_at <= DB_REPLICA_MAX_LAG]
+    random.shuffle(candidates)
+    for replica in candidates:
+        try:
+            # Don't queue behind a busy replica while the primary may be free
+            if not use_pool(replica.pool, timeout=0):
+                break
+            DB_REPLICA_READS.inc('replica')
+            return True
+        except psycopg2.pool.PoolError:
+            continue
+        except psycopg2.Error as e:
+            replica.healthy = False
+            DB_REPLICA_UP.set(replica.name, value=0)
+            print(f"❌ Replica {replica.name} unavailable, reading from the primary: {e}")
+    DB_REPLICA_READS.inc('primary')
+    return False
+
+
+def leave_replica():
+    """Send the rest of the request to the primary; returns whether it was on a replica"""
+    source = connection_pool()
+    if source is None or source is pool:
+        return False
+    release_connection()
+    return True
+
+
+def _check(replica, connection, primary_lsn, sampled_at):
+    with connection.cursor() as cur:
+        cur.execute(REPLICA_POSITION_QUERY, (primary_lsn,))
+        standby, caught_up = cur.fetchone()
+    if not standby:
+        if replica.healthy is not False:
+            print(f"❌ Replica {replica.name} is not in recovery; reading from the primary")
+        replica.healthy = False
+        return
+    if caught_up:
+        replica.caught_up_at = sampled_at
+    if not replica.healthy:
+        print(f"✅ Replica {replica.name} available for reads")
+    replica.healthy = True
+
+
+def _check_loop(interval):
+    """Track how far each replica has replayed, on connections of its own outside the pools"""
+    primary = None
+    primary_reachable = True
+    connections = {}
+    while True:
+        try:
+            if primary is None or primary.closed:
+                primary = psycopg2.connect(**pool.connect_kwargs)
+                primary.autocommit = True
+            # Taken before reading the position, so every commit before it is included
+            sampled_at = time.time()
+            with primary.cursor() as cur:
+                cur.execute(PRIMARY_POSITION_QUERY)
+                primary_lsn = cur.fetchone()[0]
+            primary_reachable = True
+        except psycopg2.Error as e:
+            # Without a position nothing new is learned; replicas age out by DB_REPLICA_MAX_LAG
+            if primary_reachable:
+                print(f"❌ Replica check can't reach the primary: {e}")
+            primary_reachable = False
+            if primary is not None:
+                primary.close()
+            primary = None
+            primary_lsn = None
+
+        for replica in replicas:
+            if primary_lsn is None:
+                break
+            connection = connections.get(replica.name)
+            try:
+                if connection is None or connection.closed:
+                    connection = psycopg2.connect(**replica.pool.connect_kwargs)
+                    connection.autocommit = True
+                    connections[replica.name] = connection
+                _check(replica, connection, primary_lsn, sampled_at)
+            except psycopg2.Error as e:
+                if replica.healthy is not False:
+                    print(f"❌ Replica {replica.name} unavailable, reading from the primary: {e}")
+                replica.healthy = False
+                if connection is not None:
+                    connection.close()
+                connections.pop(replica.name, None)
+
+        for replica in replicas:
+            DB_REPLICA_UP.set(replica.name, value=int(bool(replica.healthy)))
+            if replica.caught_up_at:
+                DB_REPLICA_STALENESS_SECONDS.set(replica.name, value=time.time() - replica.caught_up_at)
+        time.sleep(interval)
+
+
+def init_replicas(app):
+    """Record each request's committed writes and start checking the replicas"""
+    if not replicas:
+        return
+
+    @app.after_request
+    def note_writes(response):
+        # Handlers commit before returning, so the writes are visible by now
+        bumped = g.get('bumped_versions')
+        if bumped:
+            recent_writes.note(bumped)
+        return response
+
+    threading.Thread(target=_check_loop, args=(DB_REPLICA_CHECK_INTERVAL,),
+                     name='replica-check', daemon=True).start()
+    print(f"✅ Routing reads to {len(replicas)} replicas")
@@ -1,7 +1,34 @@
+"""
+S3 clients shared by the whole process.
+
+- Each client's connection pool holds S3_MAX_POOL_CONNECTIONS connections,
+  by default one per request thread (DB_POOL_MAX) plus one per storage
+  worker, so parallel fan-outs don't queue for a socket.
+- Retries use botocore's adaptive mode, which also backs off client-side
+  when S3 throttles.
+- Object bodies and multipart parts go through s3_client, with a generous
+  read timeout; metadata calls (HEAD, LIST, DELETE, multipart bookkeeping)
+  go through s3_metadata_client, whose timeout is short.
+- A circuit breaker shared by both clients refuses calls with S3Unavailable
+  after S3_BREAKER_THRESHOLD consecutive failures, instead of having every
+  request wait out timeouts and retries. After S3_BREAKER_RESET seconds one
+  call is let through as a probe; its success closes the breaker.
+- With S3_HEDGE_GETS, a GetObject that hasn't answered within the recent
+  p95 latency gets a second, identical request; the first response wins and
+  the other is closed.
+"""
+
 import boto3
 import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeout, wait
+from botocore.config import Config
 from botocore.exceptions import ClientError
 from dotenv import load_dotenv
+from services.metrics import (
+    instrument_s3_client, S3_CIRCUIT_STATE, S3_CIRCUIT_REJECTIONS, S3_HEDGED_REQUESTS)
 
 # Load environment variables
 load_dotenv()
@@ -11,26 +38,219 @@ AWS_ACCESS_KEY_ID = os.getenv('AWS_ACCESS_KEY_ID')
 AWS_SECRET_ACCESS_KEY = os.getenv('AWS_SECRET_ACCESS_KEY')
 AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
 BUCKET_NAME = os.getenv('S3_BUCKET_NAME', 'my-api-bucket')
+# Optional custom endpoint (MinIO, moto server) for local development and benchmarks
+S3_ENDPOINT_URL = os.getenv('S3_ENDPOINT_URL') or None
+
+# Connections per client; every request thread and storage worker can hold one
+S3_MAX_POOL_CONNECTIONS = int(os.getenv('S3_MAX_POOL_CONNECTIONS') or (
+    int(os.getenv('DB_POOL_MAX', '20')) +
+    int(os.getenv('STORAGE_MAX_WORKERS', os.getenv('S3_MAX_WORKERS', '8')))))
+S3_RETRY_MODE = os.getenv('S3_RETRY_MODE', 'adaptive')
+S3_MAX_ATTEMPTS = int(os.getenv('S3_MAX_ATTEMPTS', '4'))
+S3_CONNECT_TIMEOUT = float(os.getenv('S3_CONNECT_TIMEOUT', '2'))
+# Longest wait for the next bytes of a response
+S3_READ_TIMEOUT = float(os.getenv('S3_READ_TIMEOUT', '30'))
+S3_METADATA_READ_TIMEOUT = float(os.getenv('S3_METADATA_READ_TIMEOUT', '5'))
+
+# Consecutive failed calls that open the breaker (0 disables it), and
+# seconds it stays open before a probe
+S3_BREAKER_THRESHOLD = int(os.getenv('S3_BREAKER_THRESHOLD', '5'))
+S3_BREAKER_RESET = float(os.getenv('S3_BREAKER_RESET', '10'))
+
+S3_HEDGE_GETS = os.getenv('S3_HEDGE_GETS', 'False').lower() == 'true'
+S3_HEDGE_PERCENTILE = float(os.getenv('S3_HEDGE_PERCENTILE', '0.95'))
+S3_HEDGE_MIN_DELAY = float(os.getenv('S3_HEDGE_MIN_DELAY', '0.02'))
+# GET latencies kept for the hedge delay, and how many are needed first
+HEDGE_WINDOW = 1000
+HEDGE_MIN_SAMPLES = 50
+
+# Error codes that mean S3 itself is struggling, as opposed to a bad request
+UNHEALTHY_ERROR_CODES = {'SlowDown', 'Throttling', 'ThrottlingException', 'RequestTimeout',
+                         'ServiceUnavailable', 'InternalError'}
+
+
+class S3Unavailable(Exception):
+    """S3 calls are being refused while the circuit breaker is open"""
+
+
+class CircuitBreaker:
+    CLOSED = 0
+    HALF_OPEN = 1
+    OPEN = 2
+
+    def __init__(self, threshold, reset_after):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self.state = self.CLOSED
+        self.failures = 0
+        self.changed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _set_state(self, state):
+        self.state = state
+        self.changed_at = time.monotonic()
+        S3_CIRCUIT_STATE.set(value=state)
+
+    def allow(self):
+        """Raise S3Unavailable unless a call may go ahead now"""
+        if self.state == self.CLOSED or self.threshold <= 0:
+            return
+        with self._lock:
+            if self.state == self.CLOSED:
+                return
+            # Open long enough, or the last probe never reported back: probe again
+            if time.monotonic() - self.changed_at >= self.reset_after:
+                self._set_state(self.HALF_OPEN)
+                return
+        S3_CIRCUIT_REJECTIONS.inc()
+        raise S3Unavailable(f"S3 is unavailable; retrying in {self.reset_after:g}s")
+
+    def record(self, healthy):
+        with self._lock:
+            if healthy:
+                self.failures = 0
+                if self.state != self.CLOSED:
+                    self._set_state(self.CLOSED)
+                    print("✅ S3 circuit breaker closed")
+                return
+            self.failures += 1
+            if self.state == self.HALF_OPEN or (
+                    self.state == self.CLOSED and 0 < self.threshold <= self.failures):
+                self._set_state(self.OPEN)
+                print(f"❌ S3 circuit breaker open after {self.failures} consecutive failures")
+
+    def watch(self, client):
+        """Gate a client's calls on the breaker and feed it their outcomes"""
+        def before_call(**kwargs):
+            self.allow()
+
+        def after_call(http_response=None, parsed=None, **kwargs):
+            code = (parsed or {}).get('Error', {}).get('Code')
+            self.record(http_response is not None and http_response.status_code < 500
+                        and code not in UNHEALTHY_ERROR_CODES)
+
+        def after_call_error(**kwargs):
+            # Timeouts and connection errors that outlasted the retries
+            self.record(False)
+
+        client.meta.events.register('before-call.s3', before_call)
+        client.meta.events.register('after-call.s3', after_call)
+        client.meta.events.register('after-call-error.s3', after_call_error)
+
 
-# Create S3 client
-s3_client = boto3.client(
-    's3',
-    aws_access_key_id=AWS_ACCESS_KEY_ID,
-    aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
-    region_name=AWS_REGION
-)
+class LatencyTracker:
+    """Percentile of the most recent latencies, recomputed every few observations"""
+
+    def __init__(self, fraction, window=HEDGE_WINDOW, min_samples=HEDGE_MIN_SAMPLES):
+        self.fraction = fraction
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+        self._since_update = 0
+        self._value = None
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+            self._since_update += 1
+            if len(self._samples) >= self.min_samples and (
+                    self._value is None or self._since_update >= self.min_samples):
+                ordered = sorted(self._samples)
+                self._value = ordered[min(len(ordered) - 1, int(self.fraction * len(ordered)))]
+                self._since_update = 0
+
+    def value(self):
+        return self._value
+
+
+s3_breaker = CircuitBreaker(S3_BREAKER_THRESHOLD, S3_BREAKER_RESET)
+get_latency = LatencyTracker(S3_HEDGE_PERCENTILE)
+# Runs both legs of hedged GETs; separate from the storage executor, whose
+# tasks call get() themselves
+hedge_executor = ThreadPoolExecutor(max_workers=S3_MAX_POOL_CONNECTIONS, thread_name_prefix='s3-hedge')
+
+
+def create_client(read_timeout):
+    client = boto3.client(
+        's3',
+        aws_access_key_id=AWS_ACCESS_KEY_ID,
+        aws_secret_access_key=AWS_SECRET_ACCESS_KEY,
+        region_name=AWS_REGION,
+        endpoint_url=S3_ENDPOINT_URL,
+        config=Config(
+            max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+            connect_timeout=S3_CONNECT_TIMEOUT,
+            read_timeout=read_timeout,
+            retries={'mode': S3_RETRY_MODE, 'max_attempts': S3_MAX_ATTEMPTS},
+            tcp_keepalive=True
+        )
+    )
+    instrument_s3_client(client)
+    s3_breaker.watch(client)
+    return client
+
+
+# Create S3 clients
+s3_client = create_client(S3_READ_TIMEOUT)
+s3_metadata_client = create_client(S3_METADATA_READ_TIMEOUT)
+
+
+def _timed_get(client, params):
+    started = time.perf_counter()
+    response = client.get_object(**params)
+    get_latency.observe(time.perf_counter() - started)
+    return response
+
+
+def _close_body(future):
+    if future.exception() is None:
+        future.result()['Body'].close()
+
+
+def _is_definite(error):
+    """An answer about the object (e.g. NoSuchKey) that another attempt would repeat"""
+    return isinstance(error, ClientError) and error.response['Error']['Code'] not in UNHEALTHY_ERROR_CODES
+
+
+def get_object(client, **params):
+    """client.get_object, hedged with a second request when S3_HEDGE_GETS is on"""
+    if not S3_HEDGE_GETS:
+        return client.get_object(**params)
+    delay = get_latency.value()
+    if delay is None or s3_breaker.state != CircuitBreaker.CLOSED:
+        # Not enough samples yet, or S3 is struggling and shouldn't get more load
+        return _timed_get(client, params)
+
+    first = hedge_executor.submit(_timed_get, client, params)
+    try:
+        return first.result(timeout=max(delay, S3_HEDGE_MIN_DELAY))
+    except FutureTimeout:
+        pass
+    second = hedge_executor.submit(_timed_get, client, params)
+    S3_HEDGED_REQUESTS.inc('sent')
+    done, _ = wait((first, second), return_when=FIRST_COMPLETED)
+    winner = first if first in done else second
+    if winner.exception() is not None and not _is_definite(winner.exception()):
+        # That leg failed transiently; the other one may still succeed
+        winner = second if winner is first else first
+        winner.exception()
+    loser = second if winner is first else first
+    loser.add_done_callback(_close_body)
+    if winner is second and winner.exception() is None:
+        S3_HEDGED_REQUESTS.inc('won')
+    return winner.result()
 
 
 def ensure_bucket_exists():
     """Ensure the S3 bucket exists, create it if it doesn't"""
     try:
-        s3_client.head_bucket(Bucket=BUCKET_NAME)
+        s3_metadata_client.head_bucket(Bucket=BUCKET_NAME)
         print(f"✅ S3 bucket '{BUCKET_NAME}' exists.")
     except ClientError as e:
         error_code = e.response['Error']['Code']
         if error_code == '404':
             try:
-                s3_client.create_bucket(Bucket=BUCKET_NAME)
+                s3_metadata_client.create_bucket(Bucket=BUCKET_NAME)
                 print(f"✅ Created S3 bucket '{BUCKET_NAME}'.")
             except ClientError as create_error:
                 print(f"❌ Failed to create S3 bucket: {create_error}")
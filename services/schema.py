@@ -0,0 +1,300 @@
+from services.database import cursor, conn, get_connection
+
+# Full-text search over the filename (split at punctuation, weighted higher)
+# and the extracted text (services/search.py). The config must match
+# SEARCH_CONFIG there.
+SEARCH_VECTOR = """
+    setweight(to_tsvector('english', translate(filename, '._-', '   ')), 'A') ||
+    setweight(to_tsvector('english', COALESCE(original_content, '')), 'B')
+"""
+
+# Single source of truth for the database schema, used by server.py and
+# setup_docker.py. Every statement is idempotent so it can run on each start.
+SCHEMA_STATEMENTS = [
+    # GIN indexes over plain columns, for search within one user's files.
+    # A trusted extension, so the database owner can create it
+    "CREATE EXTENSION IF NOT EXISTS btree_gin",
+
+    # Users table with password support
+    """
+    CREATE TABLE IF NOT EXISTS users (
+        id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        email TEXT NOT NULL UNIQUE,
+        password_hash TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+
+    # User files
+    """
+    CREATE TABLE IF NOT EXISTS user_files (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        filename TEXT NOT NULL,
+        s3_key TEXT NOT NULL,
+        file_size INTEGER,
+        file_type TEXT DEFAULT 'unknown',
+        source_type TEXT DEFAULT 'upload',
+        original_content TEXT DEFAULT '',
+        content_type TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        search_vector tsvector GENERATED ALWAYS AS (""" + SEARCH_VECTOR + """) STORED
+    )
+    """,
+    # Databases created by older setup_docker.py runs lack these columns
+    "ALTER TABLE user_files ADD COLUMN IF NOT EXISTS file_type TEXT DEFAULT 'unknown'",
+    "ALTER TABLE user_files ADD COLUMN IF NOT EXISTS source_type TEXT DEFAULT 'upload'",
+    "ALTER TABLE user_files ADD COLUMN IF NOT EXISTS original_content TEXT DEFAULT ''",
+    # Type the file was uploaded with; rows from before it are served with
+    # their object's
+    "ALTER TABLE user_files ADD COLUMN IF NOT EXISTS content_type TEXT",
+    # Older databases get search_vector from STAGED_MIGRATIONS below
+
+    # User logos
+    """
+    CREATE TABLE IF NOT EXISTS user_logos (
+        id SERIAL PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        filename TEXT NOT NULL,
+        s3_key TEXT NOT NULL,
+        logo_url TEXT NOT NULL,
+        file_size INTEGER,
+        content_type TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+
+    # Content-addressed objects shared by user_files and user_logos rows,
+    # with the number of rows pointing at each (see services/blobs.py)
+    """
+    CREATE TABLE IF NOT EXISTS blobs (
+        s3_key TEXT PRIMARY KEY,
+        sha256 TEXT NOT NULL,
+        size BIGINT NOT NULL,
+        content_type TEXT,
+        content_encoding TEXT,
+        ref_count INTEGER NOT NULL DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+
+    "ALTER TABLE blobs ADD COLUMN IF NOT EXISTS content_encoding TEXT",
+
+    # Listing version counters backing the ETags of listing endpoints
+    """
+    CREATE TABLE IF NOT EXISTS listing_versions (
+        scope TEXT NOT NULL,
+        user_id INTEGER NOT NULL,
+        version BIGINT NOT NULL DEFAULT 0,
+        PRIMARY KEY (scope, user_id)
+    )
+    """,
+
+    # The bucket listing's version, moved on without locking (services/listing_versions.py)
+    "CREATE SEQUENCE IF NOT EXISTS storage_listing_version",
+
+    # Resumable uploads: one row per S3 multipart upload, one per accepted chunk
+    """
+    CREATE TABLE IF NOT EXISTS upload_sessions (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
+        filename TEXT NOT NULL,
+        content_type TEXT,
+        s3_key TEXT NOT NULL,
+        s3_upload_id TEXT NOT NULL,
+        total_size BIGINT NOT NULL,
+        chunk_size INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'open',
+        file_id INTEGER,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS upload_session_parts (
+        session_id TEXT REFERENCES upload_sessions(id) ON DELETE CASCADE,
+        part_number INTEGER NOT NULL,
+        size INTEGER NOT NULL,
+        sha256 TEXT NOT NULL,
+        etag TEXT NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (session_id, part_number)
+    )
+    """,
+
+    # Account purges and their progress; the user row is gone by the time this is read
+    """
+    CREATE TABLE IF NOT EXISTS purge_jobs (
+        id TEXT PRIMARY KEY,
+        user_id INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'running',
+        objects_total INTEGER NOT NULL DEFAULT 0,
+        objects_processed INTEGER NOT NULL DEFAULT 0,
+        objects_deleted INTEGER NOT NULL DEFAULT 0,
+        objects_failed INTEGER NOT NULL DEFAULT 0,
+        error TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        finished_at TIMESTAMP
+    )
+    """,
+
+    # Objects an account purge has yet to delete, taken off as it goes
+    """
+    CREATE TABLE IF NOT EXISTS purge_job_objects (
+        job_id TEXT NOT NULL,
+        s3_key TEXT NOT NULL,
+        PRIMARY KEY (job_id, s3_key)
+    )
+    """,
+
+    # Per-user totals, kept in step with user_files and user_logos (services/usage.py)
+    """
+    CREATE TABLE IF NOT EXISTS storage_usage (
+        user_id INTEGER PRIMARY KEY REFERENCES users(id) ON DELETE CASCADE,
+        files_count BIGINT NOT NULL DEFAULT 0,
+        files_bytes BIGINT NOT NULL DEFAULT 0,
+        logos_count BIGINT NOT NULL DEFAULT 0,
+        logos_bytes BIGINT NOT NULL DEFAULT 0,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+
+    # Objects and bytes per storage directory, and the changes not yet added
+    # to them (services/storage_summary.py)
+    """
+    CREATE TABLE IF NOT EXISTS storage_prefixes (
+        prefix TEXT COLLATE "C" PRIMARY KEY,
+        objects BIGINT NOT NULL DEFAULT 0,
+        bytes BIGINT NOT NULL DEFAULT 0
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS storage_prefix_changes (
+        id BIGSERIAL PRIMARY KEY,
+        prefix TEXT COLLATE "C" NOT NULL,
+        objects BIGINT NOT NULL,
+        bytes BIGINT NOT NULL
+    )
+    """,
+
+    # Side effects waiting to run after the transaction that wrote them (services/outbox.py)
+    """
+    CREATE TABLE IF NOT EXISTS outbox (
+        id BIGSERIAL PRIMARY KEY,
+        kind TEXT NOT NULL,
+        payload JSONB NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        available_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        last_error TEXT,
+        failed_at TIMESTAMP,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+
+    # Rows of bulk user imports between COPY and the upsert into users
+    # (services/user_import.py); emptied by the importing transaction, so
+    # it is not worth WAL
+    """
+    CREATE UNLOGGED TABLE IF NOT EXISTS user_import_rows (
+        import_id TEXT NOT NULL,
+        line INTEGER NOT NULL,
+        name TEXT NOT NULL,
+        email TEXT NOT NULL,
+        password_hash TEXT,
+        PRIMARY KEY (import_id, line)
+    )
+    """,
+
+    # Indexes. Listings filter by user and order by newest first, so the
+    # composite (user_id, created_at DESC) serves both without a sort and
+    # also covers user_id-only lookups and the ON DELETE CASCADE from users.
+    "CREATE INDEX IF NOT EXISTS idx_user_files_user_created ON user_files(user_id, created_at DESC)",
+    "CREATE INDEX IF NOT EXISTS idx_user_logos_user_created ON user_logos(user_id, created_at DESC)",
+    # /delete removes files by key
+    "CREATE INDEX IF NOT EXISTS idx_user_files_s3_key ON user_files(s3_key)",
+    # Unreferenced blobs waiting to be reaped
+    "CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced ON blobs(s3_key) WHERE ref_count = 0",
+    # Garbage collection finds idle sessions; deleting a user cascades by user_id
+    "CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated ON upload_sessions(updated_at)",
+    "CREATE INDEX IF NOT EXISTS idx_upload_sessions_user ON upload_sessions(user_id)",
+    # The collector reopens completions that outlived their lease
+    "CREATE INDEX IF NOT EXISTS idx_upload_sessions_completing ON upload_sessions(updated_at) WHERE status = 'completing'",
+
+    # Outbox workers claim due entries oldest first; parked ones drop out
+    "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox(available_at) WHERE failed_at IS NULL",
+
+    # Superseded indexes: users.email is already indexed by its UNIQUE
+    # constraint, user_id lookups use the composites above, and nothing
+    # filters or orders on created_at alone.
+    "DROP INDEX IF EXISTS idx_users_email",
+    "DROP INDEX IF EXISTS idx_user_files_user_id",
+    "DROP INDEX IF EXISTS idx_user_files_created_at",
+    "DROP INDEX IF EXISTS idx_user_logos_user_id",
+    "DROP INDEX IF EXISTS idx_user_logos_created_at",
+]
+
+# Changes too slow to make at every start of a populated database, applied
+# by migrate.py off-peak (or by init_database() while user_files is empty).
+# Each runs in a transaction of its own.
+STAGED_MIGRATIONS = [
+    # Computes every row's vector, rewriting user_files under an ACCESS
+    # EXCLUSIVE lock: reads and writes of it wait until it is done
+    "ALTER TABLE user_files ADD COLUMN IF NOT EXISTS search_vector tsvector GENERATED ALWAYS AS ("
+    + SEARCH_VECTOR + ") STORED",
+    # /server-files/search matches search_vector within one user's rows; with
+    # user_id in the index a common word only reads that user's matches.
+    # Built without blocking writes
+    "CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_user_files_user_search ON user_files USING GIN (user_id, search_vector)",
+    # Superseded by the above: it matched every user's rows
+    "DROP INDEX CONCURRENTLY IF EXISTS idx_user_files_search",
+]
+# Built by STAGED_MIGRATIONS; a failed concurrent build leaves it invalid
+STAGED_INDEX = 'idx_user_files_user_search'
+
+
+def staged_migrations_pending():
+    cursor.execute(
+        """SELECT NOT EXISTS (SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+                              WHERE c.relname = %s AND i.indisvalid) AS pending""",
+        (STAGED_INDEX,)
+    )
+    pending = cursor.fetchone()['pending']
+    conn.commit()
+    return pending
+
+
+def apply_staged_migrations():
+    """Apply STAGED_MIGRATIONS; safe to run again after a failure"""
+    connection = get_connection()
+    conn.commit()
+    # CREATE INDEX CONCURRENTLY can't run inside a transaction block
+    connection.autocommit = True
+    try:
+        cursor.execute(
+            """SELECT c.relname FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid
+               WHERE c.relname = %s AND NOT i.indisvalid""",
+            (STAGED_INDEX,)
+        )
+        if cursor.fetchone():
+            cursor.execute(f"DROP INDEX CONCURRENTLY {STAGED_INDEX}")
+        for statement in STAGED_MIGRATIONS:
+            cursor.execute(statement)
+    finally:
+        connection.autocommit = False
+
+
+def init_database():
+    """Initialize database tables and indexes"""
+    for statement in SCHEMA_STATEMENTS:
+        cursor.execute(statement)
+    conn.commit()
+    if staged_migrations_pending():
+        # Nothing to rewrite or index in a new database
+        cursor.execute("SELECT pg_relation_size('user_files') = 0 AS empty")
+        empty = cursor.fetchone()['empty']
+        conn.commit()
+        if empty:
+            apply_staged_migrations()
+        else:
+            print("⚠️ Search needs the staged schema migrations: run `python migrate.py` off-peak")
@@ -0,0 +1,211 @@
+"""
+Full-text search over the text of stored files.
+
+user_files.original_content holds the text of each document and
+search_vector, a generated column over the filename and that text, is
+indexed with GIN. Text is extracted when it is cheap to do so in the
+request: HTML and plain-text uploads are read as they are uploaded. PDFs,
+and anything that arrives through resumable uploads, are queued in the
+outbox in the transaction that inserts their rows and extracted in the
+background; until then they are found by filename only.
+
+PDF text comes from poppler's pdftotext, run as a subprocess like
+wkhtmltopdf; without it PDFs stay searchable by filename.
+
+search_files() ranks a user's matches with ts_rank_cd and builds
+ts_headline snippets for the requested page only, as headlines re-parse
+the document text.
+"""
+
+import html
+import os
+import shutil
+import subprocess
+import tempfile
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+from services.database import cursor
+from services.outbox import enqueue, handler
+from services.storage import storage, ObjectNotFound
+from services.storage_codec import object_chunks
+
+# Load environment variables
+load_dotenv()
+
+# Text search configuration of search_vector; queries must use the same one
+SEARCH_CONFIG = 'english'
+# Characters of text indexed per document, well under the 1MB tsvector limit
+SEARCH_TEXT_MAX_CHARS = int(os.getenv('SEARCH_TEXT_MAX_CHARS', '100000'))
+# Largest document read for extraction, and limits on pdftotext
+SEARCH_EXTRACT_MAX_BYTES = int(os.getenv('SEARCH_EXTRACT_MAX_BYTES', str(50 * 1024 * 1024)))
+SEARCH_PDF_MAX_PAGES = int(os.getenv('SEARCH_PDF_MAX_PAGES', '50'))
+SEARCH_EXTRACT_TIMEOUT = float(os.getenv('SEARCH_EXTRACT_TIMEOUT', '30'))
+PDFTOTEXT = os.getenv('PDFTOTEXT_PATH') or shutil.which('pdftotext')
+
+# Outbox entry kind
+EXTRACT_TEXT = 'extract_text'
+
+# Marks around matches in headlines, replaced once the text is escaped
+HIGHLIGHT_START = '\x02'
+HIGHLIGHT_STOP = '\x03'
+HEADLINE_OPTIONS = (f"StartSel={HIGHLIGHT_START}, StopSel={HIGHLIGHT_STOP}, "
+                    "MaxFragments=2, MaxWords=20, MinWords=5, FragmentDelimiter=\" … \"")
+
+PDF = 'pdf'
+HTML = 'html'
+TEXT = 'text'
+
+
+def detect_file_type(filename, content_type):
+    """'pdf', 'html', 'text' or 'unknown', from the content type or extension"""
+    content_type = (content_type or '').split(';')[0].strip().lower()
+    extension = os.path.splitext(filename or '')[1].lower()
+    if content_type == 'application/pdf' or extension == '.pdf':
+        return PDF
+    if content_type in ('text/html', 'application/xhtml+xml') or extension in ('.html', '.htm'):
+        return HTML
+    if content_type == 'text/plain' or extension == '.txt':
+        return TEXT
+    return 'unknown'
+
+
+def _clean(text):
+    # PostgreSQL text can't hold NUL; collapse whitespace runs left by layout
+    return ' '.join(text.replace('\x00', ' ').split())[:SEARCH_TEXT_MAX_CHARS]
+
+
+def html_text(data):
+    """Visible text of an HTML document"""
+    soup = BeautifulSoup(data, 'lxml')
+    for element in soup(['script', 'style', 'head']):
+        element.decompose()
+    return _clean(soup.get_text(' '))
+
+
+def pdf_text(data):
+    """Text of a PDF's first SEARCH_PDF_MAX_PAGES pages, or None if pdftotext is missing or can't read it"""
+    if not PDFTOTEXT:
+        return None
+    with tempfile.NamedTemporaryFile(suffix='.pdf') as document:
+        document.write(data)
+        document.flush()
+        result = subprocess.run(
+            [PDFTOTEXT, '-q', '-enc', 'UTF-8', '-l', str(SEARCH_PDF_MAX_PAGES), document.name, '-'],
+            capture_output=True, timeout=SEARCH_EXTRACT_TIMEOUT)
+    if result.returncode != 0:
+        # Damaged or encrypted; retrying won't help
+        print(f"❌ pdftotext exited with status {result.returncode}: {result.stderr.decode(errors='replace')[:200]}")
+        return None
+    return _clean(result.stdout.decode('utf-8', 'replace'))
+
+
+def extract_text(data, file_type):
+    """Searchable text of a document, or None if its type isn't extracted"""
+    if file_type == HTML:
+        return html_text(data)
+    if file_type == TEXT:
+        return _clean(data.decode('utf-8', 'replace'))
+    if file_type == PDF:
+        return pdf_text(data)
+    return None
+
+
+def upload_text(stream, file_type):
+    """Text extracted while uploading: HTML and plain text; rewinds the stream.
+
+    Returns None for types left to the background extractor.
+    """
+    if file_type not in (HTML, TEXT):
+        return None
+    stream.seek(0)
+    data = stream.read(SEARCH_EXTRACT_MAX_BYTES)
+    stream.seek(0)
+    return extract_text(data, file_type)
+
+
+def queue_extraction(file_ids):
+    """Extract the text of these files after the caller's transaction commits"""
+    if file_ids:
+        enqueue(EXTRACT_TEXT, {'file_ids': list(file_ids)})
+
+
+def _read_object(s3_key):
+    """The object's first SEARCH_EXTRACT_MAX_BYTES, and whether there was more"""
+    data = bytearray()
+    chunks = object_chunks(storage.get(s3_key))
+    try:
+        for chunk in chunks:
+            data += chunk
+            if len(data) > SEARCH_EXTRACT_MAX_BYTES:
+                return bytes(data[:SEARCH_EXTRACT_MAX_BYTES]), True
+    finally:
+        chunks.close()
+    return bytes(data), False
+
+
+@handler(EXTRACT_TEXT)
+def _extract_text(payload):
+    cursor.execute(
+        "SELECT id, s3_key, file_type FROM user_files WHERE id = ANY(%s)",
+        (payload['file_ids'],)
+    )
+    # Rows sharing deduplicated content are read and parsed once
+    documents = {}
+    for row in cursor.fetchall():
+        documents.setdefault((row['s3_key'], row['file_type']), []).append(row['id'])
+    for (s3_key, file_type), file_ids in documents.items():
+        if file_type == PDF and not PDFTOTEXT:
+            print(f"❌ pdftotext not found; {len(file_ids)} PDFs searchable by filename only")
+            continue
+        try:
+            data, truncated = _read_object(s3_key)
+        except ObjectNotFound:
+            # Deleted since it was queued
+            continue
+        if truncated and file_type == PDF:
+            # Half a PDF can't be parsed; HTML and text keep their beginning
+            print(f"❌ {s3_key} is over {SEARCH_EXTRACT_MAX_BYTES} bytes; searchable by filename only")
+            continue
+        text = extract_text(data, file_type)
+        if text is not None:
+            cursor.execute(
+                "UPDATE user_files SET original_content = %s WHERE id = ANY(%s)",
+                (text, file_ids)
+            )
+
+
+def _snippet(headline):
+    """Escape a headline's text and turn its match marks into <mark> tags"""
+    return (html.escape(headline)
+            .replace(HIGHLIGHT_START, '<mark>')
+            .replace(HIGHLIGHT_STOP, '</mark>'))
+
+
+def search_files(user_id, query, limit, offset):
+    """One page of a user's files matching a web-search style query, best first.
+
+    Returns (hits, more): more is True when later pages exist.
+    """
+    cursor.execute(
+        """SELECT f.id, f.filename, f.file_size, f.file_type, f.created_at, hits.rank,
+                  ts_headline(%s::regconfig, f.original_content, hits.query, %s) AS snippet
+           FROM (SELECT id, ts_rank_cd(search_vector, query) AS rank, query
+                 FROM user_files, websearch_to_tsquery(%s::regconfig, %s) AS query
+                 WHERE user_id = %s AND search_vector @@ query
+                 ORDER BY rank DESC, id DESC
+                 LIMIT %s OFFSET %s) AS hits
+           JOIN user_files f ON f.id = hits.id
+           ORDER BY hits.rank DESC, f.id DESC""",
+        (SEARCH_CONFIG, HEADLINE_OPTIONS, SEARCH_CONFIG, query, user_id, limit + 1, offset)
+    )
+    rows = cursor.fetchall()
+    hits = [{
+        "id": row['id'],
+        "filename": row['filename'],
+        "file_size": row['file_size'],
+        "file_type": row['file_type'],
+        "created_at": row['created_at'],
+        "rank": round(row['rank'], 6),
+        "snippet": _snippet(row['snippet']) if row['snippet'] else None
+    } for row in rows[:limit]]
+    return hits, len(rows) > limit
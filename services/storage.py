@@ -0,0 +1,501 @@
+"""
+Object storage backends.
+
+Everything the app keeps outside Postgres (uploaded files, logos, resumable
+upload parts) goes through the module-level `storage`, picked with
+STORAGE_BACKEND:
+
+- s3 (default): an S3 bucket (services/s3.py), or any S3-compatible server
+  via S3_ENDPOINT_URL;
+- local: a directory (STORAGE_ROOT) for single-node deployments and fast
+  local runs. Object metadata lives in JSON sidecars under .meta/, multipart
+  uploads assemble their parts under .uploads/. Downloads hand the file to
+  the web server: with STORAGE_ACCEL_REDIRECT set, nginx serves it from an
+  internal location (X-Accel-Redirect); otherwise send_file passes it to the
+  WSGI server's file wrapper, which gunicorn and uWSGI send with sendfile(2),
+  or to Apache/lighttpd with Flask's USE_X_SENDFILE. Either way file bytes do
+  not pass through Python.
+
+Both backends take and return the same shapes: StoredObject for reads,
+ObjectNotFound for missing keys, UploadNotFound for multipart uploads that
+are already completed or aborted, plain dicts for listings.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import shutil
+import time
+import unicodedata
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from io import BytesIO
+from urllib.parse import quote
+from flask import Response, request, send_file
+from botocore.exceptions import ClientError
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 's3').lower()
+STORAGE_ROOT = os.getenv('STORAGE_ROOT', './storage-data')
+# nginx internal location that maps onto STORAGE_ROOT, e.g. /_storage/
+STORAGE_ACCEL_REDIRECT = os.getenv('STORAGE_ACCEL_REDIRECT', '')
+# Where publicly readable local objects (logos) are served from
+STORAGE_PUBLIC_URL = os.getenv('STORAGE_PUBLIC_URL', '/download')
+STORAGE_URL_SECRET = os.getenv('STORAGE_URL_SECRET') or os.getenv(
+    'JWT_SECRET_KEY', 'your-secret-key-here-change-this-in-production')
+
+CHUNK_SIZE = 64 * 1024
+DELETE_BATCH = 1000
+
+# Shared, bounded pool for fanning storage calls out in parallel (batch
+# uploads, bulk downloads and deletes). Tasks must not submit nested work to this pool
+# and wait on it.
+STORAGE_MAX_WORKERS = int(os.getenv('STORAGE_MAX_WORKERS', os.getenv('S3_MAX_WORKERS', '8')))
+storage_executor = ThreadPoolExecutor(max_workers=STORAGE_MAX_WORKERS, thread_name_prefix='storage')
+
+
+class ObjectNotFound(Exception):
+    pass
+
+
+class UploadNotFound(Exception):
+    """A multipart upload that was already completed or aborted"""
+
+
+class StoredObject:
+    """An object's metadata and, when opened for reading, its body"""
+
+    def __init__(self, key, size, content_type=None, content_encoding=None, metadata=None,
+                 last_modified=None, body=None, path=None, etag=None, from_cache=False):
+        self.key = key
+        self.size = size
+        self.content_type = content_type or 'application/octet-stream'
+        self.content_encoding = content_encoding
+        self.metadata = metadata or {}
+        self.last_modified = last_modified
+        self.body = body
+        # Local file holding the object, for sendfile
+        self.path = path
+        self.etag = etag
+        # Body is an open local file from services/object_cache.py
+        self.from_cache = from_cache
+
+    @property
+    def original_size(self):
+        """Size before any stored compression"""
+        original_size = self.metadata.get('original-size')
+        return int(original_size) if original_size else self.size
+
+    def read(self, size=-1):
+        return self.body.read(size)
+
+    def iter_chunks(self, chunk_size=CHUNK_SIZE):
+        while True:
+            chunk = self.body.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def close(self):
+        if self.body is not None:
+            self.body.close()
+
+
+def filename_options(download_name):
+    """Content-Disposition filename parameters, as send_file writes them"""
+    try:
+        download_name.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        return {'filename': simple, 'filename*': "UTF-8''" + quote(download_name, safe="!#$&+-.^_`|~")}
+    return {'filename': download_name}
+
+
+def send_open_file(stored, download_name, as_attachment=True):
+    """Send an object whose body is an open local file.
+
+    The file object (not its path) is handed to send_file, so the WSGI
+    server can still sendfile(2) it after the path is evicted or replaced.
+    """
+    response = send_file(stored.body, mimetype=stored.content_type, as_attachment=as_attachment,
+                         download_name=download_name, conditional=False)
+    response.content_length = stored.size
+    if stored.last_modified:
+        response.last_modified = stored.last_modified
+    if stored.etag:
+        response.set_etag(stored.etag.strip('"'))
+    return response.make_conditional(request.environ, accept_ranges=True, complete_length=stored.size)
+
+
+class S3Storage:
+    name = 's3'
+
+    def __init__(self):
+        from services.s3 import s3_client, s3_metadata_client, get_object, BUCKET_NAME
+        # Object bodies go through client; calls that move no object data
+        # use metadata_client and its shorter timeout
+        self.client = s3_client
+        self.metadata_client = s3_metadata_client
+        self.clients = (s3_client, s3_metadata_client)
+        # get_object(), hedged when S3_HEDGE_GETS is on
+        self._get_object = get_object
+        self.bucket = BUCKET_NAME
+
+    def _missing(self, e):
+        return e.response['Error']['Code'] in ('NoSuchKey', '404', 'NotFound')
+
+    def ensure_ready(self):
+        from services.s3 import ensure_bucket_exists
+        ensure_bucket_exists()
+
+    def put(self, key, body, content_type=None, content_encoding=None, metadata=None):
+        extra = {'ContentEncoding': content_encoding} if content_encoding else {}
+        self.client.put_object(
+            Bucket=self.bucket,
+            Key=key,
+            Body=body,
+            ContentType=content_type or 'application/octet-stream',
+            Metadata=metadata or {},
+            **extra
+        )
+
+    def _stored_object(self, key, response, body=None):
+        return StoredObject(key, response['ContentLength'], response.get('ContentType'),
+                            response.get('ContentEncoding'), response.get('Metadata'),
+                            response.get('LastModified'), body, etag=response.get('ETag'))
+
+    def head(self, key):
+        try:
+            return self._stored_object(key, self.metadata_client.head_object(Bucket=self.bucket, Key=key))
+        except ClientError as e:
+            if self._missing(e):
+                raise ObjectNotFound(key)
+            raise
+
+    def get(self, key, start=None, stop=None):
+        """Open an object, or the bytes [start, stop) of it, for reading"""
+        extra = {}
+        if start is not None or stop is not None:
+            extra['Range'] = f"bytes={start or 0}-{'' if stop is None else stop - 1}"
+        try:
+            response = self._get_object(self.client, Bucket=self.bucket, Key=key, **extra)
+        except ClientError as e:
+            if self._missing(e):
+                raise ObjectNotFound(key)
+            raise
+        return self._stored_object(key, response, response['Body'])
+
+    def _delete_batch(self, keys):
+        response = self.metadata_client.delete_objects(Bucket=self.bucket, Delete={
+            'Objects': [{'Key': key} for key in keys], 'Quiet': True})
+        return [error['Key'] for error in response.get('Errors', [])]
+
+    def delete(self, keys):
+        """Delete keys, DELETE_BATCH per request with batches in parallel; returns the keys that failed"""
+        keys = list(dict.fromkeys(keys))
+        batches = [keys[start:start + DELETE_BATCH] for start in range(0, len(keys), DELETE_BATCH)]
+        if len(batches) <= 1:
+            return self._delete_batch(batches[0]) if batches else []
+        failed = []
+        for batch_failed in storage_executor.map(self._delete_batch, batches):
+            failed += batch_failed
+        return failed
+
+    def list(self, prefix='', start_after=None, page_size=1000):
+        """Yield {key, size, last_modified} for every object under prefix after start_after, in key order
+
+        Follows continuation tokens page by page, so callers that stop early
+        don't list the rest of the bucket.
+        """
+        params = {'Bucket': self.bucket, 'Prefix': prefix}
+        if start_after:
+            params['StartAfter'] = start_after
+        paginator = self.metadata_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(**params, PaginationConfig={'PageSize': page_size}):
+            for item in page.get('Contents', []):
+                yield {'key': item['Key'], 'size': item['Size'], 'last_modified': item['LastModified']}
+
+    def presign(self, key, expires_in=3600):
+        return self.client.generate_presigned_url(
+            'get_object', Params={'Bucket': self.bucket, 'Key': key}, ExpiresIn=expires_in)
+
+    def public_url(self, key):
+        return f"https://{self.bucket}.s3.amazonaws.com/{key}"
+
+    def send(self, stored, download_name, as_attachment=True):
+        """Response sending an opened object's stored bytes as they are"""
+        if stored.from_cache:
+            return send_open_file(stored, download_name, as_attachment)
+        try:
+            data = stored.read()
+        finally:
+            stored.close()
+        return send_file(BytesIO(data), mimetype=stored.content_type,
+                         as_attachment=as_attachment, download_name=download_name)
+
+    def create_multipart_upload(self, key, content_type=None):
+        return self.metadata_client.create_multipart_upload(
+            Bucket=self.bucket, Key=key, ContentType=content_type or 'application/octet-stream')['UploadId']
+
+    def upload_part(self, key, upload_id, part_number, data):
+        """Upload one part and return its ETag; Content-MD5 has S3 verify it arrived intact"""
+        return self.client.upload_part(
+            Bucket=self.bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number,
+            Body=data,
+            ContentMD5=base64.b64encode(hashlib.md5(data).digest()).decode()
+        )['ETag']
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        """Assemble an upload from (part_number, etag) pairs"""
+        try:
+            self.client.complete_multipart_upload(
+                Bucket=self.bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': [{'PartNumber': part_number, 'ETag': etag}
+                                           for part_number, etag in parts]}
+            )
+        except ClientError as e:
+            if e.response['Error']['Code'] == 'NoSuchUpload':
+                raise UploadNotFound(upload_id)
+            raise
+
+    def abort_multipart_upload(self, key, upload_id):
+        try:
+            self.metadata_client.abort_multipart_upload(Bucket=self.bucket, Key=key, UploadId=upload_id)
+        except ClientError as e:
+            # Already completed or aborted
+            if e.response['Error']['Code'] != 'NoSuchUpload':
+                raise
+
+
+class _FileRange:
+    """File object limited to the bytes before stop"""
+
+    def __init__(self, file, remaining):
+        self.file = file
+        self.remaining = remaining
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+class LocalStorage:
+    name = 'local'
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root)
+        self.meta_root = os.path.join(self.root, '.meta')
+        self.uploads_root = os.path.join(self.root, '.uploads')
+        self.tmp_root = os.path.join(self.root, '.tmp')
+
+    def _path(self, key, root=None):
+        """Filesystem path for a key; keys can't escape the storage root"""
+        parts = key.split('/')
+        if not key or key.startswith('/') or '\\' in key or any(
+                part in ('', '.', '..') for part in parts) or parts[0].startswith('.'):
+            raise ObjectNotFound(key)
+        return os.path.join(root or self.root, *parts)
+
+    def _meta_path(self, key):
+        return self._path(key, self.meta_root) + '.json'
+
+    def _temp_path(self):
+        return os.path.join(self.tmp_root, uuid.uuid4().hex)
+
+    def _publish(self, temp_path, key, meta):
+        """Atomically move a finished temp file into place along with its metadata"""
+        path = self._path(key)
+        meta_path = self._meta_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        meta_temp = self._temp_path()
+        with open(meta_temp, 'w') as f:
+            json.dump(meta, f)
+        os.replace(meta_temp, meta_path)
+        os.replace(temp_path, path)
+
+    def ensure_ready(self):
+        for directory in (self.root, self.meta_root, self.uploads_root, self.tmp_root):
+            os.makedirs(directory, exist_ok=True)
+        print(f"✅ Local storage at '{self.root}'.")
+
+    def put(self, key, body, content_type=None, content_encoding=None, metadata=None):
+        self._path(key)
+        temp_path = self._temp_path()
+        with open(temp_path, 'wb') as f:
+            if isinstance(body, (bytes, bytearray)):
+                f.write(body)
+            else:
+                shutil.copyfileobj(body, f, CHUNK_SIZE)
+        self._publish(temp_path, key, {'content_type': content_type or 'application/octet-stream',
+                                       'content_encoding': content_encoding,
+                                       'metadata': metadata or {}})
+
+    def head(self, key):
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+        try:
+            with open(self._meta_path(key)) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            meta = {}
+        return StoredObject(key, stat.st_size, meta.get('content_type'), meta.get('content_encoding'),
+                            meta.get('metadata'), datetime.utcfromtimestamp(stat.st_mtime), path=path)
+
+    def get(self, key, start=None, stop=None):
+        """Open an object, or the bytes [start, stop) of it, for reading"""
+        stored = self.head(key)
+        try:
+            body = open(stored.path, 'rb')
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+        if start is not None or stop is not None:
+            body.seek(start or 0)
+            body = _FileRange(body, min(stored.size if stop is None else stop, stored.size) - (start or 0))
+        stored.body = body
+        return stored
+
+    def delete(self, keys):
+        """Delete keys; returns the keys that failed"""
+        failed = []
+        for key in dict.fromkeys(keys):
+            try:
+                for path in (self._path(key), self._meta_path(key)):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+            except ObjectNotFound:
+                pass
+            except OSError:
+                failed.append(key)
+        return failed
+
+    def list(self, prefix='', start_after=None, page_size=1000):
+        """Yield {key, size, last_modified} for every object under prefix after start_after, in key order"""
+        directory = self.root
+        if '/' in prefix:
+            try:
+                directory = self._path(prefix.rsplit('/', 1)[0])
+            except ObjectNotFound:
+                return
+        keys = []
+        for dirpath, dirnames, filenames in os.walk(directory):
+            if dirpath == self.root:
+                dirnames[:] = [name for name in dirnames if not name.startswith('.')]
+            relative = os.path.relpath(dirpath, self.root).replace(os.sep, '/')
+            for filename in filenames:
+                key = filename if relative == '.' else f"{relative}/{filename}"
+                if key.startswith(prefix) and (not start_after or key > start_after):
+                    keys.append(key)
+        for key in sorted(keys):
+            try:
+                stat = os.stat(self._path(key))
+            except FileNotFoundError:
+                continue
+            yield {'key': key, 'size': stat.st_size,
+                   'last_modified': datetime.utcfromtimestamp(stat.st_mtime)}
+
+    def _signature(self, key, expires):
+        return hmac.new(STORAGE_URL_SECRET.encode(), f"{key}\n{expires}".encode(),
+                        hashlib.sha256).hexdigest()
+
+    def presign(self, key, expires_in=3600):
+        """Time-limited URL for /download/signed/<key>"""
+        expires = int(time.time()) + expires_in
+        return f"/download/signed/{quote(key)}?expires={expires}&signature={self._signature(key, expires)}"
+
+    def verify_presigned(self, key, expires, signature):
+        try:
+            expires = int(expires)
+        except (TypeError, ValueError):
+            return False
+        return expires > time.time() and hmac.compare_digest(
+            self._signature(key, expires), signature or '')
+
+    def public_url(self, key):
+        return f"{STORAGE_PUBLIC_URL.rstrip('/')}/{key}"
+
+    def send(self, stored, download_name, as_attachment=True):
+        """Response handing an opened object's file to the web server"""
+        stored.close()
+        if STORAGE_ACCEL_REDIRECT:
+            response = Response(mimetype=stored.content_type)
+            response.headers['X-Accel-Redirect'] = STORAGE_ACCEL_REDIRECT.rstrip('/') + '/' + quote(stored.key)
+            response.headers.set('Content-Disposition', 'attachment' if as_attachment else 'inline',
+                                 **filename_options(download_name))
+            return response
+        return send_file(stored.path, mimetype=stored.content_type, as_attachment=as_attachment,
+                         download_name=download_name)
+
+    def create_multipart_upload(self, key, content_type=None):
+        self._path(key)
+        upload_id = uuid.uuid4().hex
+        os.makedirs(os.path.join(self.uploads_root, upload_id))
+        with open(os.path.join(self.uploads_root, upload_id, 'upload.json'), 'w') as f:
+            json.dump({'key': key, 'content_type': content_type or 'application/octet-stream'}, f)
+        return upload_id
+
+    def _upload_dir(self, upload_id):
+        directory = os.path.join(self.uploads_root, upload_id)
+        if not upload_id.isalnum() or not os.path.isdir(directory):
+            raise UploadNotFound(upload_id)
+        return directory
+
+    def upload_part(self, key, upload_id, part_number, data):
+        directory = self._upload_dir(upload_id)
+        temp_path = self._temp_path()
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, os.path.join(directory, str(int(part_number))))
+        return f'"{hashlib.md5(data).hexdigest()}"'
+
+    def complete_multipart_upload(self, key, upload_id, parts):
+        """Assemble an upload from (part_number, etag) pairs"""
+        directory = self._upload_dir(upload_id)
+        with open(os.path.join(directory, 'upload.json')) as f:
+            upload = json.load(f)
+        temp_path = self._temp_path()
+        try:
+            with open(temp_path, 'wb') as out:
+                for part_number, etag in parts:
+                    digest = hashlib.md5()
+                    with open(os.path.join(directory, str(int(part_number))), 'rb') as part:
+                        for chunk in iter(lambda: part.read(1024 * 1024), b''):
+                            digest.update(chunk)
+                            out.write(chunk)
+                    if f'"{digest.hexdigest()}"' != etag:
+                        raise ValueError(f"Part {part_number} does not match its ETag")
+            self._publish(temp_path, key, {'content_type': upload['content_type'],
+                                           'content_encoding': None, 'metadata': {}})
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        shutil.rmtree(directory, ignore_errors=True)
+
+    def abort_multipart_upload(self, key, upload_id):
+        shutil.rmtree(os.path.join(self.uploads_root, upload_id), ignore_errors=True)
+
+
+storage = LocalStorage(STORAGE_ROOT) if STORAGE_BACKEND == 'local' else S3Storage()
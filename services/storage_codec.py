@@ -0,0 +1,147 @@
+"""
+Storage codec for text documents.
+
+HTML and text invoice sources compress 5-8x, so they are compressed before
+being written to S3. The codec is picked per object from its content type
+and size:
+
+- binary types (PDFs, images) and anything below STORAGE_COMPRESS_MIN_SIZE
+  are stored as they are;
+- documents below STORAGE_ZSTD_MIN_SIZE are gzipped: every client accepts
+  gzip, so downloads can pass the stored bytes through unchanged;
+- larger documents use zstd when the zstandard package is installed, which
+  compresses better at the same CPU cost and decompresses 2-3x faster.
+
+The encoding is recorded as the object's Content-Encoding (and on its blobs
+row), with the original size in the object's metadata. Downloads pass
+the stored bytes through when the client accepts the encoding and decompress
+on the fly otherwise. Run benchmarks/bench_storage_codec.py for ratios and
+CPU cost on invoice-shaped documents.
+"""
+
+import os
+import tempfile
+import zlib
+from flask import Response, request
+from dotenv import load_dotenv
+from services.storage import storage, filename_options
+
+try:
+    import zstandard
+except ImportError:  # zstandard is optional; documents are gzipped instead
+    zstandard = None
+
+# Load environment variables
+load_dotenv()
+
+STORAGE_COMPRESSION_ENABLED = os.getenv('STORAGE_COMPRESSION_ENABLED', 'True').lower() == 'true'
+STORAGE_COMPRESS_MIN_SIZE = int(os.getenv('STORAGE_COMPRESS_MIN_SIZE', '1024'))
+STORAGE_ZSTD_MIN_SIZE = int(os.getenv('STORAGE_ZSTD_MIN_SIZE', str(256 * 1024)))
+# gzip -9 costs ~4x the CPU of -6 for ~5% smaller objects; zstd -9 beats gzip -9
+# on size at the speed of gzip -6 (see benchmarks/bench_storage_codec.py)
+STORAGE_GZIP_LEVEL = int(os.getenv('STORAGE_GZIP_LEVEL', '6'))
+STORAGE_ZSTD_LEVEL = int(os.getenv('STORAGE_ZSTD_LEVEL', '9'))
+
+TEXT_CONTENT_TYPES = {
+    'application/json',
+    'application/xml',
+    'application/xhtml+xml',
+    'application/javascript',
+    'application/x-ndjson',
+    'image/svg+xml',
+}
+
+CHUNK_SIZE = 64 * 1024
+# Compressed uploads spill to disk beyond this
+SPOOL_SIZE = 8 * 1024 * 1024
+
+
+def storage_encoding(content_type, size):
+    """Content-Encoding to store an object with, or None to store it as is"""
+    if not STORAGE_COMPRESSION_ENABLED or size < STORAGE_COMPRESS_MIN_SIZE:
+        return None
+    mimetype = (content_type or '').split(';', 1)[0].strip().lower()
+    if not (mimetype.startswith('text/') or mimetype in TEXT_CONTENT_TYPES):
+        return None
+    if zstandard is not None and size >= STORAGE_ZSTD_MIN_SIZE:
+        return 'zstd'
+    return 'gzip'
+
+
+def _compressor(encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdCompressor(level=STORAGE_ZSTD_LEVEL).compressobj()
+    return zlib.compressobj(STORAGE_GZIP_LEVEL, zlib.DEFLATED, 31)
+
+
+def _decompressor(encoding):
+    if encoding == 'zstd':
+        return zstandard.ZstdDecompressor().decompressobj()
+    return zlib.decompressobj(31)
+
+
+def is_stored_encoding(encoding):
+    return encoding == 'gzip' or (encoding == 'zstd' and zstandard is not None)
+
+
+def encode_stream(stream, encoding):
+    """Compress a seekable stream into a spooled temporary file, rewound"""
+    compressor = _compressor(encoding)
+    encoded = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    stream.seek(0)
+    while True:
+        chunk = stream.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        encoded.write(compressor.compress(chunk))
+    encoded.write(compressor.flush())
+    encoded.seek(0)
+    return encoded
+
+
+def decode_chunks(chunks, encoding):
+    """Decompress an iterable of stored chunks incrementally"""
+    decompressor = _decompressor(encoding)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    if encoding != 'zstd':
+        data = decompressor.flush()
+        if data:
+            yield data
+
+
+def object_chunks(stored):
+    """Yield an opened object's original bytes, decoding stored compression"""
+    try:
+        chunks = stored.iter_chunks(CHUNK_SIZE)
+        if is_stored_encoding(stored.content_encoding):
+            chunks = decode_chunks(chunks, stored.content_encoding)
+        yield from chunks
+    finally:
+        stored.close()
+
+
+def send_stored_object(stored, download_name, content_type=None):
+    """Send an opened object as an attachment, as content_type if given.
+
+    Compressed objects are passed through with their Content-Encoding when
+    the client accepts it, and decompressed as they stream otherwise.
+    """
+    if content_type:
+        # Every get opens its own StoredObject, cached or not
+        stored.content_type = content_type
+    encoding = stored.content_encoding
+    if not is_stored_encoding(encoding):
+        return storage.send(stored, download_name)
+
+    if request.accept_encodings.best_match([encoding]):
+        response = storage.send(stored, download_name)
+        response.headers['Content-Encoding'] = encoding
+    else:
+        response = Response(object_chunks(stored), mimetype=stored.content_type, direct_passthrough=True)
+        response.headers.set('Content-Disposition', 'attachment', **filename_options(download_name))
+        response.content_length = stored.original_size
+    response.vary.add('Accept-Encoding')
+    return response
@@ -0,0 +1,263 @@
+"""
+Object counts and bytes per storage directory, for GET /storage/summary.
+
+storage_prefixes holds one row per directory (the key up to its last '/')
+with the number and total size of the objects directly in it. Writes don't
+update it in place: every path that adds or removes objects appends its
+change to storage_prefix_changes with record_objects() in the same
+transaction, so concurrent uploads never wait on a shared row. Every
+STORAGE_SUMMARY_FOLD_INTERVAL seconds fold_changes() adds the pending
+changes into storage_prefixes, and summarize() reads both, so a summary is
+current as soon as the write commits and costs one query over the
+directories under the prefix, however many objects they hold.
+
+Blobs count from the insert of their blobs row to its deletion by the
+reaper; other objects from the user_files or user_logos row that records
+them to its deletion (record_released() in services/blobs.py). Sizes are
+content sizes, as in services/usage.py, so compressed blobs count their
+original size. The counters start from the database
+(seed_prefixes()), and reconcile_prefixes() recounts them from a full walk
+of the bucket every STORAGE_SUMMARY_RECONCILE_INTERVAL seconds, in one
+process at a time, to repair drift: objects written outside the app, or
+legacy uploads whose rows name their object without its directory.
+"""
+
+import os
+import threading
+import time
+from psycopg2.extras import execute_values
+from dotenv import load_dotenv
+from services.database import cursor, conn, release_connection
+from services.storage import storage
+
+# Load environment variables
+load_dotenv()
+
+# Seconds between folds of pending changes into the counters; 0 disables
+# them, and summaries add up every change recorded since
+STORAGE_SUMMARY_FOLD_INTERVAL = float(os.getenv('STORAGE_SUMMARY_FOLD_INTERVAL', '10'))
+# Seconds between full recounts from the bucket listing, the first after one
+# interval; 0 disables them
+STORAGE_SUMMARY_RECONCILE_INTERVAL = int(os.getenv('STORAGE_SUMMARY_RECONCILE_INTERVAL', '86400'))
+FOLD_BATCH = 10000
+# Listed keys whose blob sizes are looked up at a time
+RECONCILE_PAGE = 1000
+# pg advisory lock keys: one seeding and one reconciling process at a time
+SEED_LOCK_ID = 0x73756d73
+RECONCILE_LOCK_ID = 0x73756d72
+
+
+def directory_of(s3_key):
+    return s3_key[:s3_key.rfind('/') + 1]
+
+
+def record_objects(objects, removed=False):
+    """Add (or take away) (s3_key, size) objects in the caller's transaction"""
+    changes = {}
+    for s3_key, size in objects:
+        counts = changes.setdefault(directory_of(s3_key), [0, 0])
+        counts[0] += 1
+        counts[1] += size or 0
+    if changes:
+        sign = -1 if removed else 1
+        execute_values(
+            cursor,
+            "INSERT INTO storage_prefix_changes (prefix, objects, bytes) VALUES %s",
+            [(prefix, sign * objects, sign * size) for prefix, (objects, size) in sorted(changes.items())]
+        )
+
+
+def fold_changes():
+    """Add pending changes into the counters; returns how many directories were updated.
+
+    Batches are claimed with SKIP LOCKED, so every process can fold at once.
+    """
+    folded = 0
+    while True:
+        # Sorted so concurrent folds lock the counters in the same order
+        cursor.execute(
+            """WITH folded AS (
+                   DELETE FROM storage_prefix_changes WHERE id IN (
+                       SELECT id FROM storage_prefix_changes ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED)
+                   RETURNING prefix, objects, bytes)
+               INSERT INTO storage_prefixes (prefix, objects, bytes)
+               SELECT prefix, sum(objects), sum(bytes) FROM folded GROUP BY prefix ORDER BY prefix
+               ON CONFLICT (prefix) DO UPDATE SET objects = storage_prefixes.objects + EXCLUDED.objects,
+                   bytes = storage_prefixes.bytes + EXCLUDED.bytes""",
+            (FOLD_BATCH,)
+        )
+        updated = cursor.rowcount
+        conn.commit()
+        if not updated:
+            return folded
+        folded += updated
+
+
+def summarize(prefixes, depth):
+    """Object count and bytes under each of prefixes, grouped depth directory levels below it.
+
+    Each prefix is '' or ends with '/', and none is under another. Objects
+    above the requested depth count towards their own directory.
+    """
+    groups = {}
+    total_objects = total_bytes = 0
+    for prefix in prefixes:
+        pattern = prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+        cursor.execute(
+            """SELECT prefix, sum(objects)::bigint AS objects, sum(bytes)::bigint AS bytes FROM (
+                   SELECT prefix, objects, bytes FROM storage_prefixes WHERE prefix LIKE %s
+                   UNION ALL
+                   SELECT prefix, objects, bytes FROM storage_prefix_changes WHERE prefix LIKE %s) AS counts
+               GROUP BY prefix""",
+            (pattern, pattern)
+        )
+        for row in cursor.fetchall():
+            if not row['objects']:
+                continue
+            directories = row['prefix'][len(prefix):].split('/')[:-1]
+            group = prefix + ''.join(f"{name}/" for name in directories[:depth])
+            counts = groups.setdefault(group, [0, 0])
+            counts[0] += row['objects']
+            counts[1] += row['bytes']
+            total_objects += row['objects']
+            total_bytes += row['bytes']
+    return {
+        "objects": total_objects,
+        "bytes": total_bytes,
+        "prefixes": [{"prefix": group, "objects": objects, "bytes": size}
+                     for group, (objects, size) in sorted(groups.items())]
+    }
+
+
+def seed_prefixes():
+    """Count every recorded object into the counters if nothing has been counted yet; returns the directories added"""
+    cursor.execute("SELECT pg_advisory_xact_lock(%s)", (SEED_LOCK_ID,))
+    # Legacy uploads (apis/upload.py) store their key without the user's
+    # directory the object is under. Blob keys are the ones is_blob_key()
+    # matches in services/blobs.py
+    cursor.execute(
+        """INSERT INTO storage_prefixes (prefix, objects, bytes)
+           SELECT COALESCE(substring(s3_key FROM '^.*/'), ''), count(*), COALESCE(sum(size), 0) FROM (
+               SELECT s3_key, size FROM blobs
+               UNION ALL
+               SELECT CASE WHEN position('/' IN s3_key) > 0 THEN s3_key ELSE 'user_' || user_id || '/' || s3_key END,
+                      file_size
+               FROM user_files WHERE s3_key !~ '^(user_[0-9]+/)?blobs/'
+               UNION ALL
+               SELECT s3_key, file_size FROM user_logos WHERE s3_key !~ '^logos/(user[0-9]+/)?blobs/') AS objects
+           WHERE NOT EXISTS (SELECT 1 FROM storage_prefixes) AND NOT EXISTS (SELECT 1 FROM storage_prefix_changes)
+           GROUP BY 1"""
+    )
+    seeded = cursor.rowcount
+    conn.commit()
+    return seeded
+
+
+def content_sizes(items):
+    """Content sizes of listed objects by key.
+
+    Only blobs are stored compressed, so the others are their listed size;
+    blobs are looked up in one query per call.
+    """
+    cursor.execute("SELECT s3_key, size FROM blobs WHERE s3_key = ANY(%s)", ([item['key'] for item in items],))
+    sizes = {row['s3_key']: row['size'] for row in cursor.fetchall()}
+    conn.commit()
+    return {item['key']: sizes.get(item['key'], item['size']) for item in items}
+
+
+def _count_page(items, counts):
+    """Add listed objects to counts at their content size"""
+    sizes = content_sizes(items)
+    for item in items:
+        directory = counts.setdefault(directory_of(item['key']), [0, 0])
+        directory[0] += 1
+        directory[1] += sizes[item['key']]
+
+
+def reconcile_prefixes():
+    """Recount the counters from the bucket listing; returns how many directories were corrected.
+
+    Changes recorded before the walk started are replaced by it; later
+    ones stay pending on top, so objects written while it runs may be off
+    until the next run. Returns None if another process is already
+    reconciling.
+    """
+    cursor.execute("SELECT pg_try_advisory_lock(%s) AS locked", (RECONCILE_LOCK_ID,))
+    locked = cursor.fetchone()['locked']
+    conn.commit()
+    if not locked:
+        return None
+    try:
+        cursor.execute("SELECT COALESCE(max(id), 0) AS last_id FROM storage_prefix_changes")
+        last_id = cursor.fetchone()['last_id']
+        conn.commit()
+        counts = {}
+        page = []
+        for item in storage.list(''):
+            page.append(item)
+            if len(page) == RECONCILE_PAGE:
+                _count_page(page, counts)
+                page = []
+        if page:
+            _count_page(page, counts)
+
+        # Same order as fold_changes(): the changes, then the counters. Folds
+        # wait until the counters are replaced; summaries keep reading
+        cursor.execute("DELETE FROM storage_prefix_changes WHERE id <= %s", (last_id,))
+        cursor.execute("LOCK TABLE storage_prefixes IN EXCLUSIVE MODE")
+        cursor.execute("SELECT prefix, objects, bytes FROM storage_prefixes")
+        current = {row['prefix']: [row['objects'], row['bytes']] for row in cursor.fetchall()}
+        changed = [(prefix, objects, size) for prefix, (objects, size) in sorted(counts.items())
+                   if current.get(prefix) != [objects, size]]
+        # Directories emptied since are dropped too, but weren't wrong
+        gone = sorted(prefix for prefix in current if prefix not in counts)
+        emptied = sum(1 for prefix in gone if current[prefix] == [0, 0])
+        if changed:
+            execute_values(
+                cursor,
+                """INSERT INTO storage_prefixes (prefix, objects, bytes) VALUES %s
+                   ON CONFLICT (prefix) DO UPDATE SET objects = EXCLUDED.objects, bytes = EXCLUDED.bytes""",
+                changed
+            )
+        if gone:
+            cursor.execute("DELETE FROM storage_prefixes WHERE prefix = ANY(%s)", (gone,))
+        conn.commit()
+        return len(changed) + len(gone) - emptied
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (RECONCILE_LOCK_ID,))
+        conn.commit()
+
+
+def _summary_loop(fold_interval, reconcile_interval):
+    next_reconcile = time.monotonic() + reconcile_interval
+    while True:
+        time.sleep(fold_interval or reconcile_interval)
+        try:
+            if fold_interval > 0:
+                fold_changes()
+            if reconcile_interval > 0 and time.monotonic() >= next_reconcile:
+                next_reconcile = time.monotonic() + reconcile_interval
+                corrected = reconcile_prefixes()
+                if corrected:
+                    print(f"🧮 Reconciled storage summary for {corrected} directories")
+        except Exception as e:
+            print(f"❌ Storage summary maintenance failed: {e}")
+        finally:
+            release_connection()
+
+
+def init_storage_summary(app):
+    """Seed the per-directory counters and start folding and reconciling them"""
+    try:
+        seeded = seed_prefixes()
+        if seeded:
+            print(f"🧮 Seeded storage summary with {seeded} directories")
+    finally:
+        release_connection()
+    if STORAGE_SUMMARY_FOLD_INTERVAL > 0 or STORAGE_SUMMARY_RECONCILE_INTERVAL > 0:
+        threading.Thread(target=_summary_loop,
+                         args=(STORAGE_SUMMARY_FOLD_INTERVAL, STORAGE_SUMMARY_RECONCILE_INTERVAL),
+                         name='storage-summary', daemon=True).start()
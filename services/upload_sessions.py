@@ -0,0 +1,131 @@
+"""
+Resumable upload sessions.
+
+A session maps one multipart upload to a row in upload_sessions; every
+chunk accepted so far is a row in upload_session_parts with its size,
+SHA-256 and the part's ETag. Clients that lose their connection
+ask for the session's state and re-send only the missing chunks.
+
+/complete moves a session to completing while it assembles the object and
+records the file. A session left completing for UPLOAD_COMPLETE_LEASE
+seconds (the request failed to hand it back, or its process died) can be
+completed or aborted again, and the collector returns it to open.
+
+Sessions nobody touches for UPLOAD_SESSION_TTL seconds are garbage collected
+by a background thread: unfinished ones are aborted with
+AbortMultipartUpload, and their object deleted in case it was assembled but
+never recorded, so S3 stops storing (and billing for) them; finished ones are
+forgotten. The same thread sweeps up content blobs whose last reference
+went without being reaped (see services/blobs.py). Several app processes may
+run the collector at once; each claims rows with SKIP LOCKED.
+"""
+
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from services.database import cursor, conn, release_connection
+from services.storage import storage
+from services.blobs import reap_blobs
+from services.listing_versions import bump_storage_version
+
+# Load environment variables
+load_dotenv()
+
+# S3 rejects multipart parts below 5 MiB (except the last) and above 10000 parts
+S3_MIN_PART_SIZE = 5 * 1024 * 1024
+S3_MAX_PARTS = 10000
+
+UPLOAD_CHUNK_SIZE = max(int(os.getenv('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024))), S3_MIN_PART_SIZE)
+UPLOAD_MAX_CHUNK_SIZE = int(os.getenv('UPLOAD_MAX_CHUNK_SIZE', str(64 * 1024 * 1024)))
+UPLOAD_MAX_SIZE = int(os.getenv('UPLOAD_MAX_SIZE', str(5 * 1024 ** 3)))
+UPLOAD_SESSION_TTL = int(os.getenv('UPLOAD_SESSION_TTL', str(24 * 3600)))
+# Seconds a /complete may keep a session completing before others can take it over
+UPLOAD_COMPLETE_LEASE = int(os.getenv('UPLOAD_COMPLETE_LEASE', '300'))
+# Seconds between garbage collection runs; 0 disables the background collector
+UPLOAD_GC_INTERVAL = int(os.getenv('UPLOAD_GC_INTERVAL', '900'))
+UPLOAD_GC_BATCH = 100
+
+OPEN = 'open'
+COMPLETING = 'completing'
+COMPLETED = 'completed'
+
+
+def choose_chunk_size(total_size, requested=None):
+    """Chunk size for a session: the client's choice within S3's limits"""
+    chunk_size = min(max(requested or UPLOAD_CHUNK_SIZE, S3_MIN_PART_SIZE), UPLOAD_MAX_CHUNK_SIZE)
+    # Large files get bigger chunks rather than more than S3_MAX_PARTS parts
+    return max(chunk_size, -(-total_size // S3_MAX_PARTS))
+
+
+def part_count(total_size, chunk_size):
+    return max(1, -(-total_size // chunk_size))
+
+
+def expected_part_size(session, part_number):
+    """Size of a part; every chunk is chunk_size except the last"""
+    offset = (part_number - 1) * session['chunk_size']
+    return min(session['chunk_size'], session['total_size'] - offset)
+
+
+def lease_cutoff():
+    """Sessions completing since before this have lost their lease"""
+    return datetime.utcnow() - timedelta(seconds=UPLOAD_COMPLETE_LEASE)
+
+
+def discard_upload(session):
+    """Abort a session's multipart upload and delete the object if it was already assembled"""
+    storage.abort_multipart_upload(session['s3_key'], session['s3_upload_id'])
+    storage.delete([session['s3_key']])
+    bump_storage_version()
+
+
+def collect_abandoned_uploads(ttl=None):
+    """Reopen stalled completions, then abort and delete sessions idle for longer than ttl seconds; returns how many were deleted"""
+    cursor.execute(
+        "UPDATE upload_sessions SET status = %s WHERE status = %s AND updated_at < %s",
+        (OPEN, COMPLETING, lease_cutoff())
+    )
+    conn.commit()
+    cutoff = datetime.utcnow() - timedelta(seconds=UPLOAD_SESSION_TTL if ttl is None else ttl)
+    collected = 0
+    while True:
+        cursor.execute(
+            "SELECT id, s3_key, s3_upload_id, status FROM upload_sessions WHERE updated_at < %s ORDER BY updated_at LIMIT %s FOR UPDATE SKIP LOCKED",
+            (cutoff, UPLOAD_GC_BATCH)
+        )
+        sessions = cursor.fetchall()
+        if not sessions:
+            conn.commit()
+            return collected
+        for session in sessions:
+            if session['status'] != COMPLETED:
+                discard_upload(session)
+        cursor.execute("DELETE FROM upload_sessions WHERE id = ANY(%s)",
+                       ([session['id'] for session in sessions],))
+        conn.commit()
+        collected += len(sessions)
+
+
+def _gc_loop(interval):
+    while True:
+        time.sleep(interval)
+        try:
+            collected = collect_abandoned_uploads()
+            if collected:
+                print(f"🧹 Garbage collected {collected} abandoned upload sessions")
+            reaped = reap_blobs()
+            if reaped:
+                print(f"🧹 Deleted {reaped} unreferenced blobs")
+        except Exception as e:
+            print(f"❌ Upload session garbage collection failed: {e}")
+        finally:
+            release_connection()
+
+
+def init_upload_sessions(app):
+    """Start the background garbage collector for abandoned upload sessions"""
+    if UPLOAD_GC_INTERVAL > 0:
+        threading.Thread(target=_gc_loop, args=(UPLOAD_GC_INTERVAL,),
+                         name='upload-gc', daemon=True).start()
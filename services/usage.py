@@ -0,0 +1,169 @@
+"""
+Per-user storage usage and quotas.
+
+storage_usage holds one row per user with the number and total size of
+their files and logos. Every insert or delete of a user_files/user_logos
+row adjusts it with record_usage() in the same transaction, so reading a
+user's usage is a primary-key lookup instead of a sum over their rows.
+Sizes are the logical size of each row: content shared through blob
+deduplication counts once per row that references it.
+
+Uploads are checked against STORAGE_QUOTA_BYTES with check_quota() as soon
+as their size is known, before anything is sent to storage. That check
+reads without locking, so record_usage() checks again as it adds the
+bytes; two uploads racing past the first check roll back the second one,
+whose object the outbox cleans up.
+
+reconcile_usage() recomputes the rows from user_files and user_logos in
+batches of users, to repair drift (rows written before this existed, or by
+hand). It runs every USAGE_RECONCILE_INTERVAL seconds, in one process at a
+time.
+"""
+
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from services.database import cursor, conn, release_connection, prepared
+
+# Load environment variables
+load_dotenv()
+
+# Bytes a user may store across files and logos; 0 means unlimited
+STORAGE_QUOTA_BYTES = int(os.getenv('STORAGE_QUOTA_BYTES', '0'))
+# Seconds between reconciliation runs, the first shortly after start; 0 disables them
+USAGE_RECONCILE_INTERVAL = int(os.getenv('USAGE_RECONCILE_INTERVAL', '86400'))
+USAGE_RECONCILE_BATCH = 1000
+# pg_try_advisory_lock key that keeps reconciliation to one process
+RECONCILE_LOCK_ID = 0x75736167
+RECONCILE_START_DELAY = 60
+
+
+class QuotaExceeded(Exception):
+    """An upload would take its user past their storage quota"""
+
+    def __init__(self, used, incoming, quota):
+        super().__init__(f"Storage quota exceeded: {used} of {quota} bytes used, "
+                         f"upload needs {incoming} more")
+
+
+def get_usage(user_id):
+    """A user's usage row, zeroes if they never stored anything"""
+    cursor.execute(
+        prepared("SELECT files_count, files_bytes, logos_count, logos_bytes, updated_at FROM storage_usage WHERE user_id = %s"),
+        (user_id,)
+    )
+    return cursor.fetchone() or {
+        'files_count': 0, 'files_bytes': 0, 'logos_count': 0, 'logos_bytes': 0, 'updated_at': None}
+
+
+def check_quota(user_id, incoming_bytes):
+    """Raise QuotaExceeded if storing incoming_bytes more would pass the quota"""
+    if STORAGE_QUOTA_BYTES <= 0:
+        return
+    usage = get_usage(user_id)
+    used = usage['files_bytes'] + usage['logos_bytes']
+    if used + incoming_bytes > STORAGE_QUOTA_BYTES:
+        raise QuotaExceeded(used, incoming_bytes, STORAGE_QUOTA_BYTES)
+
+
+def record_usage(user_id, files=0, files_bytes=0, logos=0, logos_bytes=0):
+    """Add rows and bytes (negative to remove) to a user's usage in the caller's transaction.
+
+    Raises QuotaExceeded, leaving the caller to roll back, when an addition
+    takes the user past the quota.
+    """
+    cursor.execute(
+        prepared("""INSERT INTO storage_usage (user_id, files_count, files_bytes, logos_count, logos_bytes)
+           VALUES (%s, %s, %s, %s, %s)
+           ON CONFLICT (user_id) DO UPDATE SET
+               files_count = storage_usage.files_count + EXCLUDED.files_count,
+               files_bytes = storage_usage.files_bytes + EXCLUDED.files_bytes,
+               logos_count = storage_usage.logos_count + EXCLUDED.logos_count,
+               logos_bytes = storage_usage.logos_bytes + EXCLUDED.logos_bytes,
+               updated_at = CURRENT_TIMESTAMP
+           RETURNING files_bytes + logos_bytes AS used"""),
+        (user_id, files, files_bytes, logos, logos_bytes)
+    )
+    used = cursor.fetchone()['used']
+    added = files_bytes + logos_bytes
+    if added > 0 and 0 < STORAGE_QUOTA_BYTES < used:
+        raise QuotaExceeded(used - added, added, STORAGE_QUOTA_BYTES)
+
+
+def reconcile_usage():
+    """Recompute every user's usage from their rows; returns how many rows were corrected.
+
+    Each batch locks its users' usage rows before counting, so uploads and
+    deletes that commit meanwhile are neither lost nor counted twice.
+    Returns None if another process is already reconciling.
+    """
+    cursor.execute("SELECT pg_try_advisory_lock(%s) AS locked", (RECONCILE_LOCK_ID,))
+    locked = cursor.fetchone()['locked']
+    conn.commit()
+    if not locked:
+        return None
+    corrected = 0
+    last_id = 0
+    try:
+        while True:
+            cursor.execute(
+                "SELECT id FROM users WHERE id > %s ORDER BY id LIMIT %s",
+                (last_id, USAGE_RECONCILE_BATCH)
+            )
+            user_ids = [row['id'] for row in cursor.fetchall()]
+            if not user_ids:
+                conn.commit()
+                return corrected
+            cursor.execute(
+                "INSERT INTO storage_usage (user_id) SELECT unnest(%s::int[]) ON CONFLICT (user_id) DO NOTHING",
+                (user_ids,)
+            )
+            cursor.execute(
+                "SELECT user_id FROM storage_usage WHERE user_id = ANY(%s) ORDER BY user_id FOR UPDATE",
+                (user_ids,)
+            )
+            cursor.execute(
+                """UPDATE storage_usage AS s SET files_count = t.files_count, files_bytes = t.files_bytes,
+                       logos_count = t.logos_count, logos_bytes = t.logos_bytes, updated_at = CURRENT_TIMESTAMP
+                   FROM (SELECT u.id AS user_id, f.files_count, f.files_bytes, l.logos_count, l.logos_bytes
+                         FROM unnest(%s::int[]) AS u(id)
+                         CROSS JOIN LATERAL (SELECT count(*) AS files_count, COALESCE(sum(file_size), 0) AS files_bytes
+                                             FROM user_files WHERE user_id = u.id) f
+                         CROSS JOIN LATERAL (SELECT count(*) AS logos_count, COALESCE(sum(file_size), 0) AS logos_bytes
+                                             FROM user_logos WHERE user_id = u.id) l) AS t
+                   WHERE s.user_id = t.user_id
+                     AND (s.files_count, s.files_bytes, s.logos_count, s.logos_bytes)
+                         IS DISTINCT FROM (t.files_count, t.files_bytes, t.logos_count, t.logos_bytes)""",
+                (user_ids,)
+            )
+            corrected += cursor.rowcount
+            conn.commit()
+            last_id = user_ids[-1]
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        cursor.execute("SELECT pg_advisory_unlock(%s)", (RECONCILE_LOCK_ID,))
+        conn.commit()
+
+
+def _reconcile_loop(interval):
+    time.sleep(min(interval, RECONCILE_START_DELAY))
+    while True:
+        try:
+            corrected = reconcile_usage()
+            if corrected:
+                print(f"🧮 Reconciled storage usage for {corrected} users")
+        except Exception as e:
+            print(f"❌ Storage usage reconciliation failed: {e}")
+        finally:
+            release_connection()
+        time.sleep(interval)
+
+
+def init_storage_usage(app):
+    """Start the periodic usage reconciliation"""
+    if USAGE_RECONCILE_INTERVAL > 0:
+        threading.Thread(target=_reconcile_loop, args=(USAGE_RECONCILE_INTERVAL,),
+                         name='usage-reconcile', daemon=True).start()
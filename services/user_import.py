@@ -0,0 +1,188 @@
+"""
+Bulk user import.
+
+Rows are read from CSV (header: name, email, password) or NDJSON as they
+stream in, validated, and loaded with COPY into the user_import_rows
+staging table in chunks of IMPORT_COPY_CHUNK. One set-based upsert then
+moves them into users, and the staging rows are deleted, all in one
+transaction: either every valid row is applied or none is.
+
+Rows with a missing name, an invalid email or an email repeated earlier in
+the same file are reported with their line number and left out. Emails that
+already belong to a user are skipped, or with on_conflict='update' get the
+imported name (and password, when one is given).
+
+Passwords are hashed the way /auth/register does while the rows are read.
+That is a single SHA-256, about a microsecond each, so it is done inline:
+handing it to a worker pool would cost more than the hash.
+
+Run from the command line with:
+    python -m services.user_import users.csv [--on-conflict update]
+"""
+
+import argparse
+import csv
+import io
+import json
+import os
+import sys
+import uuid
+from dotenv import load_dotenv
+from services.database import cursor, conn
+from services.listing_versions import USERS, bump_listing_version
+from utils.auth import hash_password
+from utils.validators import validate_email
+
+# Load environment variables
+load_dotenv()
+
+# Rows per COPY into the staging table
+IMPORT_COPY_CHUNK = int(os.getenv('IMPORT_COPY_CHUNK', '10000'))
+# Row errors listed in a report; the count covers all of them
+IMPORT_MAX_REPORTED_ERRORS = int(os.getenv('IMPORT_MAX_REPORTED_ERRORS', '1000'))
+
+CSV = 'csv'
+NDJSON = 'ndjson'
+ON_CONFLICT = ('skip', 'update')
+
+
+def _read_rows(stream, import_format):
+    """Yield (line, record or None, error) for each row of a binary stream"""
+    # utf-8-sig drops the byte order mark spreadsheets put before a CSV
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', errors='replace', newline='')
+    try:
+        if import_format == CSV:
+            reader = csv.DictReader(text)
+            for record in reader:
+                # Physical line the record ends on, counting the header
+                yield reader.line_num, record, None
+            return
+        for line, raw in enumerate(text, start=1):
+            if not raw.strip():
+                continue
+            try:
+                record = json.loads(raw)
+            except ValueError as e:
+                yield line, None, f"Invalid JSON: {e}"
+                continue
+            if not isinstance(record, dict):
+                yield line, None, "Expected a JSON object"
+                continue
+            yield line, record, None
+    finally:
+        # Leave the caller's stream open
+        text.detach()
+
+
+def _copy_field(value):
+    if value is None:
+        return '\\N'
+    return (value.replace('\\', '\\\\').replace('\t', '\\t')
+            .replace('\n', '\\n').replace('\r', '\\r'))
+
+
+def _copy(buffer):
+    buffer.seek(0)
+    cursor.copy_expert(
+        "COPY user_import_rows (import_id, line, name, email, password_hash) FROM STDIN", buffer)
+    buffer.seek(0)
+    buffer.truncate()
+
+
+def import_users(stream, import_format=CSV, on_conflict='skip'):
+    """Import users from a CSV or NDJSON byte stream; returns a report dict.
+
+    Commits on success and rolls back (re-raising) on database errors.
+    """
+    import_id = uuid.uuid4().hex
+    errors = []
+    error_count = 0
+    seen = {}
+    buffer = io.StringIO()
+    staged = 0
+    try:
+        for line, record, error in _read_rows(stream, import_format):
+            if record is not None:
+                name = str(record.get('name') or '').strip()
+                email = str(record.get('email') or '').strip()
+                password = record.get('password')
+                if not name:
+                    error = "name is required"
+                elif '\x00' in name:
+                    # PostgreSQL text can't hold it
+                    error = "name contains a NUL character"
+                elif not validate_email(email):
+                    error = f"Invalid email '{email}'"
+                elif email in seen:
+                    error = f"email repeats line {seen[email]}"
+            if error:
+                error_count += 1
+                if len(errors) < IMPORT_MAX_REPORTED_ERRORS:
+                    errors.append({"line": line, "error": error})
+                continue
+            seen[email] = line
+            password_hash = hash_password(str(password)) if password else None
+            buffer.write('\t'.join((import_id, str(line), _copy_field(name), _copy_field(email),
+                                    _copy_field(password_hash))) + '\n')
+            staged += 1
+            if staged % IMPORT_COPY_CHUNK == 0:
+                _copy(buffer)
+        _copy(buffer)
+
+        if on_conflict == 'update':
+            cursor.execute(
+                """INSERT INTO users (name, email, password_hash)
+                   SELECT name, email, password_hash FROM user_import_rows WHERE import_id = %s ORDER BY line
+                   ON CONFLICT (email) DO UPDATE SET name = EXCLUDED.name,
+                       password_hash = COALESCE(EXCLUDED.password_hash, users.password_hash)
+                   RETURNING (xmax = 0) AS created""",
+                (import_id,)
+            )
+        else:
+            cursor.execute(
+                """INSERT INTO users (name, email, password_hash)
+                   SELECT name, email, password_hash FROM user_import_rows WHERE import_id = %s ORDER BY line
+                   ON CONFLICT (email) DO NOTHING
+                   RETURNING true AS created""",
+                (import_id,)
+            )
+        written = cursor.fetchall()
+        created = sum(1 for row in written if row['created'])
+        cursor.execute("DELETE FROM user_import_rows WHERE import_id = %s", (import_id,))
+        if written:
+            bump_listing_version(USERS)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+
+    return {
+        "rows": staged + error_count,
+        "created": created,
+        "updated": len(written) - created,
+        "skipped": staged - len(written),
+        "failed": error_count,
+        "errors": errors
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import users from a CSV or NDJSON file")
+    parser.add_argument('path', help="File to import, or - for standard input")
+    parser.add_argument('--format', choices=(CSV, NDJSON),
+                        help="Defaults to ndjson for .ndjson/.jsonl files, csv otherwise")
+    parser.add_argument('--on-conflict', choices=ON_CONFLICT, default='skip')
+    args = parser.parse_args()
+
+    import_format = args.format or (NDJSON if args.path.endswith(('.ndjson', '.jsonl')) else CSV)
+    if args.path == '-':
+        report = import_users(sys.stdin.buffer, import_format, args.on_conflict)
+    else:
+        with open(args.path, 'rb') as stream:
+            report = import_users(stream, import_format, args.on_conflict)
+    print(json.dumps(report, indent=2))
+    return 1 if report['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
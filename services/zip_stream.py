@@ -0,0 +1,220 @@
+"""
+Streaming ZIP archives.
+
+Builds stored (uncompressed) ZIP archives on the fly from members whose sizes
+are known up front. Nothing is compressed and each CRC goes in a data
+descriptor after its member, so every byte offset, and therefore the total
+length, is known before the first byte is sent. The same members always
+produce byte-identical output, which lets an archive be served with a
+Content-Length and resumed with Range: a resumed request regenerates the
+stream and skips the bytes the client already has.
+
+Invoices are PDFs and images that are already compressed, so storing them
+costs little space and no CPU. ZIP64 records are only written for members
+or offsets past 4 GiB, so ordinary archives open in every unzip tool.
+"""
+
+import os
+import struct
+import zlib
+from collections import namedtuple
+
+# name: str, size: int, modified: datetime or None
+ZipMember = namedtuple('ZipMember', ['name', 'size', 'modified'])
+
+ZIP32_LIMIT = 0xFFFFFFFF
+ENTRY_LIMIT = 0xFFFF
+# Bit 3: sizes and CRC follow the data; bit 11: names are UTF-8
+FLAGS = 0x0808
+VERSION = 20
+VERSION_ZIP64 = 45
+VERSION_MADE_BY = (3 << 8) | VERSION_ZIP64  # Unix
+EXTERNAL_ATTR = 0o100644 << 16
+
+LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+DESCRIPTOR = struct.Struct('<IIII')
+DESCRIPTOR_ZIP64 = struct.Struct('<IIQQ')
+CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+END_RECORD = struct.Struct('<IHHHHIIH')
+END_RECORD_ZIP64 = struct.Struct('<IQHHIIQQQQ')
+END_LOCATOR_ZIP64 = struct.Struct('<IIQI')
+
+
+def _dos_datetime(modified):
+    if modified is None or modified.year < 1980:
+        return 0, (1 << 5) | 1  # 1980-01-01 00:00
+    year = min(modified.year, 2107)
+    time = (modified.hour << 11) | (modified.minute << 5) | (modified.second // 2)
+    date = ((year - 1980) << 9) | (modified.month << 5) | modified.day
+    return time, date
+
+
+def unique_member_names(filenames):
+    """Flatten filenames and suffix duplicates ("a.pdf", "a (2).pdf") in order"""
+    seen = set()
+    names = []
+    for filename in filenames:
+        name = (filename or '').replace('/', '_').replace('\\', '_').strip() or 'file'
+        candidate = name
+        stem, ext = os.path.splitext(name)
+        copy = 2
+        while candidate.lower() in seen:
+            candidate = f"{stem} ({copy}){ext}"
+            copy += 1
+        seen.add(candidate.lower())
+        names.append(candidate)
+    return names
+
+
+class _Entry:
+    __slots__ = ('name', 'size', 'time', 'date', 'offset', 'zip64')
+
+    def __init__(self, member, offset):
+        self.name = member.name.encode('utf-8')
+        self.size = member.size
+        self.time, self.date = _dos_datetime(member.modified)
+        self.offset = offset
+        self.zip64 = member.size >= ZIP32_LIMIT
+
+    def local_header(self):
+        extra = struct.pack('<HHQQ', 1, 16, 0, 0) if self.zip64 else b''
+        size = ZIP32_LIMIT if self.zip64 else 0
+        return LOCAL_HEADER.pack(
+            0x04034b50, VERSION_ZIP64 if self.zip64 else VERSION, FLAGS, 0,
+            self.time, self.date, 0, size, size, len(self.name), len(extra)
+        ) + self.name + extra
+
+    def descriptor(self, crc):
+        if self.zip64:
+            return DESCRIPTOR_ZIP64.pack(0x08074b50, crc, self.size, self.size)
+        return DESCRIPTOR.pack(0x08074b50, crc, self.size, self.size)
+
+    def _central_extra(self):
+        fields = []
+        if self.size >= ZIP32_LIMIT:
+            fields += [self.size, self.size]
+        if self.offset >= ZIP32_LIMIT:
+            fields.append(self.offset)
+        if not fields:
+            return b''
+        return struct.pack(f'<HH{len(fields)}Q', 1, 8 * len(fields), *fields)
+
+    def central_header(self, crc):
+        extra = self._central_extra()
+        zip64 = bool(extra) or self.zip64
+        size = min(self.size, ZIP32_LIMIT)
+        return CENTRAL_HEADER.pack(
+            0x02014b50, VERSION_MADE_BY, VERSION_ZIP64 if zip64 else VERSION, FLAGS, 0,
+            self.time, self.date, crc, size, size, len(self.name), len(extra), 0, 0, 0,
+            EXTERNAL_ATTR, min(self.offset, ZIP32_LIMIT)
+        ) + self.name + extra
+
+    def local_length(self):
+        return LOCAL_HEADER.size + len(self.name) + (20 if self.zip64 else 0)
+
+    def descriptor_length(self):
+        return DESCRIPTOR_ZIP64.size if self.zip64 else DESCRIPTOR.size
+
+    def central_length(self):
+        return CENTRAL_HEADER.size + len(self.name) + len(self._central_extra())
+
+
+class ZipStream:
+    """A stored ZIP archive laid out from ZipMembers, generated on demand"""
+
+    def __init__(self, members):
+        self.entries = []
+        offset = 0
+        for member in members:
+            entry = _Entry(member, offset)
+            self.entries.append(entry)
+            offset += entry.local_length() + entry.size + entry.descriptor_length()
+        self.central_offset = offset
+        self.central_size = sum(entry.central_length() for entry in self.entries)
+        self.zip64_end = (len(self.entries) >= ENTRY_LIMIT or self.central_offset >= ZIP32_LIMIT
+                          or self.central_size >= ZIP32_LIMIT)
+        end_length = END_RECORD.size
+        if self.zip64_end:
+            end_length += END_RECORD_ZIP64.size + END_LOCATOR_ZIP64.size
+        self.size = self.central_offset + self.central_size + end_length
+
+    def _end_records(self):
+        count = len(self.entries)
+        records = b''
+        if self.zip64_end:
+            zip64_offset = self.central_offset + self.central_size
+            records += END_RECORD_ZIP64.pack(
+                0x06064b50, END_RECORD_ZIP64.size - 12, VERSION_MADE_BY, VERSION_ZIP64,
+                0, 0, count, count, self.central_size, self.central_offset)
+            records += END_LOCATOR_ZIP64.pack(0x07064b50, 0, zip64_offset, 1)
+        return records + END_RECORD.pack(
+            0x06054b50, 0, 0, min(count, ENTRY_LIMIT), min(count, ENTRY_LIMIT),
+            min(self.central_size, ZIP32_LIMIT), min(self.central_offset, ZIP32_LIMIT), 0)
+
+    def generate(self, contents, start=0, stop=None):
+        """Yield the archive bytes in [start, stop).
+
+        contents yields, for each member in order, an iterable of its data
+        chunks. Members before start are still read because their CRCs are
+        needed for the central directory; nothing past stop is requested.
+        """
+        stop = self.size if stop is None else stop
+        position = 0
+
+        def clip(data):
+            begin, end = max(start - position, 0), min(stop - position, len(data))
+            return data[begin:end] if begin < end else b''
+
+        crcs = []
+        chunks = None
+        try:
+            for entry in self.entries:
+                if position >= stop:
+                    return
+                header = entry.local_header()
+                part = clip(header)
+                if part:
+                    yield part
+                position += len(header)
+
+                chunks = next(contents)
+                crc = 0
+                written = 0
+                for chunk in chunks:
+                    written += len(chunk)
+                    if written > entry.size:
+                        raise ValueError(f"{entry.name.decode()}: more data than the expected {entry.size} bytes")
+                    crc = zlib.crc32(chunk, crc)
+                    part = clip(chunk)
+                    if part:
+                        yield part
+                    position += len(chunk)
+                    if position >= stop:
+                        return
+                if written != entry.size:
+                    raise ValueError(f"{entry.name.decode()}: expected {entry.size} bytes, got {written}")
+
+                descriptor = entry.descriptor(crc)
+                part = clip(descriptor)
+                if part:
+                    yield part
+                position += len(descriptor)
+                crcs.append(crc)
+
+            for entry, crc in zip(self.entries, crcs):
+                if position >= stop:
+                    return
+                header = entry.central_header(crc)
+                part = clip(header)
+                if part:
+                    yield part
+                position += len(header)
+
+            part = clip(self._end_records())
+            if part:
+                yield part
+        finally:
+            for iterable in (chunks, contents):
+                close = getattr(iterable, 'close', None)
+                if close:
+                    close()
@@ -7,6 +7,7 @@ This script initializes the database and creates sample data for testing.
 import hashlib
 import os
 from services.database import cursor, conn
+from services.schema import init_database
 from services.s3 import ensure_bucket_exists
 from dotenv import load_dotenv
 
@@ -18,57 +19,7 @@ def create_tables():
     """Create the necessary database tables"""
 
     print("Creating database tables...")
-
-    # Create users table with password support
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS users (
-        id SERIAL PRIMARY KEY,
-        name TEXT NOT NULL,
-        email TEXT NOT NULL UNIQUE,
-        password_hash TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-
-    # Create user_files table
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS user_files (
-        id SERIAL PRIMARY KEY,
-        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-        filename TEXT NOT NULL,
-        s3_key TEXT NOT NULL,
-        file_size INTEGER,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-
-    # Create user_logos table for logo uploads
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS user_logos (
-        id SERIAL PRIMARY KEY,
-        user_id INTEGER REFERENCES users(id) ON DELETE CASCADE,
-        filename TEXT NOT NULL,
-        s3_key TEXT NOT NULL,
-        logo_url TEXT NOT NULL,
-        file_size INTEGER,
-        content_type TEXT,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    """)
-
-    # Create indexes for better performance
-    cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_users_email ON users(email)")
-    cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_user_files_user_id ON user_files(user_id)")
-    cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_user_files_created_at ON user_files(created_at)")
-    cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_user_logos_user_id ON user_logos(user_id)")
-    cursor.execute(
-        "CREATE INDEX IF NOT EXISTS idx_user_logos_created_at ON user_logos(created_at)")
-
-    conn.commit()
+    init_database()
     print("✅ Database tables created successfully!")
 
 
@@ -0,0 +1,24 @@
+import hashlib
+import hmac
+import os
+from flask import request
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Shared secret for operator-only endpoints; admin endpoints are disabled when unset
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+def is_admin_request():
+    """Check the X-Admin-Token header against the configured admin token"""
+    if not ADMIN_TOKEN:
+        return False
+    supplied = request.headers.get('X-Admin-Token', '')
+    return hmac.compare_digest(supplied.encode(), ADMIN_TOKEN.encode())
+
+
+def hash_password(password):
+    """Hash a password the way users.password_hash stores it"""
+    return hashlib.sha256(password.encode()).hexdigest()